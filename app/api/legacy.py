@@ -0,0 +1,153 @@
+# src/api/legacy.py
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Dict, Optional, Set
+
+from app.services.intervals import PortPool
+from app.system.commands import IPTablesError
+
+if TYPE_CHECKING:
+    from app.services.portmaster_service import PortMasterService
+
+# Longest accepted command line; the old daemon read a single 1024-byte chunk.
+MAX_LINE = 1024
+
+
+class LegacyProtocolServer:
+    """
+    Serves the line protocol of the old standalone daemon (`PORTS: 20001,20002` and `DISCONNECT:`)
+    used by the bash and PowerShell clients, on top of the shared PortMasterService.
+
+    Every connection is handled by its own task, so a slow client never blocks the others. Commands
+    may be pipelined: each line gets its response in order. The connection is closed when the client
+    closes it, sends a line that is too long, or stays silent for read_timeout seconds.
+    Legacy clients have no API key; they can use any port of the exposed range that is not part of a
+    client's sub-pool. Unlike the old daemon, no POSTROUTING MASQUERADE rule is added per forward.
+    """
+
+    def __init__(self, service: "PortMasterService", host: str, port: int, read_timeout: float):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.read_timeout = read_timeout
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+        exposed = service.config.exposed_ports
+        self._exposed_pool = PortPool([(exposed.start, exposed.stop - 1)])
+
+        # --- METRICS ---
+        self.connections_total = 0
+        self.commands_total = 0
+        self.timeouts_total = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.port > 0
+
+    async def start(self):
+        if self.enabled and self._server is None:
+            self._server = await asyncio.start_server(self._handle_connection, self.host, self.port, limit=MAX_LINE)
+            logging.info(f"Legacy protocol server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        client_ip = writer.get_extra_info("peername")[0]
+        self.connections_total += 1
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), self.read_timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts_total += 1
+                    break
+                except ValueError:  # The line exceeded MAX_LINE
+                    writer.write(b"Error: Request too long\n")
+                    break
+                if not line:
+                    break
+                request = line.decode("utf-8", errors="replace").strip()
+                if not request:
+                    continue
+                self.commands_total += 1
+                logging.info(f"Legacy request from {client_ip}: '{request}'")
+                writer.write((await self._process(client_ip, request)).encode("utf-8"))
+                await writer.drain()
+        except asyncio.CancelledError:
+            pass
+        except ConnectionError:
+            pass
+        except Exception as e:
+            logging.error(f"Critical error while handling legacy client {client_ip}: {e}", exc_info=True)
+            writer.write(f"Error: Internal server error: {e}\n".encode("utf-8"))
+        finally:
+            self._connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, asyncio.CancelledError):
+                pass
+
+    async def _process(self, client_ip: str, request: str) -> str:
+        try:
+            if request.upper().startswith("PORTS:"):
+                return await self._process_ports(client_ip, request[len("PORTS:"):])
+            if request.upper().startswith("DISCONNECT:"):
+                return await self._process_disconnect(client_ip)
+        except IPTablesError as e:
+            return f"Error: {e}\n"
+        return "Error: Unknown command\n"
+
+    async def _process_ports(self, client_ip: str, ports_str: str) -> str:
+        requested = {int(p) for p in (part.strip() for part in ports_str.split(",")) if p.isdigit()}
+
+        reserved = {port for port in requested if self.service.pool_index.owner_of(port) is not None}
+        # PORTS: replaces the IP's whole port list, but forwards an API client made from the same IP
+        # out of its sub-pool are not the legacy client's to drop.
+        kept = {
+            port for port in self.service.forwarded_ports.get(client_ip, frozenset())
+            if self.service.pool_index.owner_of(port) is not None
+        }
+        for port in reserved - kept:
+            logging.warning(f"Port {port} belongs to a client's sub-pool. Legacy request from {client_ip}.")
+        desired = (requested - reserved) | kept
+        final_ports = self.service.unchanged_ports(client_ip, desired)
+        failed: Set[int] = set()
+        if final_ports is None:
+            _, failed = await self.service.update_client_ports(client_ip, desired, self._exposed_pool)
+            final_ports = self.service.forwarded_ports.get(client_ip, frozenset())
+        failed |= reserved - final_ports
+
+        response = ""
+        if final_ports:
+            response += f"Success: Ports {','.join(map(str, sorted(final_ports)))} forwarded.\n"
+        if failed:
+            response += f"Error: Failed to forward ports {','.join(map(str, sorted(failed)))}.\n"
+        if not response:
+            response = "Ok: No new ports to forward. All previous ports for your IP were removed.\n"
+        return response
+
+    async def _process_disconnect(self, client_ip: str) -> str:
+        # Like the old daemon, the address in the command is ignored: clients only disconnect themselves.
+        if client_ip not in self.service.forwarded_ports:
+            return f"Info: No forwarded ports found for your IP {client_ip}.\n"
+        removed_count = await self.service.disconnect_client_ip(client_ip)
+        return f"Success: Disconnected. {removed_count} port rules removed for {client_ip}.\n"
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "legacy_connections_total": self.connections_total,
+            "legacy_open_connections": len(self._connections),
+            "legacy_commands_total": self.commands_total,
+            "legacy_timeouts_total": self.timeouts_total,
+        }
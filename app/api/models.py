@@ -8,18 +8,21 @@ from typing import Dict, List, Optional
 class ClientCreateRequest(BaseModel):
     """Request model for creating a new client."""
     client_id: str = Field(..., description="A unique identifier for the client, e.g., 'user-john-doe'.")
-    port_range: str = Field(..., description="The sub-pool of ports assigned to this client.", example="21000-21010")
+    port_range: str = Field(
+        ..., description="The sub-pool of ports assigned to this client: one or more comma-separated ranges. "
+                         "It must not overlap another client's sub-pool.", example="21000-21010,21500-21599")
 
 class ClientInfo(BaseModel):
     """Full information about a client, including their secret API key."""
     client_id: str
-    api_key: str = Field(..., description="The auto-generated API key for this client. Treat this as a secret!")
-    allowed_ports: List[int]
+    api_key: str = Field(..., description="The auto-generated API key for this client. It is only shown once, "
+                                          "when the client is created; the server keeps just its hash. Treat this as a secret!")
+    allowed_port_ranges: List[str] = Field(..., example=["21000-21010"])
 
 class ClientInfoPublic(BaseModel):
     """Publicly viewable information about a client (excludes API key)."""
     client_id: str
-    allowed_ports: List[int]
+    allowed_port_ranges: List[str]
 
 # --- User-facing Models ---
 
@@ -27,6 +30,28 @@ class PortForwardRequest(BaseModel):
     """Request model for updating port forwarding rules."""
     ports: List[int] = Field(..., description="A list of ports to be forwarded from YOUR assigned pool.")
 
+class PortAllocateRequest(BaseModel):
+    """Request model for forwarding free ports picked by the server."""
+    count: int = Field(..., ge=1, le=1024, description="How many free ports from YOUR assigned pool to forward.")
+
+class PortAllocateResponse(BaseModel):
+    """Response model after a port allocation request."""
+    message: str
+    client_ip: str
+    allocated: List[int]
+    my_forwarded_ports: List[int]
+
+class AvailablePortsResponse(BaseModel):
+    """Response model listing the free ports of a client's pool."""
+    available_count: int
+    available_port_ranges: List[str]
+
+class HeartbeatResponse(BaseModel):
+    """Response model after a lease heartbeat."""
+    client_ip: str
+    forwarded_port_count: int
+    lease_seconds: float = Field(..., description="Seconds until the forwards expire without another request; 0 if leases are disabled.")
+
 class PortForwardResponse(BaseModel):
     """Response model after a port forwarding request."""
     message: str
@@ -37,12 +62,13 @@ class PortForwardResponse(BaseModel):
 class MyStatusResponse(BaseModel):
     """Response model for a specific client's status."""
     my_forwarded_ports: List[int]
-    my_allowed_ports: List[int]
+    my_allowed_port_ranges: List[str]
 
 # --- Admin-facing Models ---
 
 class AdminStatusResponse(BaseModel):
     """Response model for the overall status of the daemon (admin view)."""
     forwarded_rules: Dict[str, List[int]]
+    forwarded_rules_by_client: Dict[str, Dict[str, List[int]]]  # client_id -> client IP -> ports
     unavailable_ports_in_range: List[int]
     managed_clients: List[ClientInfoPublic]
\ No newline at end of file
@@ -5,6 +5,8 @@ import os
 import sys
 from dataclasses import dataclass
 
+from app.system.peers import parse_peer_sources
+
 # Setup logging to output to stdout, as is standard for Docker.
 logging.basicConfig(
     level=logging.INFO,
@@ -13,6 +15,49 @@ logging.basicConfig(
 )
 
 
+def _env_flag(name: str, default: bool) -> bool:
+    """Reads a boolean flag ("1"/"true"/"yes"/"on" or "0"/"false"/"no"/"off") from the environment."""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    if value.strip().lower() in ("1", "true", "yes", "on"):
+        return True
+    if value.strip().lower() in ("0", "false", "no", "off"):
+        return False
+    logging.warning(f"{name} has an invalid value '{value}'. Using default: {default}.")
+    return default
+
+
+def _env_float(name: str, default: float) -> float:
+    """Reads a non-negative number (e.g. an interval in seconds) from the environment."""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        number = float(value)
+        if number < 0:
+            raise ValueError("must not be negative")
+        return number
+    except ValueError as e:
+        logging.warning(f"{name} is invalid ('{value}'): {e}. Using default: {default}.")
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    """Reads a positive integer (e.g. a batch size) from the environment."""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        number = int(value)
+        if number < 1:
+            raise ValueError("must be positive")
+        return number
+    except ValueError as e:
+        logging.warning(f"{name} is invalid ('{value}'): {e}. Using default: {default}.")
+        return default
+
+
 @dataclass
 class Config:
     """
@@ -24,6 +69,26 @@ class Config:
     daemon_port: int
     exposed_ports: range
     admin_api_key: str  # The one key to rule them all
+    per_client_chains: bool = False  # Give every client IP its own iptables sub-chains
+    backend: str = "iptables"  # Rule backend: "iptables", "nftables" or "simulate" (in-memory dry run)
+    persistent_writer: bool = False  # Stream iptables batches to one long-lived iptables-restore
+    reconcile_interval: float = 30.0  # Seconds between kernel drift checks; 0 disables them
+    rescan_interval: float = 60.0  # Seconds between host port rescans; 0 disables them
+    rescan_jitter: float = 5.0  # Random extra delay (seconds) added to every rescan interval
+    lease_ttl: float = 0.0  # Seconds a client's forwards live without a request or heartbeat; 0 disables leases
+    lease_tick: float = 1.0  # Resolution (seconds) of the lease expiry timer wheel
+    peer_reap_interval: float = 0.0  # Seconds between idle VPN peer checks; 0 disables the reaper
+    peer_idle_timeout: float = 86400.0  # Seconds a peer may be offline before its forwards are removed
+    peer_sources: str = "awg:amnezia-awg:wg0"  # kind:container:interface-or-status-file, comma-separated
+    roaming: bool = False  # Move a client's forwards to its new IP when its API key shows up from another address
+    group_commit_window: float = 0.005  # Seconds the rule writer waits to merge requests; 0 disables it
+    group_commit_max_batch: int = 256  # Requests merged into one kernel transaction at most
+    legacy_port: int = 0  # TCP port of the legacy PORTS:/DISCONNECT: line protocol; 0 disables it
+    legacy_read_timeout: float = 5.0  # Seconds a legacy connection may stay silent before it is closed
+    state_db: str = "data/portmaster.db"  # SQLite file with clients and the forward journal; empty disables it
+    scanner_method: str = "auto"  # Host port scanner: "auto", "netlink", "proc" or "ss"
+    simulate_seed: str = ""  # iptables-save dump the simulated ruleset starts from; empty starts empty
+    simulate_command_log: str = ""  # File the simulate backend appends every command to; empty disables it
 
     @classmethod
     def from_env(cls) -> "Config":
@@ -59,11 +124,79 @@ class Config:
             logging.error(f"Error in EXPOSED_PORT_RANGE ('{port_range_str}'): {e}. Using default range.")
             exposed_ports = range(20000, 25001)
 
+        per_client_chains = _env_flag("PORTMASTER_PER_CLIENT_CHAINS", False)
+
+        backend = os.environ.get("PORTMASTER_BACKEND", "iptables").strip().lower()
+        if backend not in ("iptables", "nftables", "simulate"):
+            logging.warning(f"PORTMASTER_BACKEND '{backend}' is not supported. Using 'iptables'.")
+            backend = "iptables"
+
+        persistent_writer = _env_flag("PORTMASTER_PERSISTENT_WRITER", False)
+        reconcile_interval = _env_float("PORTMASTER_RECONCILE_INTERVAL", 30.0)
+
+        rescan_interval = _env_float("PORTMASTER_RESCAN_INTERVAL", 60.0)
+        rescan_jitter = _env_float("PORTMASTER_RESCAN_JITTER", 5.0)
+
+        lease_ttl = _env_float("PORTMASTER_LEASE_TTL", 0.0)
+        lease_tick = _env_float("PORTMASTER_LEASE_TICK", 1.0) or 1.0
+
+        peer_reap_interval = _env_float("PORTMASTER_PEER_REAP_INTERVAL", 0.0)
+        peer_idle_timeout = _env_float("PORTMASTER_PEER_IDLE_TIMEOUT", 86400.0)
+        peer_sources = os.environ.get("PORTMASTER_PEER_SOURCES", "awg:amnezia-awg:wg0").strip()
+        try:
+            parse_peer_sources(peer_sources)
+        except ValueError as e:
+            logging.warning(f"PORTMASTER_PEER_SOURCES is invalid: {e} The idle peer reaper is disabled.")
+            peer_sources = ""
+
+        roaming = _env_flag("PORTMASTER_ROAMING", False)
+
+        group_commit_window = _env_float("PORTMASTER_GROUP_COMMIT_WINDOW", 0.005)
+        group_commit_max_batch = _env_int("PORTMASTER_GROUP_COMMIT_MAX_BATCH", 256)
+
+        legacy_port = _env_int("PORTMASTER_LEGACY_PORT", 0)
+        legacy_read_timeout = _env_float("PORTMASTER_LEGACY_READ_TIMEOUT", 5.0) or 5.0
+
+        state_db = os.environ.get("PORTMASTER_STATE_DB", "data/portmaster.db").strip()
+
+        scanner_method = os.environ.get("PORTMASTER_SCANNER", "auto").strip().lower()
+        if scanner_method not in ("auto", "netlink", "proc", "ss"):
+            logging.warning(f"PORTMASTER_SCANNER '{scanner_method}' is not supported. Using 'auto'.")
+            scanner_method = "auto"
+
+        simulate_seed = os.environ.get("PORTMASTER_SIMULATE_SEED", "").strip()
+        simulate_command_log = os.environ.get("PORTMASTER_SIMULATE_COMMAND_LOG", "").strip()
+
         logging.info(
             f"Configuration loaded: Listening on IP={vpn_ip}, Port={daemon_port}, "
-            f"Range={exposed_ports.start}-{exposed_ports.stop - 1}"
+            f"Range={exposed_ports.start}-{exposed_ports.stop - 1}, Backend={backend}"
+        )
+        return cls(
+            vpn_ip,
+            daemon_port,
+            exposed_ports,
+            admin_api_key,
+            per_client_chains=per_client_chains,
+            backend=backend,
+            persistent_writer=persistent_writer,
+            reconcile_interval=reconcile_interval,
+            rescan_interval=rescan_interval,
+            rescan_jitter=rescan_jitter,
+            lease_ttl=lease_ttl,
+            lease_tick=lease_tick,
+            peer_reap_interval=peer_reap_interval,
+            peer_idle_timeout=peer_idle_timeout,
+            peer_sources=peer_sources,
+            roaming=roaming,
+            group_commit_window=group_commit_window,
+            group_commit_max_batch=group_commit_max_batch,
+            legacy_port=legacy_port,
+            legacy_read_timeout=legacy_read_timeout,
+            state_db=state_db,
+            scanner_method=scanner_method,
+            simulate_seed=simulate_seed,
+            simulate_command_log=simulate_command_log,
         )
-        return cls(vpn_ip, daemon_port, exposed_ports, admin_api_key)
 
 # Create a single, globally accessible config instance.
 settings = Config.from_env()
\ No newline at end of file
@@ -1,32 +1,50 @@
 # src/main.py
 
+import hashlib
 import logging
 import uvicorn
 from contextlib import asynccontextmanager
-from typing import List
+from typing import AbstractSet, Dict, List, Optional
 from fastapi.security import APIKeyHeader
-from fastapi import FastAPI, Request, HTTPException, Security, APIRouter, Depends
+from fastapi import FastAPI, Request, Response, HTTPException, Security, APIRouter, Depends, Header
+from fastapi.responses import JSONResponse
 
 from app.core.config import settings
+from app.api.legacy import LegacyProtocolServer
 from app.api.models import *
 from app.services.portmaster_service import PortMasterService
-from app.system.iptables import IPTablesManager
+from app.system.backends import create_port_forward_backend
+from app.system.commands import IPTablesError
 from app.system.scanner import HostPortScanner
 
 # --- Globals & Lifespan ---
 service_instance: PortMasterService
+legacy_server: LegacyProtocolServer
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global service_instance
+    global service_instance, legacy_server
     logging.info("Application startup...")
-    service_instance = PortMasterService(settings, IPTablesManager(), HostPortScanner())
+    scanner = HostPortScanner(settings.exposed_ports, settings.scanner_method)
+    service_instance = PortMasterService(settings, create_port_forward_backend(settings), scanner)
     await service_instance.initialize()
+    service_instance.start_background_tasks()
+    legacy_server = LegacyProtocolServer(
+        service_instance, settings.vpn_ip, settings.legacy_port, settings.legacy_read_timeout
+    )
+    await legacy_server.start()
     yield
     logging.info("Application shutdown.")
+    await legacy_server.stop()
+    await service_instance.shutdown()
 
 app = FastAPI(title="PortMaster API", version="2.0.0", lifespan=lifespan)
 
+@app.exception_handler(IPTablesError)
+async def rules_not_applied(req: Request, exc: IPTablesError):
+    """The firewall refused a batch; the old rules are still in place, so the client may retry."""
+    return JSONResponse(status_code=503, content={"detail": "Port forwarding rules could not be applied, try again."})
+
 # --- SECURITY & DEPENDENCIES ---
 admin_api_key_header = APIKeyHeader(name="X-Admin-API-Key", auto_error=True)
 user_api_key_header = APIKeyHeader(name="X-API-Key", auto_error=True)
@@ -49,14 +67,14 @@ async def create_client(req: ClientCreateRequest):
     """Creates a new client and returns their generated API key."""
     client = await service_instance.create_client(req.client_id, req.port_range)
     if not client:
-        raise HTTPException(status_code=400, detail="Client already exists or port range is invalid.")
+        raise HTTPException(status_code=400, detail="Client already exists, or the port range is invalid or overlaps another client's.")
     return client
 
 @admin_router.get("/clients", response_model=List[ClientInfoPublic])
 async def list_clients():
     """Lists all managed clients (without showing their API keys)."""
     clients = service_instance.get_all_clients()
-    return [ClientInfoPublic(client_id=c.client_id, allowed_ports=c.allowed_ports) for c in clients]
+    return [ClientInfoPublic(client_id=c.client_id, allowed_port_ranges=c.allowed_port_ranges) for c in clients]
 
 @admin_router.delete("/clients/{client_id}", status_code=204)
 async def delete_client(client_id: str):
@@ -71,27 +89,62 @@ async def get_admin_status():
     """Gets the overall system status."""
     forwarded, unavailable = service_instance.forwarded_ports, service_instance.unavailable_ports
     clients = service_instance.get_all_clients()
-    public_clients = [ClientInfoPublic(client_id=c.client_id, allowed_ports=c.allowed_ports) for c in clients]
+    public_clients = [ClientInfoPublic(client_id=c.client_id, allowed_port_ranges=c.allowed_port_ranges) for c in clients]
     return AdminStatusResponse(
         forwarded_rules={ip: sorted(list(p)) for ip, p in forwarded.items()},
+        forwarded_rules_by_client={
+            client_id: {ip: sorted(p) for ip, p in forwards.items()}
+            for client_id, forwards in service_instance.forwards_by_client().items()
+        },
         unavailable_ports_in_range=sorted(list(unavailable)),
         managed_clients=public_clients
     )
 
+@admin_router.get("/metrics", response_model=Dict[str, float])
+async def get_metrics():
+    """Gets internal counters and timings (e.g. of the kernel rule reconciler)."""
+    metrics = service_instance.get_metrics()
+    metrics.update(legacy_server.metrics())
+    return metrics
+
 # --- USER API ROUTER ---
 user_router = APIRouter()
 
+def ports_etag(ports: AbstractSet[int]) -> str:
+    """A strong ETag identifying a client's set of forwarded ports."""
+    digest = hashlib.sha1(",".join(map(str, sorted(ports))).encode("ascii")).hexdigest()
+    return f'"{digest[:16]}"'
+
 @user_router.get("/ports", response_model=MyStatusResponse)
-async def get_my_status(request: Request, client: ClientInfo = Depends(get_current_client)):
-    """Gets the current status for the authenticated client."""
-    my_ports = sorted(list(service_instance.forwarded_ports.get(request.client.host, set())))
-    return MyStatusResponse(my_forwarded_ports=my_ports, my_allowed_ports=client.allowed_ports)
+async def get_my_status(request: Request, response: Response, client: ClientInfo = Depends(get_current_client)):
+    """Gets the current status for the authenticated client. The ETag header identifies the forwarded ports."""
+    my_ports = service_instance.forwarded_ports.get(request.client.host, frozenset())
+    response.headers["ETag"] = ports_etag(my_ports)
+    return MyStatusResponse(my_forwarded_ports=sorted(my_ports), my_allowed_port_ranges=client.allowed_port_ranges)
 
 @user_router.post("/ports", response_model=PortForwardResponse)
-async def update_ports(req: Request, body: PortForwardRequest, client: ClientInfo = Depends(get_current_client)):
-    """Updates port forwarding rules for the client from their assigned pool."""
-    _, failed = await service_instance.update_client_ports(req.client.host, set(body.ports), client.allowed_ports)
-    final_rules = service_instance.forwarded_ports.get(req.client.host, set())
+async def update_ports(
+        req: Request, response: Response, body: PortForwardRequest,
+        client: ClientInfo = Depends(get_current_client), if_match: Optional[str] = Header(None),
+):
+    """
+    Updates port forwarding rules for the client from their assigned pool.
+    Resubmitting the current port list is answered without touching the rules. With If-Match,
+    the update is refused (412) if the forwards changed since that ETag was issued.
+    """
+    requested = set(body.ports)
+    if if_match is not None and if_match.strip() != "*":
+        current_etag = ports_etag(service_instance.forwarded_ports.get(req.client.host, frozenset()))
+        if current_etag not in (tag.strip() for tag in if_match.split(",")):
+            raise HTTPException(status_code=412, detail="Forwarded ports changed since the given ETag was issued.")
+
+    final_rules = service_instance.unchanged_ports(req.client.host, requested, client.client_id)
+    failed = set()
+    if final_rules is None:
+        allowed = service_instance.get_client_pool(client.client_id)
+        _, failed = await service_instance.update_client_ports(req.client.host, requested, allowed, client.client_id)
+        final_rules = service_instance.forwarded_ports.get(req.client.host, frozenset())
+    response.headers["ETag"] = ports_etag(final_rules)
     return PortForwardResponse(
         message="Port forwarding rules updated.",
         client_ip=req.client.host,
@@ -99,6 +152,36 @@ async def update_ports(req: Request, body: PortForwardRequest, client: ClientInf
         failed_to_forward=sorted(list(failed))
     )
 
+@user_router.post("/ports/allocate", response_model=PortAllocateResponse)
+async def allocate_ports(req: Request, body: PortAllocateRequest, client: ClientInfo = Depends(get_current_client)):
+    """Forwards free ports picked from the client's pool, in addition to the ones already forwarded."""
+    allowed = service_instance.get_client_pool(client.client_id)
+    allocated = await service_instance.allocate_ports(req.client.host, body.count, allowed, client.client_id)
+    if not allocated:
+        raise HTTPException(status_code=409, detail="No free ports left in your assigned pool.")
+    final_rules = service_instance.forwarded_ports.get(req.client.host, frozenset())
+    message = "Ports allocated." if len(allocated) == body.count else \
+        f"Only {len(allocated)} of {body.count} requested ports were free."
+    return PortAllocateResponse(
+        message=message,
+        client_ip=req.client.host,
+        allocated=sorted(allocated),
+        my_forwarded_ports=sorted(final_rules)
+    )
+
+@user_router.get("/ports/available", response_model=AvailablePortsResponse)
+async def get_available_ports(client: ClientInfo = Depends(get_current_client)):
+    """Lists the ports of the client's pool that are currently free to forward."""
+    available = service_instance.available_port_ranges(service_instance.get_client_pool(client.client_id))
+    return AvailablePortsResponse(available_count=len(available), available_port_ranges=available.to_strings())
+
+@user_router.post("/ports/heartbeat", response_model=HeartbeatResponse)
+async def heartbeat(req: Request, _: ClientInfo = Depends(get_current_client)):
+    """Renews the lease on the client's forwards without changing them."""
+    count = service_instance.heartbeat(req.client.host)
+    lease_seconds = settings.lease_ttl if count else 0.0
+    return HeartbeatResponse(client_ip=req.client.host, forwarded_port_count=count, lease_seconds=lease_seconds)
+
 @user_router.delete("/ports", status_code=204)
 async def disconnect(req: Request, _: ClientInfo = Depends(get_current_client)):
     """Removes all forwarding rules for the client's current IP address."""
@@ -8,7 +8,7 @@ import socket
 import subprocess
 import sys
 from dataclasses import dataclass
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set, Tuple
 
 # Настраиваем логирование для вывода в stdout, как принято в Docker.
 logging.basicConfig(
@@ -114,11 +114,12 @@ class IPTablesManager:
     Класс, инкапсулирующий всю логику работы с iptables.
     """
 
-    def _run_command(self, command: List[str]):
-        """Приватный хелпер для выполнения команд."""
+    def _run_command(self, command: List[str], input: Optional[str] = None):
+        """Приватный хелпер для выполнения команд (опционально с данными на stdin)."""
         try:
             process = subprocess.run(
                 command,
+                input=input,
                 check=True,
                 capture_output=True,
                 text=True,
@@ -180,6 +181,67 @@ class IPTablesManager:
             )
         logging.info(f"Проброс порта {port} (TCP/UDP) для {client_ip} удален")
 
+    @staticmethod
+    def _forward_rules(client_ip: str, port: int) -> List[Tuple[str, str]]:
+        """
+        Пары (таблица, правило) одного проброса TCP/UDP — те же, что создает add_port_forward,
+        в том виде, в каком их выводит iptables-save (так их можно найти в его выводе).
+        """
+        rules = []
+        for proto in ["tcp", "udp"]:
+            match = f"-p {proto} -m {proto} --dport {port}"
+            rules.append(("nat", f"PREROUTING {match} -j DNAT --to-destination {client_ip}:{port}"))
+            rules.append(("filter", f"FORWARD -d {client_ip}/32 {match} -j ACCEPT"))
+            rules.append(("nat", f"POSTROUTING -d {client_ip}/32 {match} -j MASQUERADE"))
+        return rules
+
+    def _batch_tables(
+            self, client_ip: str, adds: Set[int], removes: Set[int], existing: Optional[Dict[str, Set[str]]] = None
+    ) -> Dict[str, List[str]]:
+        """
+        Строки iptables-restore для батча по таблицам. Если передан existing (правила из iptables-save),
+        удаляются только существующие правила и добавляются только недостающие.
+        """
+        tables: Dict[str, List[str]] = {"nat": [], "filter": []}
+        # Сначала удаления, чтобы у порта никогда не было двух DNAT-целей.
+        for action, ports in (("-D", removes), ("-A", adds)):
+            for port in sorted(ports):
+                for table, rule in self._forward_rules(client_ip, port):
+                    if existing is not None and (f"-A {rule}" in existing[table]) != (action == "-D"):
+                        continue
+                    tables[table].append(f"{action} {rule}")
+        return tables
+
+    def _restore(self, tables: Dict[str, List[str]]):
+        lines = []
+        for table, rules in tables.items():
+            if rules:
+                lines.append(f"*{table}")
+                lines.extend(rules)
+                lines.append("COMMIT")
+        if lines:
+            self._run_command(["iptables-restore", "--noflush", "--wait"], input="\n".join(lines) + "\n")
+
+    def apply_batch(self, client_ip: str, adds: Set[int], removes: Set[int]):
+        """
+        Применяет удаления и добавления пробросов одного клиента одним вызовом `iptables-restore --noflush`.
+        Каждая таблица коммитится отдельно: если правило в ней не применилось, не применяется ни одно
+        правило этой таблицы, но nat может быть уже закоммичен. Поэтому при ошибке (например, правило
+        для удаления уже удалено вручную или его не создавала старая версия) батч один раз повторяется
+        по фактическому состоянию таблиц: удаляются только существующие правила, добавляются только недостающие.
+        """
+        if not adds and not removes:
+            return
+        try:
+            self._restore(self._batch_tables(client_ip, adds, removes))
+        except IPTablesError:
+            existing = {
+                table: set(self._run_command(["iptables-save", "-t", table]).splitlines()) for table in ("nat", "filter")
+            }
+            logging.warning(f"Батч для {client_ip} не применился, повторяю только с недостающими изменениями.")
+            self._restore(self._batch_tables(client_ip, adds, removes, existing))
+        logging.info(f"Для {client_ip} добавлено пробросов: {len(adds)}, удалено: {len(removes)}")
+
     def parse_existing_rules(self) -> Dict[str, Set[int]]:
         """
         Парсит существующие правила iptables и возвращает словарь {ip: {порты}}.
@@ -256,18 +318,16 @@ class PortMasterDaemon:
             sock.sendall(b"Error: Invalid port format. Must be comma-separated numbers.\n")
             return
 
-        if client_ip in self.forwarded_ports:
-            for port in list(self.forwarded_ports.get(client_ip, set())):
-                try:
-                    self.iptables_manager.remove_port_forward(client_ip, port)
-                    self.forwarded_ports[client_ip].remove(port)
-                except IPTablesError as e:
-                    logging.warning(f"Не удалось удалить старое правило для {client_ip}:{port}: {e}")
+        # Порты, которые уже проброшены на этот IP и запрошены снова, сохраняют свои правила;
+        # применяется только разница, одним батчем.
+        current_ports = self.forwarded_ports.get(client_ip, set())
+        ports_to_remove = current_ports - requested_ports
+        ports_to_add, failed_ports = set(), set()
+        forwarded_to_others = {
+            p for ip, ip_ports in self.forwarded_ports.items() if ip != client_ip for p in ip_ports
+        }
 
-        success_ports, failed_ports = set(), set()
-        all_currently_forwarded_by_me = {p for ip_ports in self.forwarded_ports.values() for p in ip_ports}
-
-        for port in requested_ports:
+        for port in requested_ports - current_ports:
             if port not in self.config.exposed_ports:
                 logging.warning(f"Порт {port} не входит в разрешенный диапазон. Запрос от {client_ip}.")
                 failed_ports.add(port)
@@ -276,23 +336,27 @@ class PortMasterDaemon:
                 logging.warning(f"Порт {port} занят другим процессом на хосте. Запрос от {client_ip}.")
                 failed_ports.add(port)
                 continue
-            if port in all_currently_forwarded_by_me:
+            if port in forwarded_to_others:
                 logging.warning(f"Порт {port} уже занят другим VPN-клиентом. Запрос от {client_ip}.")
                 failed_ports.add(port)
                 continue
+            ports_to_add.add(port)
 
-            try:
-                self.iptables_manager.add_port_forward(client_ip, port)
-                if client_ip not in self.forwarded_ports:
-                    self.forwarded_ports[client_ip] = set()
-                self.forwarded_ports[client_ip].add(port)
-                success_ports.add(port)
-            except IPTablesError:
-                failed_ports.add(port)
+        try:
+            self.iptables_manager.apply_batch(client_ip, ports_to_add, ports_to_remove)
+            current_ports = (current_ports - ports_to_remove) | ports_to_add
+            if current_ports:
+                self.forwarded_ports[client_ip] = current_ports
+            else:
+                self.forwarded_ports.pop(client_ip, None)
+        except IPTablesError:
+            # Батч не применился и после повтора: пробросы считаются не добавленными, хотя правила nat
+            # (он коммитится раньше filter) могли остаться в ядре.
+            failed_ports |= ports_to_add
 
         response = ""
-        if success_ports:
-            response += f"Success: Ports {','.join(map(str, sorted(success_ports)))} forwarded.\n"
+        if current_ports:
+            response += f"Success: Ports {','.join(map(str, sorted(current_ports)))} forwarded.\n"
         if failed_ports:
             response += f"Error: Failed to forward ports {','.join(map(str, sorted(failed_ports)))}.\n"
         if not response:
@@ -0,0 +1,101 @@
+# src/services/allocator.py
+
+import re
+from typing import Dict, Iterable, List, Tuple
+
+from app.services.intervals import PortPool
+
+# Flags of a port in the free map. A port is free only if no flag is set.
+OWNED = 1  # Forwarded to a client
+HOST_OCCUPIED = 2  # A host process listens on it
+
+_FREE_RUNS = re.compile(rb"\x00+")
+_CLEAR_OWNED = bytes(flags & ~OWNED for flags in range(256))
+
+
+class PortAllocator:
+    """
+    A byte map with one flag byte per port of the exposed range, used to hand out free ports.
+
+    Free ports are found with bytearray.find / a regex over the map, which run in C. Allocation is
+    next-fit: each interval of a sub-pool remembers where the last allocation stopped and continues
+    from there, so repeated allocate/free cycles do not rescan the taken front of the interval and
+    cost O(1) amortized per port.
+    """
+
+    def __init__(self, port_range: range):
+        self.port_range = port_range
+        self._flags = bytearray(len(port_range))
+        self._cursors: Dict[Tuple[int, int], int] = {}
+
+    def _set(self, ports: Iterable[int], flag: int):
+        base = self.port_range.start
+        for port in ports:
+            if port in self.port_range:
+                self._flags[port - base] |= flag
+
+    def _clear(self, ports: Iterable[int], flag: int):
+        base = self.port_range.start
+        for port in ports:
+            if port in self.port_range:
+                self._flags[port - base] &= ~flag
+
+    def mark_owned(self, ports: Iterable[int]):
+        self._set(ports, OWNED)
+
+    def mark_released(self, ports: Iterable[int]):
+        self._clear(ports, OWNED)
+
+    def mark_host_occupied(self, occupied: Iterable[int] = (), freed: Iterable[int] = ()):
+        self._clear(freed, HOST_OCCUPIED)
+        self._set(occupied, HOST_OCCUPIED)
+
+    def clear_owned(self):
+        """Clears every OWNED flag, e.g. before the ownership table is reloaded."""
+        self._flags = self._flags.translate(_CLEAR_OWNED)
+
+    def is_free(self, port: int) -> bool:
+        return port in self.port_range and self._flags[port - self.port_range.start] == 0
+
+    def _bounds(self, start: int, end: int) -> Tuple[int, int]:
+        """Map offsets of an inclusive interval, clipped to the exposed range."""
+        base = self.port_range.start
+        return max(start, base) - base, min(end, self.port_range.stop - 1) - base + 1
+
+    def allocate(self, pool: PortPool, count: int) -> List[int]:
+        """
+        Picks up to count free ports from pool. The ports are not marked here; the caller assigns
+        them in the ownership table right away, which sets their OWNED flag.
+        """
+        base = self.port_range.start
+        picked: List[int] = []
+        for start, end in pool.intervals:
+            if len(picked) >= count:
+                break
+            low, high = self._bounds(start, end)
+            if low >= high:
+                continue
+            cursor = min(max(self._cursors.get((start, end), low), low), high)
+            # Next-fit: search from the cursor to the end of the interval, then wrap around.
+            for segment_low, segment_high in ((cursor, high), (low, cursor)):
+                i = segment_low
+                while len(picked) < count:
+                    i = self._flags.find(0, i, segment_high)
+                    if i < 0:
+                        break
+                    picked.append(base + i)
+                    i += 1
+                    self._cursors[(start, end)] = i
+                if len(picked) >= count:
+                    break
+        return picked
+
+    def free_intervals(self, pool: PortPool) -> List[Tuple[int, int]]:
+        """The free ports of pool as inclusive intervals."""
+        base = self.port_range.start
+        free = []
+        for start, end in pool.intervals:
+            low, high = self._bounds(start, end)
+            for run in _FREE_RUNS.finditer(self._flags, low, max(low, high)):
+                free.append((base + run.start(), base + run.end() - 1))
+        return free
@@ -0,0 +1,157 @@
+# src/services/group_commit.py
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple, Union
+
+from app.services.intervals import PortPool
+
+if TYPE_CHECKING:
+    from app.services.portmaster_service import PortMasterService
+
+
+@dataclass
+class PortUpdate:
+    """Replace the forwarded ports of client_ip with requested (limited to allowed) on behalf of client_id."""
+    client_ip: str
+    requested: Set[int]
+    allowed: PortPool
+    client_id: Optional[str] = None
+
+
+@dataclass
+class Allocate:
+    """Forward count more free ports of allowed to client_ip on behalf of client_id."""
+    client_ip: str
+    count: int
+    allowed: PortPool
+    client_id: Optional[str] = None
+
+
+@dataclass
+class Disconnect:
+    """Remove every forward of client_ip."""
+    client_ip: str
+
+
+@dataclass
+class Roam:
+    """Move every forward of client_id at its previous IPs (from_ips) over to client_ip."""
+    client_ip: str
+    client_id: str
+    from_ips: List[str]
+
+
+RuleRequest = Union[PortUpdate, Allocate, Disconnect, Roam]
+# (successful_adds, failed_adds) for a PortUpdate or Allocate, the number of removed (Disconnect)
+# or moved (Roam) ports otherwise.
+RuleResult = Union[Tuple[Set[int], Set[int]], int]
+
+
+class GroupCommitWriter:
+    """
+    Single writer task that merges concurrent rule changes into one kernel transaction.
+
+    Callers enqueue PortUpdate/Allocate/Disconnect requests and await a future. The writer waits at most
+    `window` seconds after the first queued request (or until `max_batch` requests are queued),
+    lets the service validate the whole batch against the ownership table, applies the combined
+    diff with one apply_batch call and resolves every caller's future with its own result. During
+    reconnect storms the number of kernel commits therefore grows with the number of batches, not
+    with the number of requests.
+    """
+
+    def __init__(self, service: "PortMasterService", window: float, max_batch: int):
+        self.service = service
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+        # --- METRICS ---
+        self.batches = 0
+        self.requests = 0
+        self.last_batch_size = 0
+        self.largest_batch_size = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logging.info(f"Group commit writer started (window {self.window * 1000:g}ms, max batch {self.max_batch}).")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("PortMaster is shutting down."))
+
+    async def submit(self, request: RuleRequest) -> RuleResult:
+        """Queues a request for the next group commit and waits for its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self._queue.put((request, future, loop.time()))
+        return await future
+
+    async def _collect(self) -> List[Tuple[RuleRequest, asyncio.Future, float]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            requests = [request for request, _, _ in batch]
+            try:
+                async with self.service._rules_lock.shared():
+                    # Time in the queue plus waiting for the rules lock, per request.
+                    started = asyncio.get_running_loop().time()
+                    for _, _, enqueued in batch:
+                        self.service.lock_wait.observe(started - enqueued)
+                    results: List[Union[RuleResult, Exception]] = await self.service._commit_requests(requests)
+            except Exception as e:
+                logging.error(f"Group commit of {len(batch)} request(s) failed: {e}", exc_info=True)
+                results = [e] * len(batch)
+
+            for (_, future, _), result in zip(batch, results):
+                if future.done():  # The caller went away.
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+            self.batches += 1
+            self.requests += len(batch)
+            self.last_batch_size = len(batch)
+            self.largest_batch_size = max(self.largest_batch_size, len(batch))
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "group_commit_batches": self.batches,
+            "group_commit_requests": self.requests,
+            "group_commit_last_batch_size": self.last_batch_size,
+            "group_commit_largest_batch_size": self.largest_batch_size,
+        }
@@ -0,0 +1,114 @@
+# src/services/intervals.py
+
+from bisect import bisect_right, insort
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+class PortPool:
+    """
+    An immutable set of ports stored as sorted, disjoint, inclusive intervals, e.g. 21000-21010,21500-21599.
+    Memory grows with the number of intervals, not with their width; membership is a binary search.
+    """
+
+    __slots__ = ("_starts", "_ends")
+
+    def __init__(self, intervals: Iterable[Tuple[int, int]] = ()):
+        merged: List[List[int]] = []
+        for start, end in sorted(intervals):
+            if start > end:
+                raise ValueError(f"Invalid interval {start}-{end}: start is greater than end.")
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self._starts = [start for start, _ in merged]
+        self._ends = [end for _, end in merged]
+
+    @classmethod
+    def parse(cls, text: str) -> "PortPool":
+        """Parses "21000-21010", "21000" or a comma-separated list of both."""
+        intervals = []
+        for part in text.split(","):
+            start_str, _, end_str = part.strip().partition("-")
+            start = int(start_str)
+            intervals.append((start, int(end_str) if end_str else start))
+        return cls(intervals)
+
+    @property
+    def intervals(self) -> List[Tuple[int, int]]:
+        return list(zip(self._starts, self._ends))
+
+    def __contains__(self, port: object) -> bool:
+        if not isinstance(port, int):
+            return False
+        i = bisect_right(self._starts, port) - 1
+        return i >= 0 and port <= self._ends[i]
+
+    def __iter__(self) -> Iterator[int]:
+        for start, end in zip(self._starts, self._ends):
+            yield from range(start, end + 1)
+
+    def __len__(self) -> int:
+        return sum(end - start + 1 for start, end in zip(self._starts, self._ends))
+
+    def __bool__(self) -> bool:
+        return bool(self._starts)
+
+    def clipped(self, ports: range) -> "PortPool":
+        """The part of the pool inside a contiguous port range (e.g. EXPOSED_PORT_RANGE)."""
+        if not ports:
+            return PortPool()
+        low, high = ports.start, ports.stop - 1
+        return PortPool(
+            (max(start, low), min(end, high)) for start, end in self.intervals if start <= high and end >= low
+        )
+
+    def to_strings(self) -> List[str]:
+        return [f"{start}-{end}" if start != end else str(start) for start, end in zip(self._starts, self._ends)]
+
+    def __str__(self) -> str:
+        return ",".join(self.to_strings())
+
+
+class IntervalIndex:
+    """
+    The port intervals of all clients, sorted by start. Intervals never overlap, so the only
+    candidate for an overlap with [start, end] is the last interval starting at or before end,
+    which a binary search finds in O(log n).
+    """
+
+    def __init__(self):
+        self._intervals: List[Tuple[int, int, str]] = []  # (start, end, owner)
+
+    def _candidate(self, port: int) -> Optional[Tuple[int, int, str]]:
+        i = bisect_right(self._intervals, (port, float("inf"))) - 1
+        return self._intervals[i] if i >= 0 else None
+
+    def owner_of(self, port: int) -> Optional[str]:
+        candidate = self._candidate(port)
+        return candidate[2] if candidate is not None and port <= candidate[1] else None
+
+    def overlapping_owner(self, pool: PortPool) -> Optional[str]:
+        """Returns the owner of an interval overlapping any interval of pool, or None."""
+        for start, end in pool.intervals:
+            candidate = self._candidate(end)
+            if candidate is not None and candidate[1] >= start:
+                return candidate[2]
+        return None
+
+    def add(self, owner: str, pool: PortPool):
+        """Indexes the intervals of pool under owner. Raises ValueError if one overlaps another owner's."""
+        overlapping = self.overlapping_owner(pool)
+        if overlapping is not None:
+            raise ValueError(f"Port range overlaps the sub-pool of client '{overlapping}'.")
+        for start, end in pool.intervals:
+            insort(self._intervals, (start, end, owner))
+
+    def remove(self, owner: str, pool: PortPool):
+        for start, end in pool.intervals:
+            i = bisect_right(self._intervals, (start, end, owner)) - 1
+            if i >= 0 and self._intervals[i] == (start, end, owner):
+                del self._intervals[i]
+
+    def __len__(self) -> int:
+        return len(self._intervals)
@@ -0,0 +1,128 @@
+# src/services/leases.py
+
+import logging
+import math
+import time
+from typing import TYPE_CHECKING, Dict, List, Set
+
+from app.services.periodic import PeriodicTask
+
+if TYPE_CHECKING:
+    from app.services.portmaster_service import PortMasterService
+
+
+class TimerWheel:
+    """
+    A hashed timer wheel: one slot per tick, a key lives in the slot of the tick it expires on.
+
+    The wheel has more slots than the longest timeout is ticks long, so a slot only ever holds keys
+    that expire on exactly that tick. Scheduling, rescheduling and cancelling are O(1); advancing
+    costs O(1) per elapsed tick plus O(expired keys), however many timers are pending.
+    """
+
+    def __init__(self, tick: float, max_timeout: float):
+        self.tick = tick
+        self._slots: List[Set[str]] = [set() for _ in range(math.ceil(max_timeout / tick) + 2)]
+        self._slot_of: Dict[str, int] = {}
+        self._current_tick = self._tick_at(time.monotonic())
+
+    def _tick_at(self, moment: float) -> int:
+        return int(moment // self.tick)
+
+    def schedule(self, key: str, timeout: float):
+        """(Re)starts the timer of key; it expires timeout seconds from now (rounded up to a tick)."""
+        self.cancel(key)
+        ticks = min(max(1, math.ceil(timeout / self.tick)), len(self._slots) - 1)
+        slot = (self._current_tick + ticks) % len(self._slots)
+        self._slots[slot].add(key)
+        self._slot_of[key] = slot
+
+    def cancel(self, key: str):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            self._slots[slot].discard(key)
+
+    def advance(self) -> List[str]:
+        """Moves the wheel to the current time and returns the keys whose timers expired on the way."""
+        now_tick = self._tick_at(time.monotonic())
+        expired: List[str] = []
+        # After a long stall every slot has been passed at most once, so the walk is capped at one turn.
+        for tick in range(self._current_tick + 1, min(now_tick, self._current_tick + len(self._slots)) + 1):
+            slot = self._slots[tick % len(self._slots)]
+            expired.extend(slot)
+            for key in slot:
+                del self._slot_of[key]
+            slot.clear()
+        self._current_tick = max(self._current_tick, now_tick)
+        return expired
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._slot_of
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+
+class LeaseManager:
+    """
+    Optional leases on forwards. Every client IP with forwards holds a lease of `ttl` seconds that
+    is renewed by any of its requests (including POST /ports/heartbeat). A background task advances
+    a TimerWheel every `tick` seconds and removes the forwards of all IPs whose leases expired in
+    one batch, so roaming or crashed clients that never send DELETE /ports do not leak ports.
+    """
+
+    def __init__(self, service: "PortMasterService", ttl: float, tick: float):
+        self.service = service
+        self.ttl = ttl
+        self.tick = tick
+        self._wheel = TimerWheel(tick, ttl) if ttl > 0 else None
+        self._loop = PeriodicTask("Lease expiry", self.expire_once, tick)
+
+        # --- METRICS ---
+        self.expired_total = 0
+        self.last_sweep_expired = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._wheel is not None
+
+    def renew(self, client_ip: str):
+        """Restarts the lease of client_ip, or drops it if the IP has no forwards left."""
+        if self._wheel is None:
+            return
+        if client_ip in self.service.forwarded_ports:
+            self._wheel.schedule(client_ip, self.ttl)
+        else:
+            self._wheel.cancel(client_ip)
+
+    def cancel(self, client_ip: str):
+        if self._wheel is not None:
+            self._wheel.cancel(client_ip)
+
+    def start(self):
+        if self._wheel is not None and not self._loop.running:
+            # Forwards found in the kernel at startup get a fresh lease; clients that never come back lose them.
+            for client_ip in self.service.forwarded_ports:
+                self._wheel.schedule(client_ip, self.ttl)
+            self._loop.start()
+            logging.info(f"Lease expiry started (TTL {self.ttl}s, tick {self.tick}s).")
+
+    async def stop(self):
+        await self._loop.stop()
+
+    async def expire_once(self) -> List[str]:
+        """Advances the wheel and removes the forwards of every client IP whose lease expired."""
+        expired = [ip for ip in self._wheel.advance() if ip in self.service.forwarded_ports]
+        self.last_sweep_expired = len(expired)
+        if expired:
+            logging.info(f"Leases of {len(expired)} client IP(s) expired, removing their forwards.")
+            await self.service.expire_client_ips(expired)
+            self.expired_total += len(expired)
+        return expired
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "leases_active": len(self._wheel) if self._wheel is not None else 0,
+            "leases_expired_total": self.expired_total,
+            "leases_last_sweep_expired": self.last_sweep_expired,
+        }
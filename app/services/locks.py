@@ -0,0 +1,114 @@
+# src/services/locks.py
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+
+
+class KeyedLock:
+    """
+    One asyncio.Lock per key (e.g. per client IP), created on first use and dropped again once
+    nobody holds or waits for it, so the table does not grow with every IP ever seen.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: str) -> AsyncIterator[None]:
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+    def locked(self, key: str) -> bool:
+        lock = self._locks.get(key)
+        return lock is not None and lock.locked()
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class SharedExclusiveLock:
+    """
+    A readers-writer lock for asyncio. Any number of tasks may hold it shared; an exclusive holder
+    waits for them to finish and keeps new shared holders out while it waits, so it cannot starve.
+    """
+
+    def __init__(self):
+        self._condition = asyncio.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._exclusive_waiting = 0
+
+    @asynccontextmanager
+    async def shared(self) -> AsyncIterator[None]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._exclusive and not self._exclusive_waiting)
+            self._shared += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._shared -= 1
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def exclusive(self) -> AsyncIterator[None]:
+        async with self._condition:
+            self._exclusive_waiting += 1
+            try:
+                await self._condition.wait_for(lambda: not self._exclusive and not self._shared)
+            finally:
+                self._exclusive_waiting -= 1
+                # Wake shared waiters in case we were cancelled while they were held back for us.
+                self._condition.notify_all()
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+
+class WaitHistogram:
+    """
+    Cumulative histogram of wait times (e.g. for locks or the group commit queue) with fixed
+    bucket bounds, flattened into metrics like <prefix>_le_5ms so scrapers can diff two snapshots.
+    """
+
+    BOUNDS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+    def __init__(self):
+        self._counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        milliseconds = seconds * 1000
+        for i, bound in enumerate(self.BOUNDS_MS):
+            if milliseconds <= bound:
+                self._counts[i] += 1
+                break
+        else:
+            self._counts[-1] += 1
+        self.count += 1
+        self.total += seconds
+
+    def metrics(self, prefix: str) -> Dict[str, float]:
+        metrics: Dict[str, float] = {}
+        cumulative = 0
+        for bound, count in zip(self.BOUNDS_MS, self._counts):
+            cumulative += count
+            metrics[f"{prefix}_le_{bound:g}ms"] = cumulative
+        metrics[f"{prefix}_count"] = self.count
+        metrics[f"{prefix}_sum_seconds"] = self.total
+        return metrics
@@ -0,0 +1,190 @@
+# src/services/ownership.py
+
+import logging
+from array import array
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Mapping, Optional, Set
+
+from app.services.allocator import PortAllocator
+
+
+class PortOwnershipTable:
+    """
+    The source of truth for which client IP a forwarded port belongs to.
+
+    Owners are kept in an array with one 16-bit slot per port of the exposed range, holding an
+    interned client IP index (0 means free). Every port has at most one owner, so the indexes always
+    fit and the memory stays flat (~120 KB for 60k ports) no matter how many ports are forwarded.
+    Ownership checks are O(1) per port. Each index also keeps the set of ports it owns, so listing
+    one client's ports does not need a scan of the whole range. Indexes of IPs that no longer own
+    anything are reused. The free map of the port allocator is kept in step with every change.
+
+    Every IP index is also tagged with the client_id that last changed its forwards, and each
+    client keeps the set of its IPs, so a client's forwards are found in O(its ports). The tag is
+    dropped together with the index when the IP owns nothing anymore.
+    """
+
+    def __init__(self, port_range: range):
+        self.port_range = port_range
+        self._owners = array("H", [0]) * len(port_range)
+        self._ips: List[Optional[str]] = [None]  # index -> client IP; index 0 is "free"
+        self._ports: List[Set[int]] = [set()]  # index -> ports owned by that IP
+        self._clients: List[Optional[str]] = [None]  # index -> client_id the IP belongs to, if known
+        self._client_ips: Dict[str, Set[str]] = {}  # client_id -> its IPs that own ports
+        self._ip_index: Dict[str, int] = {}
+        self._free_indexes: List[int] = []
+        self.view = ForwardedPortsView(self)
+        self.free_map = PortAllocator(port_range)
+
+    def _slot(self, port: int) -> int:
+        if port not in self.port_range:
+            raise ValueError(f"Port {port} is outside the exposed range.")
+        return port - self.port_range.start
+
+    def _intern(self, client_ip: str) -> int:
+        index = self._ip_index.get(client_ip)
+        if index is None:
+            if self._free_indexes:
+                index = self._free_indexes.pop()
+                self._ips[index] = client_ip
+            else:
+                index = len(self._ips)
+                self._ips.append(client_ip)
+                self._ports.append(set())
+                self._clients.append(None)
+            self._ip_index[client_ip] = index
+        return index
+
+    def _release_index_if_empty(self, index: int):
+        if not self._ports[index]:
+            self._untag(index)
+            del self._ip_index[self._ips[index]]
+            self._ips[index] = None
+            self._free_indexes.append(index)
+
+    def _untag(self, index: int):
+        client_id = self._clients[index]
+        if client_id is not None:
+            ips = self._client_ips[client_id]
+            ips.discard(self._ips[index])
+            if not ips:
+                del self._client_ips[client_id]
+            self._clients[index] = None
+
+    def owner(self, port: int) -> Optional[str]:
+        """Returns the client IP the port is forwarded to, or None."""
+        if port not in self.port_range:
+            return None
+        return self._ips[self._owners[port - self.port_range.start]]
+
+    def is_free(self, port: int) -> bool:
+        """True if the port is inside the exposed range and not forwarded to anyone."""
+        return port in self.port_range and self._owners[port - self.port_range.start] == 0
+
+    def ports_of(self, client_ip: str) -> FrozenSet[int]:
+        index = self._ip_index.get(client_ip)
+        return frozenset(self._ports[index]) if index is not None else frozenset()
+
+    def client_of(self, client_ip: str) -> Optional[str]:
+        """Returns the client_id the forwards of client_ip belong to, or None if unknown."""
+        index = self._ip_index.get(client_ip)
+        return self._clients[index] if index is not None else None
+
+    def set_client(self, client_ip: str, client_id: Optional[str]):
+        """Tags the forwards of client_ip as belonging to client_id. No-op if the IP owns no ports."""
+        index = self._ip_index.get(client_ip)
+        if index is None or self._clients[index] == client_id:
+            return
+        self._untag(index)
+        if client_id is not None:
+            self._clients[index] = client_id
+            self._client_ips.setdefault(client_id, set()).add(client_ip)
+
+    def forwards_of_client(self, client_id: str) -> Dict[str, FrozenSet[int]]:
+        """{ "vpn_client_ip": {ports} } for every IP of client_id."""
+        return {ip: self.ports_of(ip) for ip in self._client_ips.get(client_id, ())}
+
+    def forwards_by_client(self) -> Dict[str, Dict[str, FrozenSet[int]]]:
+        """{ "client_id": { "vpn_client_ip": {ports} } } for all clients with forwards."""
+        return {client_id: self.forwards_of_client(client_id) for client_id in list(self._client_ips)}
+
+    def assign(self, client_ip: str, ports: Iterable[int]):
+        """Records ports as forwarded to client_ip. Raises ValueError if one belongs to another IP."""
+        ports = list(ports)
+        slots = [self._slot(port) for port in ports]
+        index = self._ip_index.get(client_ip, -1)
+        for port, slot in zip(ports, slots):
+            if self._owners[slot] not in (0, index):
+                raise ValueError(f"Port {port} is already forwarded to {self._ips[self._owners[slot]]}.")
+        if not ports:
+            return
+        index = self._intern(client_ip)
+        for slot in slots:
+            self._owners[slot] = index
+        self._ports[index].update(ports)
+        self.free_map.mark_owned(ports)
+
+    def release(self, client_ip: str, ports: Iterable[int]):
+        """Frees those of the given ports that are forwarded to client_ip."""
+        index = self._ip_index.get(client_ip)
+        if index is None:
+            return
+        owned = self._ports[index]
+        released = []
+        for port in ports:
+            if port in owned:
+                owned.discard(port)
+                self._owners[port - self.port_range.start] = 0
+                released.append(port)
+        self.free_map.mark_released(released)
+        self._release_index_if_empty(index)
+
+    def release_all(self, client_ip: str) -> FrozenSet[int]:
+        """Frees every port of client_ip and returns them."""
+        ports = self.ports_of(client_ip)
+        self.release(client_ip, ports)
+        return ports
+
+    def load(self, forwards: Mapping[str, Iterable[int]], clients: Optional[Mapping[str, str]] = None):
+        """
+        Replaces the whole table, e.g. with the forwards parsed from the kernel at startup, and
+        tags the IPs with the client_ids given in clients ({ "vpn_client_ip": "client_id" }).
+        Ports outside the exposed range are never reached by our jump rules, so they are dropped.
+        """
+        self._owners = array("H", [0]) * len(self.port_range)
+        self._ips, self._ports, self._clients = [None], [set()], [None]
+        self._ip_index, self._free_indexes, self._client_ips = {}, [], {}
+        self.free_map.clear_owned()
+        for client_ip, ports in forwards.items():
+            in_range = {port for port in ports if port in self.port_range}
+            if len(in_range) != len(set(ports)):
+                logging.warning(
+                    f"Ignoring {len(set(ports)) - len(in_range)} forward(s) of {client_ip} outside the exposed range."
+                )
+            self.assign(client_ip, in_range)
+            self.set_client(client_ip, (clients or {}).get(client_ip))
+
+    @property
+    def port_count(self) -> int:
+        return sum(len(ports) for ports in self._ports)
+
+
+class ForwardedPortsView(Mapping[str, FrozenSet[int]]):
+    """Read-only { "vpn_client_ip": {port1, port2} } view of a PortOwnershipTable."""
+
+    def __init__(self, table: PortOwnershipTable):
+        self._table = table
+
+    def __getitem__(self, client_ip: str) -> FrozenSet[int]:
+        index = self._table._ip_index.get(client_ip)
+        if index is None:
+            raise KeyError(client_ip)
+        return frozenset(self._table._ports[index])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._table._ip_index))
+
+    def __len__(self) -> int:
+        return len(self._table._ip_index)
+
+    def __contains__(self, client_ip: object) -> bool:
+        return client_ip in self._table._ip_index
@@ -0,0 +1,45 @@
+# src/services/periodic.py
+
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable, Optional
+
+
+class PeriodicTask:
+    """
+    Runs job every interval seconds (plus a random jitter of up to `jitter` seconds) in a background
+    task. A failing run is logged as "<name> failed" and the loop carries on with the next one.
+    """
+
+    def __init__(self, name: str, job: Callable[[], Awaitable], interval: float, jitter: float = 0.0):
+        self.name = name
+        self.job = job
+        self.interval = interval
+        self.jitter = jitter
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval + (random.uniform(0, self.jitter) if self.jitter > 0 else 0.0))
+            try:
+                await self.job()
+            except Exception as e:
+                logging.error(f"{self.name} failed: {e}", exc_info=True)
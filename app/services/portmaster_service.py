@@ -3,150 +3,536 @@
 import asyncio
 import logging
 import secrets
-from typing import Dict, Set, Tuple, List, Optional
+import time
+from contextlib import AsyncExitStack
+from typing import Dict, Mapping, FrozenSet, Set, Tuple, List, Optional, Union
 
 from app.core.config import Config
-from app.system.iptables import IPTablesManager, IPTablesError
+from app.services.group_commit import (
+    Allocate, Disconnect, GroupCommitWriter, PortUpdate, Roam, RuleRequest, RuleResult,
+)
+from app.services.intervals import IntervalIndex, PortPool
+from app.services.leases import LeaseManager
+from app.services.reaper import IdlePeerReaper
+from app.services.locks import KeyedLock, SharedExclusiveLock, WaitHistogram
+from app.services.ownership import PortOwnershipTable
+from app.services.reconciler import RuleReconciler, forward_diff
+from app.services.rescanner import HostPortRescanner
+from app.services.store import ClientRow, StateStore, hash_api_key
+from app.system.backends import PortForwardBackend
+from app.system.iptables import IPTablesError
+from app.system.peers import PeerActivityReader, parse_peer_sources
 from app.system.scanner import HostPortScanner
 from app.api.models import ClientInfo  # We need this for type hinting
 
 
 class PortMasterService:
-    def __init__(self, config: Config, iptables_manager: IPTablesManager, host_port_scanner: HostPortScanner):
+    def __init__(self, config: Config, iptables_manager: PortForwardBackend, host_port_scanner: HostPortScanner):
         self.config = config
         self.iptables = iptables_manager
         self.scanner = host_port_scanner
-        self._lock = asyncio.Lock()
+
+        # --- LOCKS ---
+        # Without the group commit writer, rule changes of one client IP are serialized and
+        # different IPs apply their rules concurrently.
+        self._ip_locks = KeyedLock()
+        # Held shared by every rule change and exclusively by whole-ruleset work (startup, reconcile).
+        self._rules_lock = SharedExclusiveLock()
+        # Guards the client database only; never held across iptables calls.
+        self._clients_lock = asyncio.Lock()
 
         # --- STATE ATTRIBUTES ---
-        # Stores forwarded ports: { "vpn_client_ip": {port1, port2} }
-        self.forwarded_ports: Dict[str, Set[int]] = {}
+        # Port -> client IP owner index; forwarded_ports is derived from it
+        self.ownership = PortOwnershipTable(config.exposed_ports)
         # Stores ports from global pool that are occupied by host processes
         self.unavailable_ports: Set[int] = set()
         # --- NEW: In-memory client database ---
         # { "client_id": ClientInfo_object }
         self.clients: Dict[str, ClientInfo] = {}
-        # For fast lookup: { "api_key": "client_id" }
+        # For fast lookup: { hash_api_key(api_key): "client_id" }
         self.api_key_to_client_id: Dict[str, str] = {}
+        # Sub-pool of every client: { "client_id": PortPool }, plus an index of all their intervals
+        self.client_pools: Dict[str, PortPool] = {}
+        self.pool_index = IntervalIndex()
+        # Rule requests queued or being applied, per client IP
+        self._in_flight: Dict[str, int] = {}
+
+        # --- METRICS ---
+        self.fast_path_hits = 0
+        self.fast_path_misses = 0
+        # How long rule requests wait for the locks (or the group commit queue) before they are applied
+        self.lock_wait = WaitHistogram()
+
+        # --- PERSISTENCE ---
+        state_db = config.state_db
+        if config.backend == "simulate" and state_db:
+            # A dry run must not journal modelled forwards into (or adopt clients from) the real database.
+            logging.info(f"Simulation backend: using an in-memory state database instead of {state_db}.")
+            state_db = ":memory:"
+        self.store = StateStore(state_db)
+
+        # --- BACKGROUND TASKS ---
+        self.reconciler = RuleReconciler(self, config.reconcile_interval)
+        self.rescanner = HostPortRescanner(self, config.rescan_interval, config.rescan_jitter)
+        self.writer = GroupCommitWriter(self, config.group_commit_window, config.group_commit_max_batch)
+        self.leases = LeaseManager(self, config.lease_ttl, config.lease_tick)
+        self.reaper = IdlePeerReaper(
+            self, PeerActivityReader(parse_peer_sources(config.peer_sources)),
+            config.peer_reap_interval, config.peer_idle_timeout,
+        )
 
     async def initialize(self):
         logging.info("Initializing PortManagerService...")
-        async with self._lock:
+        async with self._rules_lock.exclusive():
+            stored_clients, journal = await self.store.load()
+            self._restore_clients(stored_clients)
+            await self.iptables.ensure_chains()
             host_ports = await self.scanner.get_listening_ports()
             config_ports = set(self.config.exposed_ports)
+            self.ownership.free_map.mark_host_occupied(freed=self.unavailable_ports)
             self.unavailable_ports = config_ports.intersection(host_ports)
-            self.forwarded_ports = await self.iptables.parse_existing_rules()
+            self.ownership.free_map.mark_host_occupied(occupied=self.unavailable_ports)
+            try:
+                kernel_ports: Optional[Dict[str, Set[int]]] = await self.iptables.parse_existing_rules()
+            except IPTablesError as e:
+                logging.error(f"Failed to read existing kernel rules: {e}")
+                kernel_ports = None
+            if journal is None:
+                # No journal yet: the kernel rules are all we know, and not which client they belong to.
+                # If they cannot be read either, we start empty.
+                self.ownership.load(kernel_ports or {})
+                self.store.replace_forwards(self.forwarded_ports)
+            else:
+                # The journal is the source of truth; only the difference goes to the kernel.
+                journaled_ports, ip_clients = journal
+                self.ownership.load(journaled_ports, {
+                    ip: client_id for ip, client_id in ip_clients.items() if client_id in self.clients
+                })
+                if kernel_ports is not None:
+                    await self._restore_kernel_rules(kernel_ports)
+                # Otherwise the reconciler brings the kernel in line once the rules can be read.
         logging.info("PortManagerService initialized successfully.")
 
+    def _restore_clients(self, stored_clients: List[ClientRow]):
+        exposed = self.config.exposed_ports
+        for client_id, api_key_hash, port_ranges in stored_clients:
+            try:
+                # EXPOSED_PORT_RANGE may have shrunk since the client was created; the stored row is kept.
+                stored = PortPool.parse(port_ranges)
+                pool = stored.clipped(exposed)
+                if not pool:
+                    raise ValueError(f"no port is left inside the exposed range {exposed.start}-{exposed.stop - 1}")
+                if pool.intervals != stored.intervals:
+                    logging.warning(
+                        f"Stored client '{client_id}' is limited to {pool}: port range '{port_ranges}' "
+                        f"reaches outside the exposed range {exposed.start}-{exposed.stop - 1}."
+                    )
+                self.pool_index.add(client_id, pool)
+            except ValueError as e:
+                logging.error(f"Skipping stored client '{client_id}' with port range '{port_ranges}': {e}")
+                continue
+            self.clients[client_id] = ClientInfo(
+                client_id=client_id, api_key=api_key_hash, allowed_port_ranges=pool.to_strings()
+            )
+            self.client_pools[client_id] = pool
+            self.api_key_to_client_id[api_key_hash] = client_id
+
+    async def _restore_kernel_rules(self, kernel_ports: Dict[str, Set[int]]):
+        adds, removes = forward_diff(kernel_ports, self.forwarded_ports)
+        if not adds and not removes:
+            return
+        logging.info(
+            f"Restoring journaled forwards: adding {sum(len(p) for p in adds.values())} and "
+            f"removing {sum(len(p) for p in removes.values())} kernel forward(s)."
+        )
+        try:
+            await self.iptables.apply_batch(adds=adds, removes=removes)
+        except IPTablesError as e:
+            # The reconciler retries on its next run.
+            logging.error(f"Failed to restore journaled forwards: {e}")
+
+    @property
+    def forwarded_ports(self) -> Mapping[str, FrozenSet[int]]:
+        """Read-only view of forwarded ports: { "vpn_client_ip": {port1, port2} }"""
+        return self.ownership.view
+
+    def start_background_tasks(self):
+        self.store.start()
+        self.reconciler.start()
+        self.rescanner.start()
+        self.writer.start()
+        self.leases.start()
+        self.reaper.start()
+
+    async def shutdown(self):
+        logging.info("Shutting down PortManagerService...")
+        await self.reconciler.stop()
+        await self.rescanner.stop()
+        await self.reaper.stop()
+        await self.leases.stop()
+        await self.writer.stop()
+        await self.store.close()
+        await self.iptables.close()
+
+    def get_metrics(self) -> Dict[str, float]:
+        metrics: Dict[str, float] = {
+            "forwarded_client_ips": len(self.forwarded_ports),
+            "forwarded_ports": self.ownership.port_count,
+            "unavailable_ports": len(self.unavailable_ports),
+            "managed_clients": len(self.clients),
+            "fast_path_hits": self.fast_path_hits,
+            "fast_path_misses": self.fast_path_misses,
+            "fast_path_hit_ratio": self.fast_path_hits / max(1, self.fast_path_hits + self.fast_path_misses),
+        }
+        metrics.update(self.lock_wait.metrics("lock_wait"))
+        metrics.update(self.reconciler.metrics())
+        metrics.update(self.rescanner.metrics())
+        metrics.update(self.writer.metrics())
+        metrics.update(self.leases.metrics())
+        metrics.update(self.reaper.metrics())
+        metrics.update(self.store.metrics())
+        # Only some backends report metrics (e.g. the simulation's ruleset size and traversal depth).
+        backend_metrics = getattr(self.iptables, "metrics", None)
+        if backend_metrics is not None:
+            metrics.update(backend_metrics())
+        return metrics
+
     # --- NEW: Client Management Methods (for Admin) ---
 
     async def create_client(self, client_id: str, port_range_str: str) -> Optional[ClientInfo]:
-        async with self._lock:
+        async with self._clients_lock:
             if client_id in self.clients:
                 logging.warning(f"Admin tried to create client with existing ID: {client_id}")
                 return None  # Or raise a specific exception
 
             try:
-                start_str, end_str = port_range_str.split("-")
-                start, end = int(start_str), int(end_str)
-                if not (start in self.config.exposed_ports and end in self.config.exposed_ports and start <= end):
+                pool = PortPool.parse(port_range_str)
+                exposed = self.config.exposed_ports
+                if not pool or any(start not in exposed or end not in exposed for start, end in pool.intervals):
                     raise ValueError("Provided range is not a valid sub-set of the global exposed range.")
+                self.pool_index.add(client_id, pool)
 
                 new_api_key = secrets.token_hex(16)
+                api_key_hash = hash_api_key(new_api_key)
+                # Only the hash is kept; the key itself is returned this once.
                 client_data = ClientInfo(
                     client_id=client_id,
-                    api_key=new_api_key,
-                    allowed_ports=list(range(start, end + 1))
+                    api_key=api_key_hash,
+                    allowed_port_ranges=pool.to_strings()
                 )
                 self.clients[client_id] = client_data
-                self.api_key_to_client_id[new_api_key] = client_id
+                self.client_pools[client_id] = pool
+                self.store.save_client(client_id, api_key_hash, str(pool))
+                await self.store.flush()
+                self.api_key_to_client_id[api_key_hash] = client_id
                 logging.info(f"Admin created new client '{client_id}' with port range {port_range_str}")
-                return client_data
+                return client_data.model_copy(update={"api_key": new_api_key})
             except ValueError as e:
                 logging.error(f"Admin provided invalid port range '{port_range_str}' for client '{client_id}': {e}")
                 return None
 
     async def delete_client(self, client_id: str) -> bool:
-        async with self._lock:
+        async with self._clients_lock:
             if client_id not in self.clients:
                 return False
 
-            # Clean up forwarded ports for this client across all their possible IPs
             client_to_remove = self.clients[client_id]
-            ports_to_remove = set()
-            for ip, rules in list(self.forwarded_ports.items()):
-                # This logic assumes we can identify which rules belong to the client.
-                # A more robust system would store { client_id: { ip: {ports} } }
-                # For now, we assume any user of this key is this client.
-                # On deletion, we can't know the IP, so this part is tricky.
-                # A better approach: do nothing here, let ports be cleaned up by user disconnect.
-                pass
-
             del self.api_key_to_client_id[client_to_remove.api_key]
             del self.clients[client_id]
-            logging.info(f"Admin deleted client '{client_id}'")
+            self.pool_index.remove(client_id, self.client_pools.pop(client_id))
+            self.store.delete_client(client_id)
+            await self.store.flush()
+
+            # Clean up forwarded ports for this client across all their IPs, as one batch
+            client_ips = list(self.ownership.forwards_of_client(client_id))
+            results = await self._submit_many([Disconnect(client_ip) for client_ip in client_ips])
+            for client_ip, result in zip(client_ips, results):
+                if isinstance(result, Exception):
+                    logging.error(f"Failed to remove forwards of deleted client '{client_id}' at {client_ip}: {result}")
+            logging.info(f"Admin deleted client '{client_id}' and removed the forwards of {len(client_ips)} IP(s)")
             return True
 
     def get_all_clients(self) -> List[ClientInfo]:
         return list(self.clients.values())
 
+    def forwards_by_client(self) -> Dict[str, Dict[str, FrozenSet[int]]]:
+        """{ "client_id": { "vpn_client_ip": {ports} } }; forwards adopted from the kernel have no client."""
+        return self.ownership.forwards_by_client()
+
+    def get_client_pool(self, client_id: str) -> PortPool:
+        """The client's sub-pool; empty if the client has been deleted in the meantime."""
+        return self.client_pools.get(client_id, PortPool())
+
     def get_client_by_key(self, api_key: str) -> Optional[ClientInfo]:
-        client_id = self.api_key_to_client_id.get(api_key)
+        """The client with the given API key. Its ClientInfo carries the key's hash, not the key."""
+        client_id = self.api_key_to_client_id.get(hash_api_key(api_key))
         if client_id:
             return self.clients.get(client_id)
         return None
 
     # --- MODIFIED: User-facing Methods ---
 
+    def unchanged_ports(
+            self, client_ip: str, requested_ports_set: Set[int], client_id: Optional[str] = None
+    ) -> Optional[FrozenSet[int]]:
+        """
+        Lock-free check for resubmissions of the current state (clients resend their full port list
+        on every network change). Returns the client's forwards if update_client_ports would be a
+        no-op, i.e. nothing is queued for the IP, the request equals its forwards and they are
+        already tagged with client_id (if given); otherwise None.
+        """
+        if not self._in_flight.get(client_ip) and (
+                client_id is None or self.ownership.client_of(client_ip) == client_id):
+            current_ports = self.ownership.ports_of(client_ip)
+            if current_ports == requested_ports_set:
+                self.fast_path_hits += 1
+                self.leases.renew(client_ip)
+                return current_ports
+        self.fast_path_misses += 1
+        return None
+
     async def update_client_ports(
-            self, client_ip: str, requested_ports_set: Set[int], allowed_ports: List[int]
+            self, client_ip: str, requested_ports_set: Set[int], allowed_ports: PortPool,
+            client_id: Optional[str] = None,
     ) -> Tuple[Set[int], Set[int]]:
-        async with self._lock:
-            allowed_ports_set = set(allowed_ports)
-            old_ports_for_client = self.forwarded_ports.get(client_ip, set())
-            other_clients_ports = {p for ip, ports in self.forwarded_ports.items() if ip != client_ip for p in ports}
+        return await self._submit_roaming(PortUpdate(client_ip, set(requested_ports_set), allowed_ports, client_id))
+
+    async def allocate_ports(
+            self, client_ip: str, count: int, allowed_ports: PortPool, client_id: Optional[str] = None
+    ) -> Set[int]:
+        """
+        Forwards up to count free ports of the client's sub-pool to client_ip and returns them.
+        Raises IPTablesError if the rules could not be written.
+        """
+        allocated, _ = await self._submit_roaming(Allocate(client_ip, count, allowed_ports, client_id))
+        return allocated
 
-            ports_to_remove = old_ports_for_client - requested_ports_set
-            for port in ports_to_remove:
-                await self.iptables.remove_port_forward(client_ip, port)
+    def available_port_ranges(self, allowed_ports: PortPool) -> PortPool:
+        """The ports of a sub-pool that are neither forwarded nor occupied by host processes."""
+        return PortPool(self.ownership.free_map.free_intervals(allowed_ports))
 
-            ports_to_add = requested_ports_set - old_ports_for_client
-            successful_adds, failed_adds = set(), set()
+    async def disconnect_client_ip(self, client_ip: str) -> int:
+        # This now just disconnects an IP, not a logical client
+        return await self._submit(Disconnect(client_ip))
+
+    def heartbeat(self, client_ip: str) -> int:
+        """Renews the lease on the forwards of client_ip and returns how many ports it has forwarded."""
+        self.leases.renew(client_ip)
+        return len(self.ownership.ports_of(client_ip))
+
+    async def expire_client_ips(self, client_ips: List[str]):
+        """Removes every forward of the given client IPs, as one batch."""
+        await self._submit_many([Disconnect(client_ip) for client_ip in client_ips])
+
+    # --- Rule application ---
+
+    async def _submit(self, request: RuleRequest) -> RuleResult:
+        """Hands a rule change to the group commit writer, or applies it directly if that is disabled."""
+        result = (await self._submit_many([request]))[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def _submit_roaming(self, request: Union[PortUpdate, Allocate]) -> RuleResult:
+        """
+        Submits a client's request. If the client's forwards are still at other IPs (its VPN address
+        changed), a Roam moving them to the request's IP is submitted together with it.
+        """
+        previous_ips = []
+        if self.config.roaming and request.client_id is not None:
+            previous_ips = [ip for ip in self.ownership.forwards_of_client(request.client_id) if ip != request.client_ip]
+        if not previous_ips:
+            return await self._submit(request)
+
+        roam_result, result = await self._submit_many([Roam(request.client_ip, request.client_id, previous_ips), request])
+        if isinstance(roam_result, Exception):
+            logging.error(f"Failed to move the forwards of client '{request.client_id}' to {request.client_ip}: {roam_result}")
+        else:
+            logging.info(
+                f"Client '{request.client_id}' roamed from {', '.join(previous_ips)} to {request.client_ip}; "
+                f"moved {roam_result} forward(s)."
+            )
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def _submit_many(self, requests: List[RuleRequest]) -> List[Union[RuleResult, Exception]]:
+        """
+        Submits requests together: queued at once for the group commit writer, or, without it,
+        committed as one batch under the locks of all their IPs (taken in sorted order).
+        Every IP's lease is renewed afterwards, or dropped if it has no forwards left. Returns once the
+        changes are in the state database.
+        """
+        client_ips = sorted(
+            {request.client_ip for request in requests}
+            | {ip for request in requests if isinstance(request, Roam) for ip in request.from_ips}
+        )
+        for client_ip in client_ips:
+            self._in_flight[client_ip] = self._in_flight.get(client_ip, 0) + 1
+        try:
+            if self.writer.enabled:
+                results = await asyncio.gather(
+                    *(self.writer.submit(request) for request in requests), return_exceptions=True
+                )
+            else:
+                async with AsyncExitStack() as stack:
+                    started = time.perf_counter()
+                    await stack.enter_async_context(self._rules_lock.shared())
+                    for client_ip in client_ips:
+                        await stack.enter_async_context(self._ip_locks.hold(client_ip))
+                    waited = time.perf_counter() - started
+                    for _ in requests:
+                        self.lock_wait.observe(waited)
+                    results = await self._commit_requests(requests)
+            # On the next start the journal decides which kernel rules stay, so a change is only
+            # acknowledged once it is journaled. Concurrent requests share the write.
+            await self.store.flush()
+            return results
+        finally:
+            for client_ip in client_ips:
+                self._in_flight[client_ip] -= 1
+                if not self._in_flight[client_ip]:
+                    del self._in_flight[client_ip]
+                self.leases.renew(client_ip)
 
+    def _plan_requests(
+            self, requests: List[RuleRequest], working: Dict[str, Set[int]], original: Dict[str, Set[int]]
+    ) -> list:
+        """
+        Validates requests in order against the ownership table and merges them into one diff.
+        Fills in the working port set per touched IP and its state before the batch as it goes, so
+        the caller can roll back even if planning fails half-way, and returns each request's result.
+        Accepted additions are reserved in the ownership table right away, so neither a later
+        request in the batch nor a concurrent commit can claim them.
+        """
+        results: list = []
+
+        def touch(client_ip: str) -> Set[int]:
+            if client_ip not in working:
+                original[client_ip] = set(self.ownership.ports_of(client_ip))
+                working[client_ip] = set(original[client_ip])
+            return working[client_ip]
+
+        for request in requests:
+            client_ip = request.client_ip
+            current = touch(client_ip)
+
+            if isinstance(request, Roam):
+                # Ownership passes straight from the old IPs to the new one, so the ports are never
+                # free in between; the kernel swaps the rules in the same transaction.
+                moved = 0
+                for previous_ip in request.from_ips:
+                    if previous_ip == client_ip or self.ownership.client_of(previous_ip) != request.client_id:
+                        continue
+                    previous = touch(previous_ip)
+                    ports = set(previous)
+                    previous.clear()
+                    self.ownership.release(previous_ip, ports)
+                    self.ownership.assign(client_ip, ports)
+                    current.update(ports)
+                    moved += len(ports)
+                results.append(moved)
+                continue
+
+            if isinstance(request, Disconnect):
+                results.append(len(current))
+                current.clear()
+                continue
+
+            if isinstance(request, Allocate):
+                # The free map has OWNED set for everything reserved so far, so picks never collide.
+                allocated = set(self.ownership.free_map.allocate(request.allowed, request.count))
+                self.ownership.assign(client_ip, allocated)
+                current.update(allocated)
+                results.append((allocated, set()))
+                continue
+
+            ports_to_add = request.requested - current
+            candidate_adds, failed_adds = set(), set()
             for port in ports_to_add:
-                if port not in allowed_ports_set:
+                if port not in self.config.exposed_ports:
+                    logging.warning(f"Port {port} requested by the client at {client_ip} is outside the exposed range.")
+                    failed_adds.add(port)
+                elif port not in request.allowed:
                     logging.warning(f"Port {port} is outside the allowed sub-pool for the client at {client_ip}.")
                     failed_adds.add(port)
                 elif port in self.unavailable_ports:
                     failed_adds.add(port)
-                elif port in other_clients_ports:
+                elif self.ownership.owner(port) not in (None, client_ip):
                     failed_adds.add(port)
                 else:
-                    try:
-                        await self.iptables.add_port_forward(client_ip, port)
-                        successful_adds.add(port)
-                    except IPTablesError:
-                        failed_adds.add(port)
-
-            current_client_ports = (old_ports_for_client - ports_to_remove).union(successful_adds)
-            if current_client_ports:
-                self.forwarded_ports[client_ip] = current_client_ports
-            elif client_ip in self.forwarded_ports:
-                del self.forwarded_ports[client_ip]
+                    candidate_adds.add(port)
+            self.ownership.assign(client_ip, candidate_adds - original[client_ip])
+            current.intersection_update(request.requested)
+            current.update(candidate_adds)
+            results.append((candidate_adds, failed_adds))
+        return results
 
-            all_failed = failed_adds.union(ports_to_add - successful_adds)
-            return successful_adds, all_failed
+    def _finish_plan(
+            self, requests: List[RuleRequest], working: Dict[str, Set[int]], original: Dict[str, Set[int]],
+            committed: bool,
+    ):
+        """
+        Settles the ownership table once a planned batch has been committed or rejected: ports the
+        batch dropped (committed) or reserved (rejected) are released, and ports and client tags a
+        rejected batch moved away from an IP are given back to it.
+        """
+        for client_ip, ports in working.items():
+            owned = self.ownership.ports_of(client_ip)
+            keep = ports if committed else original[client_ip]
+            self.ownership.release(client_ip, owned - keep)
+        if not committed:
+            for client_ip, ports in original.items():
+                self.ownership.assign(client_ip, ports - self.ownership.ports_of(client_ip))
+            for request in requests:
+                if isinstance(request, Roam):
+                    for previous_ip in request.from_ips:
+                        self.ownership.set_client(previous_ip, request.client_id)
 
-    async def disconnect_client_ip(self, client_ip: str) -> int:
-        # This now just disconnects an IP, not a logical client
-        async with self._lock:
-            if client_ip not in self.forwarded_ports: return 0
+    async def _commit_requests(self, requests: List[RuleRequest]) -> List[Union[RuleResult, Exception]]:
+        """
+        Applies a batch of rule requests with one kernel transaction and returns one result per request.
+        If the combined transaction fails, the batch is split in halves and retried, so one bad request
+        cannot fail the others and costs only O(log n) extra commits.
+        """
+        working: Dict[str, Set[int]] = {}
+        original: Dict[str, Set[int]] = {}
+        committed = False
+        try:
+            results = self._plan_requests(requests, working, original)
+            adds = {ip: working[ip] - original[ip] for ip in working}
+            removes = {ip: original[ip] - working[ip] for ip in working}
+            if len(requests) == 1 and isinstance(requests[0], Disconnect):
+                if original[requests[0].client_ip]:
+                    await self.iptables.flush_client(requests[0].client_ip, original[requests[0].client_ip])
+            else:
+                # All removals and additions go to the kernel as one transaction.
+                await self.iptables.apply_batch(adds=adds, removes=removes)
+            committed = True
+            self.store.record_forwards(adds, removes)
+        except IPTablesError as e:
+            # The old rules are still in place: the backend reverts a batch the kernel committed only
+            # in part, and if even that fails, the reconciler repairs the rules on its next run.
+            error = e
+        finally:
+            self._finish_plan(requests, working, original, committed)
 
-            ports_to_remove = self.forwarded_ports.get(client_ip, set())
-            removed_count = 0
-            for port in list(ports_to_remove):
-                await self.iptables.remove_port_forward(client_ip, port)
-                removed_count += 1
+        if not committed:
+            if len(requests) > 1:
+                logging.warning(f"Group commit of {len(requests)} requests failed, retrying it in halves.")
+                middle = len(requests) // 2
+                return await self._commit_requests(requests[:middle]) + await self._commit_requests(requests[middle:])
+            if isinstance(requests[0], (Disconnect, Roam, Allocate)):
+                # An allocation that could not be written must not look like an exhausted pool.
+                return [error]
+            # PortUpdate reports the ports it could not forward, as it always has.
+            candidate_adds, failed_adds = results[0]
+            return [(set(), failed_adds | candidate_adds)]
 
-            del self.forwarded_ports[client_ip]
-            return removed_count
\ No newline at end of file
+        # The last request of an IP decides which client its forwards belong to.
+        for request in requests:
+            if not isinstance(request, Disconnect) and request.client_id is not None:
+                self.ownership.set_client(request.client_ip, request.client_id)
+        for client_ip in working:
+            self.store.record_client_ip(client_ip, self.ownership.client_of(client_ip))
+        return results
@@ -0,0 +1,84 @@
+# src/services/reaper.py
+
+import logging
+import time
+from typing import TYPE_CHECKING, Dict, List
+
+from app.services.periodic import PeriodicTask
+from app.system.peers import PeerActivityReader
+
+if TYPE_CHECKING:
+    from app.services.portmaster_service import PortMasterService
+
+
+class IdlePeerReaper:
+    """
+    Background task that removes the forwards of VPN peers that have been offline for too long.
+
+    Every interval it reads peer activity in bulk from the VPN containers (WireGuard/AmneziaWG
+    handshakes, OpenVPN status) and folds it into an in-memory last-seen cache. A forwarded IP
+    that no source reports starts its idle clock when it is first noticed, so OpenVPN clients,
+    which only appear while connected, are handled too. IPs idle for longer than idle_timeout
+    lose all their forwards in one batch. Nothing is reaped in a run where a source was unreadable.
+    """
+
+    def __init__(self, service: "PortMasterService", reader: PeerActivityReader, interval: float, idle_timeout: float):
+        self.service = service
+        self.reader = reader
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self._loop = PeriodicTask("Idle peer reaping", self.reap_once, interval)
+        # { "vpn_client_ip": epoch seconds of the last known activity }
+        self.last_seen: Dict[str, float] = {}
+
+        # --- METRICS ---
+        self.runs = 0
+        self.last_reaped = 0
+        self.reaped_total = 0
+
+    def start(self):
+        if self.interval > 0 and self.reader.sources and not self._loop.running:
+            self._loop.start()
+            logging.info(
+                f"Idle peer reaper started (interval {self.interval}s, idle timeout {self.idle_timeout}s, "
+                f"{len(self.reader.sources)} source(s))."
+            )
+
+    async def stop(self):
+        await self._loop.stop()
+
+    async def reap_once(self) -> List[str]:
+        """Refreshes the last-seen cache and removes the forwards of idle peers. Returns the reaped IPs."""
+        activity = await self.reader.read()
+        if activity is None:
+            return []
+
+        now = time.time()
+        forwarded = self.service.forwarded_ports
+        for client_ip, last_active in activity.items():
+            if client_ip in forwarded:
+                self.last_seen[client_ip] = max(last_active, self.last_seen.get(client_ip, 0.0))
+        # Forget IPs without forwards; start the clock for forwarded IPs no source knows about.
+        self.last_seen = {ip: seen for ip, seen in self.last_seen.items() if ip in forwarded}
+        for client_ip in forwarded:
+            self.last_seen.setdefault(client_ip, now)
+
+        idle = [ip for ip, seen in self.last_seen.items() if now - seen > self.idle_timeout]
+        if idle:
+            logging.info(f"Removing forwards of {len(idle)} peer(s) idle for over {self.idle_timeout}s: {sorted(idle)}")
+            await self.service.expire_client_ips(idle)
+            for client_ip in idle:
+                self.last_seen.pop(client_ip, None)
+
+        self.runs += 1
+        self.last_reaped = len(idle)
+        self.reaped_total += len(idle)
+        return idle
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "reaper_runs": self.runs,
+            "reaper_tracked_peers": len(self.last_seen),
+            "reaper_last_reaped": self.last_reaped,
+            "reaper_reaped_total": self.reaped_total,
+        }
@@ -0,0 +1,110 @@
+# src/services/reconciler.py
+
+import logging
+import time
+from typing import TYPE_CHECKING, AbstractSet, Dict, Mapping, Set, Tuple
+
+from app.services.periodic import PeriodicTask
+from app.system.iptables import IPTablesError
+
+if TYPE_CHECKING:
+    from app.services.portmaster_service import PortMasterService
+
+
+def forward_diff(
+        current: Mapping[str, AbstractSet[int]], desired: Mapping[str, AbstractSet[int]]
+) -> Tuple[Dict[str, Set[int]], Dict[str, Set[int]]]:
+    """The forwards to add to and remove from current to get desired, as apply_batch arguments."""
+    adds: Dict[str, Set[int]] = {}
+    removes: Dict[str, Set[int]] = {}
+    for client_ip in set(current) | set(desired):
+        have, want = current.get(client_ip, frozenset()), desired.get(client_ip, frozenset())
+        if want - have:
+            adds[client_ip] = set(want - have)
+        if have - want:
+            removes[client_ip] = set(have - want)
+    return adds, removes
+
+
+class RuleReconciler:
+    """
+    Background task that keeps the kernel ruleset in line with PortMasterService state.
+
+    Every interval it takes a cheap fingerprint of our rules. The backend keeps the fingerprint it
+    expects up to date across its own batches, so only when the two differ, i.e. after an outside
+    change or a batch with an unclear outcome, does it restore missing chains and jumps
+    (a flushed PREROUTING cuts off every forward at once), parse the kernel rules, compute the
+    minimal diff against the service's forwards and apply it in one batch. The service state is
+    the source of truth: forwards missing from the kernel are re-added, unknown ones removed.
+    """
+
+    def __init__(self, service: "PortMasterService", interval: float):
+        self.service = service
+        self.interval = interval
+        self._loop = PeriodicTask("Rule reconcile", self.reconcile_once, interval)
+
+        # --- METRICS ---
+        self.runs = 0
+        self.last_duration = 0.0
+        self.last_diff_size = 0
+        self.total_diff_size = 0
+
+    def start(self):
+        if self.interval > 0 and not self._loop.running:
+            self._loop.start()
+            logging.info(f"Rule reconciler started (interval {self.interval}s).")
+
+    async def stop(self):
+        await self._loop.stop()
+
+    async def reconcile_once(self) -> int:
+        """Checks the fingerprint and, if it changed, repairs the kernel ruleset. Returns the diff size."""
+        fingerprint = await self.service.iptables.fingerprint()
+        if fingerprint == self.service.iptables.expected_fingerprint.value:
+            return 0
+
+        started = time.perf_counter()
+        async with self.service._rules_lock.exclusive():
+            try:
+                diff_size = await self.service.iptables.ensure_chains()
+            except IPTablesError:
+                # The expected fingerprint still differs, so the next run tries again.
+                return 0
+            if diff_size:
+                logging.warning(f"Kernel chains drifted: restored {diff_size} chain declaration(s) and jump(s).")
+            try:
+                kernel_ports = await self.service.iptables.parse_existing_rules()
+            except IPTablesError as e:
+                # Without a complete view every forward would look missing and be added twice.
+                logging.error(f"Skipping reconcile, cannot read the kernel rules: {e}")
+                return diff_size
+            adds, removes = forward_diff(kernel_ports, self.service.forwarded_ports)
+
+            forwards = sum(len(p) for p in adds.values()) + sum(len(p) for p in removes.values())
+            diff_size += forwards
+            if forwards:
+                logging.warning(
+                    f"Kernel rules drifted from service state: re-adding "
+                    f"{sum(len(p) for p in adds.values())} and removing "
+                    f"{sum(len(p) for p in removes.values())} forward(s)."
+                )
+                try:
+                    await self.service.iptables.apply_batch(adds=adds, removes=removes)
+                except IPTablesError:
+                    # The expected fingerprint still differs, so the next run tries again.
+                    return diff_size
+            self.service.iptables.expected_fingerprint.sync(await self.service.iptables.fingerprint())
+
+        self.runs += 1
+        self.last_duration = time.perf_counter() - started
+        self.last_diff_size = diff_size
+        self.total_diff_size += diff_size
+        return diff_size
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "reconcile_runs": self.runs,
+            "reconcile_last_duration_seconds": self.last_duration,
+            "reconcile_last_diff_size": self.last_diff_size,
+            "reconcile_total_diff_size": self.total_diff_size,
+        }
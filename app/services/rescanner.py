@@ -0,0 +1,103 @@
+# src/services/rescanner.py
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, List
+
+from app.services.periodic import PeriodicTask
+
+if TYPE_CHECKING:
+    from app.services.portmaster_service import PortMasterService
+
+
+@dataclass
+class PortConflictEvent:
+    """A host process started listening on a port that is already forwarded to a VPN client."""
+    port: int
+    client_ip: str
+    detected_at: float
+
+
+class HostPortRescanner:
+    """
+    Background task that keeps PortMasterService.unavailable_ports in step with the host.
+
+    Every interval (plus a random jitter, so several instances don't scan in lockstep) it scans the
+    host without holding the service lock, diffs the result against the current set and applies only
+    the changes. Ports that became occupied while forwarded to a client are reported as
+    PortConflictEvent to every registered listener.
+    """
+
+    def __init__(self, service: "PortMasterService", interval: float, jitter: float):
+        self.service = service
+        self.interval = interval
+        self.jitter = jitter
+        self._loop = PeriodicTask("Host port rescan", self.rescan_once, interval, jitter)
+        self._listeners: List[Callable[[PortConflictEvent], None]] = [self._log_conflict]
+
+        # --- METRICS ---
+        self.runs = 0
+        self.last_duration = 0.0
+        self.last_added = 0
+        self.last_removed = 0
+        self.conflicts = 0
+
+    def add_listener(self, listener: Callable[[PortConflictEvent], None]):
+        self._listeners.append(listener)
+
+    @staticmethod
+    def _log_conflict(event: PortConflictEvent):
+        logging.warning(
+            f"Port {event.port} is forwarded to {event.client_ip} but a host process now listens on it."
+        )
+
+    def start(self):
+        if self.interval > 0 and not self._loop.running:
+            self._loop.start()
+            logging.info(f"Host port rescanner started (interval {self.interval}s, jitter {self.jitter}s).")
+
+    async def stop(self):
+        await self._loop.stop()
+
+    async def rescan_once(self) -> List[PortConflictEvent]:
+        """Rescans the host and updates unavailable_ports incrementally. Returns the new conflicts."""
+        started = time.perf_counter()
+        host_ports = await self.service.scanner.get_listening_ports()
+        occupied = host_ports.intersection(self.service.config.exposed_ports)
+
+        # No awaits from here on: the diff and the update happen atomically on the event loop.
+        unavailable = self.service.unavailable_ports
+        newly_occupied, freed = occupied - unavailable, unavailable - occupied
+        unavailable.update(newly_occupied)
+        unavailable.difference_update(freed)
+        self.service.ownership.free_map.mark_host_occupied(newly_occupied, freed)
+        if newly_occupied or freed:
+            logging.info(
+                f"Host ports changed: {len(newly_occupied)} newly occupied {sorted(newly_occupied)}, "
+                f"{len(freed)} freed {sorted(freed)}."
+            )
+
+        events = []
+        for port in sorted(newly_occupied):
+            client_ip = self.service.ownership.owner(port)
+            if client_ip is not None:
+                events.append(PortConflictEvent(port, client_ip, time.time()))
+        for event in events:
+            for listener in self._listeners:
+                listener(event)
+
+        self.runs += 1
+        self.last_duration = time.perf_counter() - started
+        self.last_added, self.last_removed = len(newly_occupied), len(freed)
+        self.conflicts += len(events)
+        return events
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "rescan_runs": self.runs,
+            "rescan_last_duration_seconds": self.last_duration,
+            "rescan_last_newly_occupied": self.last_added,
+            "rescan_last_freed": self.last_removed,
+            "rescan_conflicts_total": self.conflicts,
+        }
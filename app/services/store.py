@@ -0,0 +1,220 @@
+# src/services/store.py
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    client_id TEXT PRIMARY KEY,
+    api_key TEXT NOT NULL UNIQUE,  -- SHA-256 hex digest of the key, never the key itself
+    port_ranges TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS forwards (
+    port INTEGER PRIMARY KEY,
+    client_ip TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS client_ips (
+    client_ip TEXT PRIMARY KEY,
+    client_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# A client row as stored: (client_id, hash_api_key(api_key), port_ranges such as "21000-21010,21500")
+ClientRow = Tuple[str, str, str]
+# Journaled forwards: ({ "vpn_client_ip": {ports} }, { "vpn_client_ip": "client_id" })
+Journal = Tuple[Dict[str, Set[int]], Dict[str, str]]
+
+
+def hash_api_key(api_key: str) -> str:
+    """The digest clients are stored and looked up by, so a leaked database does not leak their keys."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class StateStore:
+    """
+    Durable client registry and forward journal in SQLite (WAL mode).
+
+    The service records the same mutations it applies in memory; they are queued and written in
+    one transaction by whichever flush() comes first, so concurrent requests waiting for their
+    changes to be journaled share one fsync-light WAL commit. The service flushes before it answers
+    a request, since on the next start the journal decides which kernel rules stay; a background
+    task flushes every flush_interval seconds whatever else was queued. With an empty path the
+    store is disabled and every method is a no-op.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.05):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pending: List[Tuple[str, tuple]] = []
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        # --- METRICS ---
+        self.flushes = 0
+        self.flushed_statements = 0
+        self.last_flush_duration = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self._connection is not None
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(_SCHEMA)
+        self._connection = connection
+
+    def _load(self) -> Tuple[List[ClientRow], Optional[Journal]]:
+        connection = self._connection
+        connection.execute("BEGIN")
+        try:
+            if not connection.execute("SELECT 1 FROM meta WHERE key = 'api_keys_hashed'").fetchone():
+                # Databases written by older versions hold the keys themselves.
+                rows = connection.execute("SELECT client_id, api_key FROM clients").fetchall()
+                connection.executemany(
+                    "UPDATE clients SET api_key = ? WHERE client_id = ?",
+                    [(hash_api_key(api_key), client_id) for client_id, api_key in rows],
+                )
+                connection.execute("INSERT INTO meta VALUES ('api_keys_hashed', '1')")
+                if rows:
+                    logging.info(f"Replaced the stored API keys of {len(rows)} client(s) by their hashes.")
+            clients = connection.execute("SELECT client_id, api_key, port_ranges FROM clients").fetchall()
+            journaled = connection.execute("SELECT 1 FROM meta WHERE key = 'forwards_journaled'").fetchone()
+            journal: Optional[Journal] = None
+            if journaled:
+                forwards: Dict[str, Set[int]] = {}
+                for port, client_ip in connection.execute("SELECT port, client_ip FROM forwards"):
+                    forwards.setdefault(client_ip, set()).add(port)
+                journal = forwards, dict(connection.execute("SELECT client_ip, client_id FROM client_ips"))
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return clients, journal
+
+    async def load(self) -> Tuple[List[ClientRow], Optional[Journal]]:
+        """
+        Opens the database and returns the stored clients and the forward journal. The journal is
+        None if it has never been written (first start), so the caller can fall back to the kernel.
+        """
+        if not self.path:
+            return [], None
+        try:
+            await asyncio.to_thread(self._open)
+            clients, journal = await asyncio.to_thread(self._load)
+        except sqlite3.Error as e:
+            logging.error(f"Cannot open state database '{self.path}': {e}. Running without persistence.")
+            self._connection = None
+            return [], None
+        logging.info(
+            f"Loaded {len(clients)} client(s) and "
+            f"{'no forward journal' if journal is None else f'forwards of {len(journal[0])} IP(s)'} from {self.path}."
+        )
+        return clients, journal
+
+    def _queue(self, sql: str, params: tuple = ()):
+        if self._connection is not None:
+            self._pending.append((sql, params))
+
+    def save_client(self, client_id: str, api_key: str, port_ranges: str):
+        self._queue("INSERT OR REPLACE INTO clients VALUES (?, ?, ?)", (client_id, api_key, port_ranges))
+
+    def delete_client(self, client_id: str):
+        self._queue("DELETE FROM clients WHERE client_id = ?", (client_id,))
+
+    def record_forwards(self, adds: Mapping[str, Iterable[int]], removes: Mapping[str, Iterable[int]]):
+        """Journals a committed rule batch. Removals go first, like in the kernel batch."""
+        for client_ip, ports in removes.items():
+            for port in ports:
+                self._queue("DELETE FROM forwards WHERE port = ? AND client_ip = ?", (port, client_ip))
+        for client_ip, ports in adds.items():
+            for port in ports:
+                self._queue("INSERT OR REPLACE INTO forwards VALUES (?, ?)", (port, client_ip))
+
+    def record_client_ip(self, client_ip: str, client_id: Optional[str]):
+        """Journals which client the forwards of client_ip belong to (None: no client or no forwards)."""
+        if client_id is None:
+            self._queue("DELETE FROM client_ips WHERE client_ip = ?", (client_ip,))
+        else:
+            self._queue("INSERT OR REPLACE INTO client_ips VALUES (?, ?)", (client_ip, client_id))
+
+    def replace_forwards(self, forwards: Mapping[str, Iterable[int]]):
+        """Replaces the whole journal, e.g. with the forwards found in the kernel on the first start."""
+        self._queue("DELETE FROM forwards")
+        self._queue("DELETE FROM client_ips")
+        self.record_forwards(forwards, {})
+        self._queue("INSERT OR REPLACE INTO meta VALUES ('forwards_journaled', '1')")
+
+    def _write(self, statements: List[Tuple[str, tuple]]):
+        connection = self._connection
+        connection.execute("BEGIN")
+        try:
+            for sql, params in statements:
+                connection.execute(sql, params)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    async def flush(self):
+        """Writes all queued mutations in one transaction."""
+        async with self._flush_lock:
+            if not self._pending or self._connection is None:
+                return
+            statements, self._pending = self._pending, []
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write, statements)
+            except sqlite3.Error as e:
+                # Keep the statements so the next flush retries them in order.
+                self._pending = statements + self._pending
+                logging.error(f"Failed to write {len(statements)} change(s) to the state database: {e}")
+                return
+            self.flushes += 1
+            self.flushed_statements += len(statements)
+            self.last_flush_duration = time.perf_counter() - started
+
+    def start(self):
+        if self._connection is not None and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        """Stops the flusher, writes what is still queued and closes the database."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._connection is not None:
+            await self.flush()
+            self._connection.close()
+            self._connection = None
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "store_flushes": self.flushes,
+            "store_flushed_statements": self.flushed_statements,
+            "store_pending_statements": len(self._pending),
+            "store_last_flush_duration_seconds": self.last_flush_duration,
+        }
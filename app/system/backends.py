@@ -0,0 +1,30 @@
+# src/system/backends.py
+
+import logging
+from typing import Union
+
+from app.core.config import Config
+from app.system.iptables import IPTablesManager
+from app.system.nftables import NFTablesManager
+from app.system.simulate import SimulatedIPTablesManager
+
+# Every backend exposes ensure_chains, apply_batch, add_port_forward, remove_port_forward,
+# flush_client, parse_existing_rules, fingerprint, expected_fingerprint and close,
+# and raises IPTablesError (or a subclass) on failure.
+PortForwardBackend = Union[IPTablesManager, NFTablesManager]
+
+BACKENDS = ("iptables", "nftables", "simulate")
+
+
+def create_port_forward_backend(config: Config) -> PortForwardBackend:
+    """Builds the rule backend selected by PORTMASTER_BACKEND."""
+    if config.backend == "nftables":
+        logging.info("Using the nftables verdict-map backend.")
+        return NFTablesManager(config.exposed_ports)
+    if config.backend == "simulate":
+        logging.warning("Using the simulation backend: rules are only modelled in memory, nothing is forwarded.")
+        return SimulatedIPTablesManager(
+            config.exposed_ports, config.per_client_chains, config.simulate_seed, config.simulate_command_log,
+        )
+    logging.info("Using the iptables backend.")
+    return IPTablesManager(config.exposed_ports, config.per_client_chains, config.persistent_writer)
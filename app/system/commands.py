@@ -0,0 +1,78 @@
+# src/system/commands.py
+
+import asyncio
+import hashlib
+import logging
+from typing import Iterable, List, Optional
+
+_DIGEST_MODULUS = 1 << 256
+
+
+class IPTablesError(Exception):
+    """Custom exception for errors during iptables command execution."""
+    pass
+
+
+def ruleset_digest(lines: Iterable[str]) -> int:
+    """
+    An order-independent digest of a ruleset: the sum of its lines' SHA-256 values. Adding or
+    removing lines adds or subtracts their hashes, so the digest can follow our own changes
+    without reading the ruleset back.
+    """
+    total = 0
+    for line in lines:
+        total += int.from_bytes(hashlib.sha256(line.encode("utf-8")).digest(), "big")
+    return total % _DIGEST_MODULUS
+
+
+def format_digest(digest: int) -> str:
+    """Renders a ruleset_digest() value as a fingerprint string."""
+    return f"{digest:064x}"
+
+
+class ExpectedFingerprint:
+    """
+    The fingerprint our rules should have, advanced by every batch the backend commits itself.
+    The reconciler only needs a full pass when the kernel's fingerprint differs from it, i.e.
+    after outside changes. It is unknown (None) until synced with the kernel, and again after
+    anything whose effect on the ruleset is not known exactly, such as a failed batch.
+    """
+
+    def __init__(self):
+        self._digest: Optional[int] = None
+
+    @property
+    def value(self) -> Optional[str]:
+        return None if self._digest is None else format_digest(self._digest)
+
+    def sync(self, fingerprint: str):
+        self._digest = int(fingerprint, 16)
+
+    def invalidate(self):
+        self._digest = None
+
+    def advance(self, added: Iterable[str], removed: Iterable[str]):
+        if self._digest is not None:
+            self._digest = (self._digest + ruleset_digest(added) - ruleset_digest(removed)) % _DIGEST_MODULUS
+
+
+async def run_command(command: List[str], input: Optional[str] = None) -> str:
+    """
+    Executes a firewall command asynchronously, optionally feeding stdin, and returns its stdout.
+    The process is awaited on the event loop itself, so no executor thread is held while it runs.
+    Raises IPTablesError if the command fails, whichever firewall tool it was.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate(input.encode("utf-8") if input is not None else None)
+    if process.returncode != 0:
+        error_message = f"Error executing '{' '.join(command)}'. stderr: {stderr.decode('utf-8').strip()}"
+        logging.error(error_message)
+        raise IPTablesError(error_message)
+
+    logging.info(f"Command executed successfully: {' '.join(command)}")
+    return stdout.decode("utf-8")
@@ -0,0 +1,96 @@
+# src/system/coprocess.py
+
+import asyncio
+import logging
+from typing import List, Optional
+
+from app.system.commands import IPTablesError
+
+
+class RestoreCoprocess:
+    """
+    A long-lived `iptables-restore --noflush --wait=<seconds> --verbose` process that rule batches are streamed to.
+
+    iptables-restore keeps reading stdin after each COMMIT, so one process can serve the daemon's
+    whole lifetime. In verbose mode it echoes (and flushes) comment lines as it reaches them, which
+    gives us an acknowledgement: after each batch we send a unique `# portmaster-ack <n>` comment
+    and wait for it on stdout. If a rule fails, iptables-restore reports it on stderr and exits;
+    the batch is then reported as failed and a fresh process is started for the next one.
+    Like the one-shot restores, it waits for the xtables lock (held e.g. by Docker) instead of failing,
+    but only for a third of ack_timeout per table, so a batch held up by the lock fails with a rule
+    error rather than being killed half-committed. A batch that still times out is reported as
+    failed like any other, and IPTablesManager.apply_batch reverts its nat part if that got committed.
+    """
+
+    def __init__(self, command: Optional[List[str]] = None, ack_timeout: float = 10.0):
+        # nat and filter are committed (and locked) one after the other: both waits must fit in ack_timeout.
+        lock_wait = max(1, int(ack_timeout / 3))
+        self.command = command or ["iptables-restore", "--noflush", f"--wait={lock_wait}", "--verbose"]
+        self.ack_timeout = ack_timeout
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._lock = asyncio.Lock()
+        self._sequence = 0
+
+    async def _ensure_started(self) -> asyncio.subprocess.Process:
+        if self._process is None or self._process.returncode is not None:
+            self._process = await asyncio.create_subprocess_exec(
+                *self.command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            logging.info(f"Started rule writer coprocess: {' '.join(self.command)} (pid {self._process.pid})")
+        return self._process
+
+    async def _read_until_ack(self, process: asyncio.subprocess.Process, marker: str):
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                # The process exited before acknowledging, i.e. a rule in the batch failed.
+                stderr = await process.stderr.read()
+                await process.wait()
+                raise IPTablesError(
+                    f"Error executing '{' '.join(self.command)}'. stderr: {stderr.decode('utf-8').strip()}"
+                )
+            if line.decode("utf-8").strip() == marker:
+                return
+
+    async def submit(self, payload: str):
+        """Streams one iptables-restore payload to the coprocess and waits until it has been committed."""
+        async with self._lock:
+            process = await self._ensure_started()
+            self._sequence += 1
+            marker = f"# portmaster-ack {self._sequence}"
+            try:
+                process.stdin.write(f"{payload}{marker}\n".encode("utf-8"))
+                await process.stdin.drain()
+                await asyncio.wait_for(self._read_until_ack(process, marker), self.ack_timeout)
+            except (IPTablesError, asyncio.TimeoutError, ConnectionError) as e:
+                await self._terminate()
+                error_message = str(e) or f"Rule writer coprocess did not acknowledge batch {self._sequence}."
+                logging.error(error_message)
+                if isinstance(e, IPTablesError):
+                    raise
+                raise IPTablesError(error_message) from e
+
+            logging.info(f"Rule writer coprocess committed batch {self._sequence}")
+
+    async def _terminate(self):
+        process, self._process = self._process, None
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    async def close(self):
+        """Closes stdin so the coprocess exits cleanly once all pending input is committed."""
+        async with self._lock:
+            process, self._process = self._process, None
+            if process is None or process.returncode is not None:
+                return
+            process.stdin.close()
+            try:
+                await asyncio.wait_for(process.wait(), self.ack_timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+            logging.info("Rule writer coprocess stopped.")
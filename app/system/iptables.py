@@ -3,94 +3,500 @@
 import asyncio
 import logging
 import re
-import subprocess
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set, Tuple
 
+from app.system.commands import ExpectedFingerprint, IPTablesError, format_digest, ruleset_digest, run_command
+from app.system.coprocess import RestoreCoprocess
 
-class IPTablesError(Exception):
-    """Custom exception for errors during iptables command execution."""
-    pass
+# Our own chains. The built-in PREROUTING/FORWARD chains only get a jump into them,
+# so the kernel never walks our rules for traffic outside the exposed range.
+DNAT_CHAIN = "PORTMASTER-DNAT"
+FORWARD_CHAIN = "PORTMASTER-FWD"
+# Prefixes of the optional per-client sub-chains, e.g. "PMD-10.8.1.2".
+CLIENT_DNAT_PREFIX = "PMD-"
+CLIENT_FORWARD_PREFIX = "PMF-"
+
+TABLES = ("nat", "filter")
+_OWN_CHAINS = {"nat": DNAT_CHAIN, "filter": FORWARD_CHAIN}
+_BUILTIN_CHAINS = {"nat": "PREROUTING", "filter": "FORWARD"}
+_CLIENT_PREFIXES = {"nat": CLIENT_DNAT_PREFIX, "filter": CLIENT_FORWARD_PREFIX}
+
+_DNAT_RULE_REGEX = re.compile(
+    r"^-A (?P<chain>\S+) .*-p (?P<proto>tcp|udp) .*--dport (?P<port>\d+) "
+    r"-j DNAT --to-destination (?P<ip>[\d.]+):(?P<dest_port>\d+)$"
+)
+_ACCEPT_RULE_REGEX = re.compile(
+    r"^-A (?P<chain>\S+) (?:.*-d (?P<ip>[\d.]+)(?:/32)? )?.*-p (?P<proto>tcp|udp) .*--dport (?P<port>\d+) -j ACCEPT$"
+)
+
+# The four rules that make up one complete forward.
+FORWARD_PIECES = ("dnat/tcp", "dnat/udp", "accept/tcp", "accept/udp")
 
 
 class IPTablesManager:
     """
     An async-compatible class that encapsulates all interactions with iptables.
-    It uses asyncio.to_thread to run blocking subprocess calls without blocking the event loop.
-    This is an application of the Adapter pattern, adapting the synchronous subprocess API
+    It runs iptables as asyncio subprocesses, so rule changes never block the event loop.
+    This is an application of the Adapter pattern, adapting the iptables command line
     to the asynchronous context of our application.
+
+    All rules live in the dedicated PORTMASTER-DNAT (nat) and PORTMASTER-FWD (filter) chains.
+    With per_client_chains enabled, every client IP additionally gets its own PMD-<ip>/PMF-<ip>
+    sub-chains, so disconnecting a client is a single chain flush. The sub-chains and their jumps
+    are removed by whichever batch removes the IP's last port.
+
+    With persistent_writer enabled, rule batches are streamed to one long-lived iptables-restore
+    coprocess instead of forking a new process per batch.
     """
 
-    async def _run_command(self, command: List[str]) -> str:
-        """Private helper to execute shell commands asynchronously."""
+    def __init__(
+            self, exposed_ports: Optional[range] = None, per_client_chains: bool = False,
+            persistent_writer: bool = False,
+    ):
+        self.exposed_ports = exposed_ports
+        self.per_client_chains = per_client_chains
+        self._writer = RestoreCoprocess() if persistent_writer else None
+        # Client IPs whose sub-chains currently exist in the kernel, per table.
+        self._client_chains: Dict[str, Set[str]] = {table: set() for table in TABLES}
+        # Ports forwarded per client IP (per-client chains only), to tell when a batch empties a sub-chain.
+        self._client_ports: Dict[str, Set[int]] = {}
+        # The iptables-save dump taken by ensure_chains(), reused once by parse_existing_rules()
+        # unless a batch has been written in between.
+        self._saved_tables: Optional[Dict[str, List[str]]] = None
+        # What fingerprint() should return as long as only we change our rules.
+        self.expected_fingerprint = ExpectedFingerprint()
+
+    async def _run_command(self, command: List[str], input: Optional[str] = None) -> str:
+        """Private helper to execute shell commands asynchronously, optionally feeding stdin."""
+        return await run_command(command, input)
+
+    async def _restore(self, tables: Dict[str, List[str]]):
+        """Commits per-table restore lines (chain declarations and rules) in one iptables-restore call."""
+        lines = []
+        for table, rules in tables.items():
+            if rules:
+                lines.append(f"*{table}")
+                lines.extend(rules)
+                lines.append("COMMIT")
+        if not lines:
+            return
+        self._saved_tables = None
+        payload = "\n".join(lines) + "\n"
+        if self._writer is not None:
+            await self._writer.submit(payload)
+        else:
+            # --wait: batches of different clients may run concurrently and contend for the xtables lock.
+            await self._run_command(["iptables-restore", "--noflush", "--wait"], input=payload)
+
+    async def _save_tables(self) -> Dict[str, List[str]]:
+        """Dumps the nat and filter tables with iptables-save, concurrently and without counters."""
+        outputs = await asyncio.gather(*(self._run_command(["iptables-save", "-t", table]) for table in TABLES))
+        return {table: output.splitlines() for table, output in zip(TABLES, outputs)}
+
+    async def close(self):
+        """Stops the persistent rule writer, if one is running."""
+        if self._writer is not None:
+            await self._writer.close()
+
+    def _jump_rules(self) -> Dict[str, List[str]]:
+        """The jump rules from the built-in chains into ours, restricted to the exposed range if known."""
+        if self.exposed_ports is None:
+            return {"nat": [f"-A PREROUTING -j {DNAT_CHAIN}"], "filter": [f"-A FORWARD -j {FORWARD_CHAIN}"]}
+
+        port_range = f"{self.exposed_ports.start}:{self.exposed_ports.stop - 1}"
+        jumps: Dict[str, List[str]] = {"nat": [], "filter": []}
+        for proto in ["tcp", "udp"]:
+            jumps["nat"].append(f"-A PREROUTING -p {proto} -m {proto} --dport {port_range} -j {DNAT_CHAIN}")
+            jumps["filter"].append(f"-A FORWARD -p {proto} -m {proto} --dport {port_range} -j {FORWARD_CHAIN}")
+        return jumps
+
+    async def ensure_chains(self) -> int:
+        """
+        Creates our chains and the jumps into them (including those into existing per-client
+        sub-chains) if they are missing, and drops stale jumps (e.g. left over from a different
+        EXPOSED_PORT_RANGE). Safe to call on every startup and reconcile. Returns the number of
+        lines it had to write.
+        """
+        saved = await self._save_tables()
+        wanted_jumps = self._jump_rules()
+        changes: Dict[str, List[str]] = {"nat": [], "filter": []}
+
+        for table in TABLES:
+            lines = saved[table]
+            self._client_chains[table] = {
+                line[1 + len(_CLIENT_PREFIXES[table]):].split(" ", 1)[0]
+                for line in lines if line.startswith(f":{_CLIENT_PREFIXES[table]}")
+            }
+            if not any(line.startswith(f":{_OWN_CHAINS[table]} ") for line in lines):
+                changes[table].append(f":{_OWN_CHAINS[table]} - [0:0]")
+            for line in lines:
+                if (line.startswith(f"-A {_BUILTIN_CHAINS[table]} ")
+                        and line.endswith(f"-j {_OWN_CHAINS[table]}")
+                        and line not in wanted_jumps[table]):
+                    changes[table].append("-D" + line[2:])
+            changes[table].extend(rule for rule in wanted_jumps[table] if rule not in lines)
+            for client_ip in sorted(self._client_chains[table]):
+                jump = self._client_chain_rules(client_ip)[table][1]
+                if jump not in lines:
+                    changes[table].append(jump)
+
+        if any(changes.values()):
+            self.expected_fingerprint.invalidate()
+        await self._restore(changes)
+        # Only chains and jumps changed above, which parsing ignores, so the dump is still valid for it.
+        self._saved_tables = saved
+        logging.info(f"PortMaster chains {DNAT_CHAIN}/{FORWARD_CHAIN} are in place.")
+        return sum(len(lines) for lines in changes.values())
+
+    def _piece_rules(self, client_ip: str, port: int) -> Dict[str, Tuple[str, str]]:
+        """Returns {piece: (table, rule spec)} for the rules that make up one TCP/UDP forward."""
+        rules = {}
+        for proto in ["tcp", "udp"]:
+            dnat_target = f"-j DNAT --to-destination {client_ip}:{port}"
+            if self.per_client_chains:
+                rules[f"dnat/{proto}"] = (
+                    "nat", f"{CLIENT_DNAT_PREFIX}{client_ip} -p {proto} -m {proto} --dport {port} {dnat_target}")
+                rules[f"accept/{proto}"] = (
+                    "filter", f"{CLIENT_FORWARD_PREFIX}{client_ip} -p {proto} -m {proto} --dport {port} -j ACCEPT")
+            else:
+                # Rule to change destination address (DNAT)
+                rules[f"dnat/{proto}"] = (
+                    "nat", f"{DNAT_CHAIN} -p {proto} -m {proto} --dport {port} {dnat_target}")
+                # Rule to allow the packet to be forwarded
+                rules[f"accept/{proto}"] = (
+                    "filter", f"{FORWARD_CHAIN} -d {client_ip}/32 -p {proto} -m {proto} --dport {port} -j ACCEPT")
+        return rules
+
+    def _forward_rules(self, client_ip: str, port: int) -> List[Tuple[str, str]]:
+        """Returns (table, rule spec) pairs that make up one TCP/UDP forward, in iptables-restore syntax."""
+        return list(self._piece_rules(client_ip, port).values())
+
+    def _client_chain_rules(self, client_ip: str) -> Dict[str, List[str]]:
+        """Declarations and jump rules for a new pair of per-client sub-chains."""
+        return {
+            "nat": [f":{CLIENT_DNAT_PREFIX}{client_ip} - [0:0]",
+                    f"-A {DNAT_CHAIN} -j {CLIENT_DNAT_PREFIX}{client_ip}"],
+            "filter": [f":{CLIENT_FORWARD_PREFIX}{client_ip} - [0:0]",
+                       f"-A {FORWARD_CHAIN} -d {client_ip}/32 -j {CLIENT_FORWARD_PREFIX}{client_ip}"],
+        }
+
+    def _client_chain_teardown(self, client_ip: str) -> Dict[str, List[str]]:
+        """Flush, unhook and delete lines for the client's existing sub-chains."""
+        teardown: Dict[str, List[str]] = {"nat": [], "filter": []}
+        for table, (_, jump) in self._client_chain_rules(client_ip).items():
+            if client_ip in self._client_chains[table]:
+                chain = f"{_CLIENT_PREFIXES[table]}{client_ip}"
+                teardown[table] = [f"-F {chain}", "-D" + jump[2:], f"-X {chain}"]
+        return teardown
+
+    def _emptied_clients(self, adds: Dict[str, Set[int]], removes: Dict[str, Set[int]]) -> Set[str]:
+        """Client IPs that have no ports left once the batch is applied (per-client chains only)."""
+        if not self.per_client_chains:
+            return set()
+        return {
+            client_ip for client_ip, ports in removes.items()
+            if not (self._client_ports.get(client_ip, set()) | adds.get(client_ip, set())) - ports
+        }
+
+    def _build_restore_tables(
+            self, adds: Dict[str, Set[int]], removes: Dict[str, Set[int]],
+            raw_rules: Optional[Dict[str, List[str]]] = None,
+    ) -> Dict[str, List[str]]:
+        """
+        Renders adds and removes (plus any ready-made raw rule lines) as iptables-restore lines per table.
+        Deletions go first so that a port moving between clients never has two DNAT targets. A client
+        IP left without ports has its sub-chains flushed and deleted instead of its rules deleted one by one.
+        """
+        declarations: Dict[str, List[str]] = {"nat": [], "filter": []}
+        rules: Dict[str, List[str]] = {"nat": [], "filter": []}
+        for table, lines in (raw_rules or {}).items():
+            rules[table].extend(lines)
+        if self.per_client_chains:
+            for client_ip in adds:
+                for table, lines in self._client_chain_rules(client_ip).items():
+                    # Declaring an existing chain under --noflush would flush it, so only new ones are declared.
+                    if client_ip not in self._client_chains[table]:
+                        declarations[table].append(lines[0])
+                        rules[table].append(lines[1])
+
+        emptied = self._emptied_clients(adds, removes)
+        for action, changes in (("-D", removes), ("-A", adds)):
+            for client_ip, ports in changes.items():
+                if client_ip in emptied:
+                    for table, lines in self._client_chain_teardown(client_ip).items():
+                        rules[table].extend(lines)
+                    continue
+                for port in sorted(ports):
+                    for table, rule in self._forward_rules(client_ip, port):
+                        rules[table].append(f"{action} {rule}")
+
+        # iptables-restore requires chain declarations to precede the rules of a table.
+        return {table: declarations[table] + rules[table] for table in rules}
+
+    async def apply_batch(
+            self, adds: Optional[Dict[str, Set[int]]] = None, removes: Optional[Dict[str, Set[int]]] = None
+    ):
+        """
+        Applies a whole set of forward additions and removals in a single `iptables-restore --noflush` call.
+        iptables-restore commits table by table: a failing rule leaves its own table unchanged, but
+        the nat table is already committed when the filter part fails. That nat part is then reverted,
+        so a failed batch leaves the forwards as they were; should the revert fail as well, the
+        reconciler repairs the rules on its next run.
+        """
+        adds = {ip: ports for ip, ports in (adds or {}).items() if ports}
+        removes = {ip: ports for ip, ports in (removes or {}).items() if ports}
+        if not adds and not removes:
+            return
+
+        tables = self._build_restore_tables(adds, removes)
+        added_lines, removed_lines = self._batch_line_changes(adds, removes)
         try:
-            process = await asyncio.to_thread(
-                subprocess.run,
-                command,
-                check=True,
-                capture_output=True,
-                text=True,
-                encoding="utf-8",
-            )
-            logging.info(f"Command executed successfully: {' '.join(command)}")
-            return process.stdout
-        except subprocess.CalledProcessError as e:
-            error_message = f"Error executing '{" ".join(command)}'. stderr: {e.stderr.strip()}"
-            logging.error(error_message)
-            raise IPTablesError(error_message) from e
+            await self._restore(tables)
+        except IPTablesError:
+            self.expected_fingerprint.invalidate()
+            if tables["nat"] and tables["filter"]:
+                await self._revert_committed_nat(tables["nat"], adds, removes)
+            raise
+        self.expected_fingerprint.advance(added_lines, removed_lines)
+        self._remember_batch(adds, removes)
+        added = sum(len(p) for p in adds.values())
+        removed = sum(len(p) for p in removes.values())
+        logging.info(f"Applied rule batch: {added} port(s) forwarded, {removed} port(s) removed (TCP/UDP)")
+
+    def _batch_line_changes(
+            self, adds: Dict[str, Set[int]], removes: Dict[str, Set[int]]
+    ) -> Tuple[List[str], List[str]]:
+        """
+        The lines of our chains (as fingerprint() sees them) that a batch adds and removes, judged
+        by the backend's view of the sub-chains and their ports before the batch.
+        """
+        added: List[str] = []
+        removed: List[str] = []
+        emptied = self._emptied_clients(adds, removes)
+        for client_ip in emptied:
+            for port in self._client_ports.get(client_ip, set()):
+                removed.extend(f"-A {rule}" for _, rule in self._forward_rules(client_ip, port))
+            for table, lines in self._client_chain_rules(client_ip).items():
+                if client_ip in self._client_chains[table]:
+                    removed.extend(lines)
+        for client_ip, ports in removes.items():
+            if client_ip not in emptied:
+                for port in ports:
+                    removed.extend(f"-A {rule}" for _, rule in self._forward_rules(client_ip, port))
+        for client_ip, ports in adds.items():
+            if client_ip in emptied:
+                continue
+            if self.per_client_chains:
+                for table, lines in self._client_chain_rules(client_ip).items():
+                    if client_ip not in self._client_chains[table]:
+                        added.extend(lines)
+            for port in ports:
+                added.extend(f"-A {rule}" for _, rule in self._forward_rules(client_ip, port))
+        return added, removed
+
+    async def _revert_committed_nat(self, nat_rules: List[str], adds: Dict[str, Set[int]], removes: Dict[str, Set[int]]):
+        """
+        Called after a failed batch: if the nat table shows the batch's changes (i.e. its nat part
+        was committed before the filter part failed), applies the inverse nat changes.
+        """
+        try:
+            nat = (await self._run_command(["iptables-save", "-t", "nat"])).splitlines()
+            if not self._shows_changes(nat, nat_rules):
+                return
+            self._remember_batch(adds, removes, tables=("nat",))
+            await self._restore({"nat": self._build_restore_tables(adds=removes, removes=adds)["nat"]})
+            self._remember_batch(removes, adds, tables=("nat",))
+            logging.warning("Reverted the nat part of a rule batch whose filter part failed.")
+        except IPTablesError as e:
+            raise IPTablesError(
+                f"Rule batch was applied to the nat table only and could not be reverted: {e}"
+            ) from e
+
+    @staticmethod
+    def _shows_changes(saved: List[str], rules: List[str]) -> bool:
+        """Whether an iptables-save dump of a table reflects all of a batch's restore lines for it."""
+        present = set(saved)
+        chains = {line[1:].split()[0] for line in saved if line.startswith(":")}
+        for line in rules:
+            if line.startswith(":"):
+                if line[1:].split()[0] not in chains:
+                    return False
+                continue
+            action, chain = line.split()[:2]
+            if action == "-A" and line not in present:
+                return False
+            if action == "-D" and "-A" + line[2:] in present:
+                return False
+            if action == "-F" and any(rule.startswith(f"-A {chain} ") for rule in saved):
+                return False
+            if action == "-X" and chain in chains:
+                return False
+        return True
+
+    def _remember_batch(
+            self, adds: Dict[str, Set[int]], removes: Dict[str, Set[int]], tables: Tuple[str, ...] = TABLES,
+    ):
+        """Records the sub-chains (of the given tables) and client ports a committed batch created or removed."""
+        if not self.per_client_chains:
+            return
+        emptied = self._emptied_clients(adds, removes)
+        for table in tables:
+            self._client_chains[table].update(adds)
+            self._client_chains[table].difference_update(emptied)
+        for client_ip, ports in removes.items():
+            remaining = self._client_ports.get(client_ip, set()) - ports
+            if remaining:
+                self._client_ports[client_ip] = remaining
+            else:
+                self._client_ports.pop(client_ip, None)
+        for client_ip, ports in adds.items():
+            self._client_ports.setdefault(client_ip, set()).update(ports)
 
     async def add_port_forward(self, client_ip: str, port: int):
         """Adds DNAT and FORWARD rules for a given port (TCP/UDP)."""
-        for proto in ["tcp", "udp"]:
-            # Rule to change destination address (DNAT)
-            await self._run_command([
-                "iptables", "-t", "nat", "-A", "PREROUTING",
-                "-p", proto, "--dport", str(port),
-                "-j", "DNAT", "--to-destination", f"{client_ip}:{port}",
-            ])
-            # Rule to allow the packet to be forwarded
-            await self._run_command([
-                "iptables", "-A", "FORWARD",
-                "-p", proto, "-d", client_ip, "--dport", str(port),
-                "-j", "ACCEPT",
-            ])
+        await self.apply_batch(adds={client_ip: {port}})
         logging.info(f"Port {port} (TCP/UDP) forwarded to {client_ip}")
 
     async def remove_port_forward(self, client_ip: str, port: int):
         """Removes the corresponding DNAT and FORWARD rules."""
-        for proto in ["tcp", "udp"]:
-            await self._run_command([
-                "iptables", "-t", "nat", "-D", "PREROUTING",
-                "-p", proto, "--dport", str(port),
-                "-j", "DNAT", "--to-destination", f"{client_ip}:{port}",
-            ])
-            await self._run_command([
-                "iptables", "-D", "FORWARD",
-                "-p", proto, "-d", client_ip, "--dport", str(port),
-                "-j", "ACCEPT",
-            ])
+        await self.apply_batch(removes={client_ip: {port}})
         logging.info(f"Port forwarding for {port} (TCP/UDP) to {client_ip} removed")
 
+    async def flush_client(self, client_ip: str, ports: Set[int]):
+        """
+        Removes every forward of a client IP. With per-client chains this is a flush and delete
+        of the client's sub-chains, independent of the number of ports.
+        """
+        await self.apply_batch(removes={client_ip: set(ports) | self._client_ports.get(client_ip, set())})
+        logging.info(f"Flushed all forwards for {client_ip}")
+
+    def _is_own_line(self, line: str) -> bool:
+        """True for declarations and rules of our chains, and the jumps into them."""
+        if line.startswith(":"):
+            return line[1:].startswith(("PORTMASTER-", CLIENT_DNAT_PREFIX, CLIENT_FORWARD_PREFIX))
+        if line.startswith("-A "):
+            chain = line[3:].split(" ", 1)[0]
+            return (chain.startswith(("PORTMASTER-", CLIENT_DNAT_PREFIX, CLIENT_FORWARD_PREFIX))
+                    or line.endswith((f"-j {DNAT_CHAIN}", f"-j {FORWARD_CHAIN}")))
+        return False
+
+    async def fingerprint(self) -> str:
+        """
+        A cheap digest of our chains' contents. It changes whenever anything (us, a Docker restart,
+        a flush by another tool) modifies our rules, and ignores everybody else's rules and counters.
+        Being independent of rule order, it can be followed by expected_fingerprint across our batches.
+        """
+        saved = await self._save_tables()
+        return format_digest(ruleset_digest(
+            line for table in TABLES for line in saved[table] if self._is_own_line(line)
+        ))
+
+    def _model_forwards(
+            self, saved: Dict[str, List[str]]
+    ) -> Tuple[Dict[Tuple[str, int], Dict[str, List[str]]], Set[Tuple[str, int]]]:
+        """
+        Builds {(client_ip, port): {piece: [rule lines]}} from an iptables-save dump in one pass per table.
+        Also returns the forwards that still sit on the built-in chains (written by older versions).
+        """
+        model: Dict[Tuple[str, int], Dict[str, List[str]]] = {}
+        legacy: Set[Tuple[str, int]] = set()
+
+        for line in saved["nat"]:
+            if not line.startswith("-A "):
+                continue
+            match = _DNAT_RULE_REGEX.match(line)
+            if not match or match["port"] != match["dest_port"]:
+                continue
+            chain, key = match["chain"], (match["ip"], int(match["port"]))
+            if chain == "PREROUTING":
+                legacy.add(key)
+            elif chain != DNAT_CHAIN and not chain.startswith(CLIENT_DNAT_PREFIX):
+                continue
+            model.setdefault(key, {}).setdefault(f"dnat/{match['proto']}", []).append(line)
+
+        for line in saved["filter"]:
+            if not line.startswith("-A "):
+                continue
+            match = _ACCEPT_RULE_REGEX.match(line)
+            if not match:
+                continue
+            chain, client_ip = match["chain"], match["ip"]
+            if chain.startswith(CLIENT_FORWARD_PREFIX):
+                client_ip = chain[len(CLIENT_FORWARD_PREFIX):]
+            elif chain not in (FORWARD_CHAIN, "FORWARD") or client_ip is None:
+                continue
+            key = (client_ip, int(match["port"]))
+            # Someone else's ACCEPT on FORWARD is only ours if we also DNAT that port there.
+            if chain == "FORWARD" and key not in legacy:
+                continue
+            model.setdefault(key, {}).setdefault(f"accept/{match['proto']}", []).append(line)
+
+        return model, legacy
+
     async def parse_existing_rules(self) -> Dict[str, Set[int]]:
-        """Parses existing PREROUTING rules to find current forwards."""
+        """
+        Builds a complete model of our forwards from `iptables-save -t nat` / `-t filter` and repairs it
+        in one batch: half-present forwards (e.g. DNAT without FORWARD ACCEPT) are completed, orphaned
+        ACCEPT rules and duplicates are removed, ports DNATed to several clients keep only the first
+        (effective) target, and forwards on the built-in chains are moved into ours. Raises
+        IPTablesError if the tables cannot be read or repaired, since an empty or partial result
+        would look like missing forwards.
+        """
         forwarded_ports: Dict[str, Set[int]] = {}
-        try:
-            output = await self._run_command(["iptables", "-t", "nat", "-L", "PREROUTING", "-n", "-v"])
-            dnat_regex = re.compile(r"dpt:(\d+)\s+to:([\d\.]+):(\d+)")
-
-            for line in output.splitlines():
-                match = dnat_regex.search(line)
-                if match:
-                    port, client_ip, dest_port = match.groups()
-                    if port == dest_port:
-                        port_num = int(port)
-                        forwarded_ports.setdefault(client_ip, set()).add(port_num)
-
-            if forwarded_ports:
-                logging.info(f"Found existing forwarded rules: {forwarded_ports}")
+        saved, self._saved_tables = self._saved_tables or await self._save_tables(), None
+        model, legacy = self._model_forwards(saved)
+
+        deletions: Dict[str, List[str]] = {"nat": [], "filter": []}
+        readds: Dict[str, Set[int]] = {}
+        port_owners: Dict[int, str] = {}
+        incomplete, orphaned, conflicting = 0, 0, 0
+
+        for (client_ip, port), pieces in model.items():
+            has_dnat = "dnat/tcp" in pieces or "dnat/udp" in pieces
+            owner = port_owners.setdefault(port, client_ip) if has_dnat else None
+            keep = has_dnat and owner == client_ip
+            complete = set(pieces) == set(FORWARD_PIECES) and all(len(lines) == 1 for lines in pieces.values())
+
+            if keep and complete and (client_ip, port) not in legacy:
+                forwarded_ports.setdefault(client_ip, set()).add(port)
+                continue
+
+            # Anything else is removed verbatim and, if it is a forward we keep, re-added in full.
+            for piece, lines in pieces.items():
+                table = "nat" if piece.startswith("dnat") else "filter"
+                deletions[table].extend("-D" + line[2:] for line in lines)
+            if keep:
+                forwarded_ports.setdefault(client_ip, set()).add(port)
+                readds.setdefault(client_ip, set()).add(port)
+                incomplete += (client_ip, port) not in legacy
+            elif has_dnat:
+                conflicting += 1
             else:
-                logging.info("No existing port forwarding rules found.")
+                orphaned += 1
 
-        except IPTablesError as e:
-            logging.error(f"Failed to parse existing iptables rules: {e}")
+        # Sub-chains of client IPs without forwards (e.g. left behind by older versions) are dropped.
+        stale_chains = {ip for chains in self._client_chains.values() for ip in chains} - set(forwarded_ports)
+        for client_ip in sorted(stale_chains):
+            for table, lines in self._client_chain_teardown(client_ip).items():
+                deletions[table].extend(lines)
+
+        if readds or any(deletions.values()):
+            logging.warning(
+                f"Repairing iptables state: {incomplete} incomplete forward(s), "
+                f"{len(legacy)} forward(s) on built-in chains, {orphaned} orphaned ACCEPT rule set(s), "
+                f"{conflicting} conflicting DNAT target(s), {len(stale_chains)} empty client sub-chain(s)."
+            )
+            self.expected_fingerprint.invalidate()
+            await self._restore(self._build_restore_tables(adds=readds, removes={}, raw_rules=deletions))
+            for chains in self._client_chains.values():
+                chains.difference_update(stale_chains)
+            self._remember_batch(readds, {})
+        if self.per_client_chains:
+            self._client_ports = {client_ip: set(ports) for client_ip, ports in forwarded_ports.items()}
+
+        if forwarded_ports:
+            logging.info(f"Found existing forwarded rules for {len(forwarded_ports)} client IP(s).")
+        else:
+            logging.info("No existing port forwarding rules found.")
 
-        return forwarded_ports
\ No newline at end of file
+        return forwarded_ports
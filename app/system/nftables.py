@@ -0,0 +1,220 @@
+# src/system/nftables.py
+
+import json
+import logging
+from typing import Dict, Iterator, List, Optional, Set
+
+from app.system.commands import ExpectedFingerprint, IPTablesError, format_digest, ruleset_digest, run_command
+
+NFT_TABLE = "portmaster"
+# dport -> client IP. The DNAT rule looks the destination port up in this map,
+# so the per-packet cost does not depend on the number of forwarded ports.
+NFT_PORT_MAP = "fwd_ports"
+# client IP . dport pairs that may be forwarded.
+NFT_ACCEPT_SET = "fwd_accept"
+
+
+class NFTablesError(IPTablesError):
+    """Raised when an nft command fails. Subclasses IPTablesError so callers can treat both backends alike."""
+    pass
+
+
+class NFTablesManager:
+    """
+    An nftables backend with the same interface as IPTablesManager.
+
+    All forwards live in one `ip portmaster` table: a `dport -> client_ip` verdict map drives
+    DNAT and an `ip . dport` set drives the FORWARD accept. Adding or removing forwards only
+    changes map/set elements, and every batch is a single atomic `nft -f -` transaction.
+
+    Note that an accept in our own forward hook does not override a drop verdict issued by
+    another table (e.g. Docker's iptables FORWARD policy); the host must still let the VPN
+    subnet through there, as apply_portmaster_net_rules.sh does.
+    """
+
+    def __init__(self, exposed_ports: Optional[range] = None):
+        self.exposed_ports = exposed_ports
+        # What fingerprint() should return as long as only we change our table.
+        self.expected_fingerprint = ExpectedFingerprint()
+
+    async def _run_command(self, command: List[str], input: Optional[str] = None) -> str:
+        """Private helper to execute nft commands asynchronously, optionally feeding stdin."""
+        try:
+            return await run_command(command, input)
+        except IPTablesError as e:
+            raise NFTablesError(str(e)) from e
+
+    async def close(self):
+        """Nothing to release: every nft batch is a single short-lived process."""
+        pass
+
+    async def _run_script(self, lines: List[str]):
+        """Runs a list of nft commands as one atomic transaction."""
+        if lines:
+            await self._run_command(["nft", "-f", "-"], input="\n".join(lines) + "\n")
+
+    def _port_match(self) -> str:
+        """Restricts our rules to the exposed range, if known."""
+        if self.exposed_ports is None:
+            return ""
+        return f"th dport {self.exposed_ports.start}-{self.exposed_ports.stop - 1} "
+
+    async def ensure_chains(self) -> int:
+        """
+        Creates the portmaster table, its map/set and base chains if they are missing.
+        Existing map and set elements are kept; only the two rules are rewritten. The rewrite is
+        unconditional, so no repairs are counted and 0 is returned.
+        """
+        table = f"ip {NFT_TABLE}"
+        port_match = self._port_match()
+        self.expected_fingerprint.invalidate()
+        await self._run_script([
+            f"add table {table}",
+            f"add map {table} {NFT_PORT_MAP} {{ type inet_service : ipv4_addr; }}",
+            f"add set {table} {NFT_ACCEPT_SET} {{ type ipv4_addr . inet_service; }}",
+            f"add chain {table} prerouting {{ type nat hook prerouting priority dstnat; policy accept; }}",
+            f"add chain {table} forward {{ type filter hook forward priority filter; policy accept; }}",
+            f"flush chain {table} prerouting",
+            f"flush chain {table} forward",
+            f"add rule {table} prerouting meta l4proto {{ tcp, udp }} {port_match}dnat to th dport map @{NFT_PORT_MAP}",
+            f"add rule {table} forward meta l4proto {{ tcp, udp }} {port_match}ip daddr . th dport @{NFT_ACCEPT_SET} accept",
+        ])
+        logging.info(f"nftables table '{NFT_TABLE}' is in place.")
+        return 0
+
+    @staticmethod
+    def _element_commands(action: str, changes: Dict[str, Set[int]]) -> List[str]:
+        """Renders one add/delete element command per map/set for the given forwards."""
+        map_elements, set_elements = [], []
+        for client_ip, ports in changes.items():
+            for port in sorted(ports):
+                map_elements.append(f"{port} : {client_ip}" if action == "add" else str(port))
+                set_elements.append(f"{client_ip} . {port}")
+        if not map_elements:
+            return []
+        return [
+            f"{action} element ip {NFT_TABLE} {NFT_PORT_MAP} {{ {', '.join(map_elements)} }}",
+            f"{action} element ip {NFT_TABLE} {NFT_ACCEPT_SET} {{ {', '.join(set_elements)} }}",
+        ]
+
+    @staticmethod
+    def _element_lines(changes: Dict[str, Set[int]]) -> Iterator[str]:
+        """The map and set elements of the given forwards, as fingerprint() sees them."""
+        for client_ip, ports in changes.items():
+            for port in ports:
+                yield f"map {port} : {client_ip}"
+                yield f"set {client_ip} . {port}"
+
+    async def apply_batch(
+            self, adds: Optional[Dict[str, Set[int]]] = None, removes: Optional[Dict[str, Set[int]]] = None
+    ):
+        """
+        Applies a whole set of forward additions and removals in a single `nft -f -` transaction.
+        Deletions go first so that a port can move between clients within one batch.
+        """
+        adds = {ip: ports for ip, ports in (adds or {}).items() if ports}
+        removes = {ip: ports for ip, ports in (removes or {}).items() if ports}
+        if not adds and not removes:
+            return
+
+        try:
+            await self._run_script(self._element_commands("delete", removes) + self._element_commands("add", adds))
+        except NFTablesError:
+            self.expected_fingerprint.invalidate()
+            raise
+        self.expected_fingerprint.advance(self._element_lines(adds), self._element_lines(removes))
+        added = sum(len(p) for p in adds.values())
+        removed = sum(len(p) for p in removes.values())
+        logging.info(f"Applied nftables batch: {added} port(s) forwarded, {removed} port(s) removed (TCP/UDP)")
+
+    async def add_port_forward(self, client_ip: str, port: int):
+        """Adds the map and set elements for a given port (TCP/UDP)."""
+        await self.apply_batch(adds={client_ip: {port}})
+        logging.info(f"Port {port} (TCP/UDP) forwarded to {client_ip}")
+
+    async def remove_port_forward(self, client_ip: str, port: int):
+        """Removes the map and set elements for a given port."""
+        await self.apply_batch(removes={client_ip: {port}})
+        logging.info(f"Port forwarding for {port} (TCP/UDP) to {client_ip} removed")
+
+    async def flush_client(self, client_ip: str, ports: Set[int]):
+        """Removes every forward of a client IP in one transaction."""
+        await self.apply_batch(removes={client_ip: ports})
+
+    async def _list_table(self) -> List[dict]:
+        """The JSON listing of our table, one dict per table, chain, rule, map or set."""
+        output = await self._run_command(["nft", "-j", "list", "table", "ip", NFT_TABLE])
+        try:
+            return json.loads(output).get("nftables", [])
+        except ValueError as e:
+            raise NFTablesError(f"Cannot parse the nftables listing: {e}") from e
+
+    async def fingerprint(self) -> str:
+        """
+        A digest of our table's listing; it changes whenever its rules or elements change. Each map and
+        set element counts as a line of its own and rule handles are left out, so expected_fingerprint
+        can follow our batches.
+        """
+        try:
+            items = await self._list_table()
+        except NFTablesError:
+            # A missing table is a state of its own (e.g. after 'nft flush ruleset').
+            items = []
+        lines = []
+        for item in items:
+            for kind, body in item.items():
+                if kind == "map" and body.get("name") == NFT_PORT_MAP:
+                    lines.extend(f"map {port} : {client_ip}" for port, client_ip in body.get("elem", []))
+                elif kind == "set" and body.get("name") == NFT_ACCEPT_SET:
+                    for element in body.get("elem", []):
+                        client_ip, port = element["concat"]
+                        lines.append(f"set {client_ip} . {port}")
+                body = {key: value for key, value in body.items() if key not in ("handle", "elem")}
+                lines.append(json.dumps({kind: body}, sort_keys=True))
+        return format_digest(ruleset_digest(lines))
+
+    async def parse_existing_rules(self) -> Dict[str, Set[int]]:
+        """
+        Reads the port map and accept set in one listing and repairs them in one batch:
+        map entries without a matching accept element get one, accept elements that no
+        map entry points at are removed. Raises NFTablesError if the table cannot be read,
+        parsed or repaired.
+        """
+        forwarded_ports: Dict[str, Set[int]] = {}
+        try:
+            accepted: Set[tuple] = set()
+            for item in await self._list_table():
+                if item.get("map", {}).get("name") == NFT_PORT_MAP:
+                    for port, client_ip in item["map"].get("elem", []):
+                        forwarded_ports.setdefault(client_ip, set()).add(int(port))
+                elif item.get("set", {}).get("name") == NFT_ACCEPT_SET:
+                    for element in item["set"].get("elem", []):
+                        client_ip, port = element["concat"]
+                        accepted.add((client_ip, int(port)))
+
+            mapped = {(ip, port) for ip, ports in forwarded_ports.items() for port in ports}
+            missing, orphaned = mapped - accepted, accepted - mapped
+            if missing or orphaned:
+                logging.warning(
+                    f"Repairing nftables state: {len(missing)} forward(s) without accept element, "
+                    f"{len(orphaned)} orphaned accept element(s)."
+                )
+                commands = []
+                if orphaned:
+                    elements = ", ".join(f"{ip} . {port}" for ip, port in sorted(orphaned))
+                    commands.append(f"delete element ip {NFT_TABLE} {NFT_ACCEPT_SET} {{ {elements} }}")
+                if missing:
+                    elements = ", ".join(f"{ip} . {port}" for ip, port in sorted(missing))
+                    commands.append(f"add element ip {NFT_TABLE} {NFT_ACCEPT_SET} {{ {elements} }}")
+                self.expected_fingerprint.invalidate()
+                await self._run_script(commands)
+
+            if forwarded_ports:
+                logging.info(f"Found existing forwarded rules for {len(forwarded_ports)} client IP(s).")
+            else:
+                logging.info("No existing port forwarding rules found.")
+
+        except (ValueError, KeyError) as e:
+            raise NFTablesError(f"Cannot parse the nftables listing: {e}") from e
+
+        return forwarded_ports
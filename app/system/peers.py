@@ -0,0 +1,119 @@
+# src/system/peers.py
+
+import asyncio
+import calendar
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from app.system.commands import IPTablesError, run_command
+
+PEER_SOURCE_KINDS = ("awg", "wg", "openvpn")
+
+
+@dataclass
+class PeerSource:
+    """One VPN server to read peer activity from: kind is awg/wg (argument: interface) or openvpn (argument: status file)."""
+    kind: str
+    container: str
+    argument: str
+
+    def command(self) -> List[str]:
+        if self.kind == "openvpn":
+            return ["docker", "exec", self.container, "cat", self.argument]
+        return ["docker", "exec", self.container, self.kind, "show", self.argument, "dump"]
+
+
+def parse_peer_sources(spec: str) -> List[PeerSource]:
+    """Parses "kind:container:argument" entries separated by commas, e.g. "awg:amnezia-awg:wg0"."""
+    sources = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        kind, _, rest = entry.partition(":")
+        container, _, argument = rest.partition(":")
+        if kind not in PEER_SOURCE_KINDS or not container or not argument:
+            raise ValueError(f"Invalid peer source '{entry}' (expected kind:container:argument, kind one of {PEER_SOURCE_KINDS}).")
+        sources.append(PeerSource(kind, container, argument))
+    return sources
+
+
+def parse_wg_dump(output: str) -> Dict[str, float]:
+    """
+    Maps every peer address of `wg show <if> dump` (also `awg`) to its latest handshake (epoch seconds).
+    The first line describes the interface; peer lines are public-key, preshared-key, endpoint,
+    allowed-ips, latest-handshake, rx, tx, keepalive. Peers that never shook hands are left out.
+    """
+    activity: Dict[str, float] = {}
+    for line in output.splitlines()[1:]:
+        fields = line.split("\t")
+        if len(fields) < 8 or not fields[4].isdigit() or fields[4] == "0":
+            continue
+        for allowed_ip in fields[3].split(","):
+            address, _, prefix = allowed_ip.partition("/")
+            if prefix in ("", "32"):
+                activity[address] = float(fields[4])
+    return activity
+
+
+def _parse_ctime(value: str) -> Optional[float]:
+    try:
+        return float(calendar.timegm(time.strptime(value.strip(), "%a %b %d %H:%M:%S %Y")))
+    except ValueError:
+        return None
+
+
+def parse_openvpn_status(output: str) -> Dict[str, float]:
+    """
+    Maps the virtual address of every connected OpenVPN client to its last activity (epoch seconds).
+    Understands status-version 1 ("ROUTING TABLE" section) and 2/3 ("ROUTING_TABLE" rows, comma or
+    tab separated, with a trailing time_t). Version 1 only has a ctime string, read as UTC.
+    """
+    activity: Dict[str, float] = {}
+    in_routing_table = False
+    for line in output.splitlines():
+        separator = "\t" if "\t" in line else ","
+        fields = line.split(separator)
+        if fields[0] == "ROUTING_TABLE" and len(fields) >= 5:
+            last_ref = float(fields[-1]) if fields[-1].isdigit() else _parse_ctime(fields[4])
+            if last_ref is not None:
+                activity[fields[1]] = last_ref
+        elif line.startswith("ROUTING TABLE"):
+            in_routing_table = True
+        elif line.startswith(("GLOBAL STATS", "END")):
+            in_routing_table = False
+        elif in_routing_table and len(fields) >= 4 and fields[0] != "Virtual Address":
+            last_ref = _parse_ctime(fields[3])
+            if last_ref is not None:
+                activity[fields[0]] = last_ref
+    return activity
+
+
+class PeerActivityReader:
+    """Reads peer activity of all configured VPN containers in bulk, one `docker exec` per source."""
+
+    def __init__(self, sources: List[PeerSource]):
+        self.sources = sources
+
+    async def _read_source(self, source: PeerSource) -> Optional[Dict[str, float]]:
+        try:
+            output = await run_command(source.command())
+        except (IPTablesError, OSError) as e:
+            logging.warning(f"Cannot read peer activity from {source.container}: {e}")
+            return None
+        if source.kind == "openvpn":
+            return parse_openvpn_status(output)
+        return parse_wg_dump(output)
+
+    async def read(self) -> Optional[Dict[str, float]]:
+        """
+        Returns { "vpn_client_ip": last_activity_epoch } over all sources, or None if any source
+        could not be read (so callers never mistake an unreachable container for idle peers).
+        """
+        results = await asyncio.gather(*(self._read_source(source) for source in self.sources))
+        if any(result is None for result in results):
+            return None
+        activity: Dict[str, float] = {}
+        for result in filter(None, results):
+            for client_ip, last_active in result.items():
+                activity[client_ip] = max(last_active, activity.get(client_ip, 0.0))
+        return activity
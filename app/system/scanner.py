@@ -2,15 +2,64 @@
 
 import asyncio
 import logging
+import os
 import subprocess
-from typing import Set
+from typing import Optional, Set
+
+from app.system.sock_diag import query_listening_ports
+
+# /proc/net tables and the socket state that means "occupies the port" in each of them:
+# 0A is TCP_LISTEN, 07 is TCP_CLOSE, which the kernel uses for unconnected (bound) UDP sockets.
+PROC_NET_TABLES = {"tcp": b"0A", "tcp6": b"0A", "udp": b"07", "udp6": b"07"}
+
+SCANNER_METHODS = ("auto", "netlink", "proc", "ss")
+
 
 class HostPortScanner:
     """
     Async-compatible scanner for listening ports on the host machine.
-    Uses 'ss' command, assuming the container runs in network_mode: host.
+    Assumes the container runs in network_mode: host.
+
+    By default it asks the kernel over NETLINK_SOCK_DIAG with a bytecode filter for port_range, so
+    the cost scales with the number of conflicting listeners rather than with every socket on the host.
+    If sock_diag is unavailable it reads /proc/net/{tcp,tcp6,udp,udp6} with a streaming parser that
+    keeps only ports inside port_range. The 'ss' command is the last fallback.
     """
 
+    def __init__(self, port_range: Optional[range] = None, method: str = "auto", proc_net_dir: str = "/proc/net"):
+        self.port_range = port_range
+        self.method = method
+        self.proc_net_dir = proc_net_dir
+
+    def _in_range(self, port: int) -> bool:
+        return self.port_range is None or port in self.port_range
+
+    def _scan_proc_table(self, path: str, occupied_state: bytes, ports: Set[int]):
+        """Adds in-range ports of sockets in occupied_state from one /proc/net table to ports."""
+        low, high = (self.port_range.start, self.port_range.stop) if self.port_range is not None else (0, 65536)
+        with open(path, "rb") as table:
+            next(table, None)  # Skip header
+            for line in table:
+                # "   0: 0100007F:1F90 00000000:0000 0A ..." -> sl, local_address, rem_address, st, rest
+                fields = line.split(None, 4)
+                if len(fields) < 4 or fields[3] != occupied_state:
+                    continue
+                port = int(fields[1][-4:], 16)
+                if low <= port < high:
+                    ports.add(port)
+
+    def _scan_proc_net(self) -> Set[int]:
+        """Reads all /proc/net socket tables. Missing IPv6 tables (IPv6 disabled) are skipped."""
+        ports: Set[int] = set()
+        for name, occupied_state in PROC_NET_TABLES.items():
+            path = os.path.join(self.proc_net_dir, name)
+            try:
+                self._scan_proc_table(path, occupied_state, ports)
+            except FileNotFoundError:
+                if not name.endswith("6"):
+                    raise
+        return ports
+
     def _parse_ss_output(self, output: str) -> Set[int]:
         """Parses the output of the 'ss' command to extract port numbers."""
         ports = set()
@@ -21,16 +70,13 @@ class HostPortScanner:
                 try:
                     address_port = parts[4]
                     port_str = address_port.split(':')[-1]
-                    if port_str.isdigit():
+                    if port_str.isdigit() and self._in_range(int(port_str)):
                         ports.add(int(port_str))
                 except (ValueError, IndexError):
                     continue
         return ports
 
-    async def get_listening_ports(self) -> Set[int]:
-        """
-        Asynchronously gets a set of all listening TCP and UDP ports on the host.
-        """
+    async def _get_listening_ports_ss(self) -> Set[int]:
         listening_ports = set()
         try:
             process = await asyncio.to_thread(
@@ -42,7 +88,6 @@ class HostPortScanner:
                 encoding="utf-8",
             )
             listening_ports = self._parse_ss_output(process.stdout)
-            logging.info(f"Found {len(listening_ports)} listening ports on the host.")
 
         except FileNotFoundError:
             logging.error("The 'ss' command was not found. Ensure 'iproute2' is installed in the container.")
@@ -51,4 +96,35 @@ class HostPortScanner:
         except Exception as e:
             logging.error(f"An unexpected error occurred while scanning ports: {e}")
 
-        return listening_ports
\ No newline at end of file
+        return listening_ports
+
+    async def get_listening_ports(self) -> Set[int]:
+        """
+        Asynchronously gets a set of all listening TCP and UDP ports on the host
+        (restricted to port_range, if one was given).
+        """
+        if self.method in ("auto", "netlink"):
+            try:
+                listening_ports = await asyncio.to_thread(query_listening_ports, self.port_range)
+                logging.info(f"Found {len(listening_ports)} listening ports on the host (sock_diag).")
+                return listening_ports
+            except OSError as e:
+                if self.method == "netlink":
+                    logging.error(f"sock_diag query failed: {e}")
+                    return set()
+                logging.warning(f"sock_diag is not available ({e}). Falling back to {self.proc_net_dir}.")
+
+        if self.method in ("auto", "proc"):
+            try:
+                listening_ports = await asyncio.to_thread(self._scan_proc_net)
+                logging.info(f"Found {len(listening_ports)} listening ports on the host (/proc/net).")
+                return listening_ports
+            except OSError as e:
+                if self.method == "proc":
+                    logging.error(f"Failed to read socket tables from {self.proc_net_dir}: {e}")
+                    return set()
+                logging.warning(f"Cannot read {self.proc_net_dir} ({e}). Falling back to 'ss'.")
+
+        listening_ports = await self._get_listening_ports_ss()
+        logging.info(f"Found {len(listening_ports)} listening ports on the host.")
+        return listening_ports
@@ -0,0 +1,354 @@
+# src/system/simulate.py
+
+import logging
+import re
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.system.commands import IPTablesError
+from app.system.iptables import (
+    CLIENT_DNAT_PREFIX, CLIENT_FORWARD_PREFIX, DNAT_CHAIN, FORWARD_CHAIN, TABLES, IPTablesManager,
+)
+
+BUILTIN_CHAINS = {
+    "nat": ("PREROUTING", "INPUT", "OUTPUT", "POSTROUTING"),
+    "filter": ("INPUT", "FORWARD", "OUTPUT"),
+}
+OWN_CHAIN_PREFIXES = (DNAT_CHAIN, FORWARD_CHAIN, CLIENT_DNAT_PREFIX, CLIENT_FORWARD_PREFIX)
+# Targets that end the walk of a table for a packet.
+TERMINAL_TARGETS = {"ACCEPT", "DROP", "REJECT", "DNAT", "SNAT", "MASQUERADE", "REDIRECT"}
+
+_PORT_RANGE_REGEX = re.compile(r"^(\d+)(?::(\d+))?$")
+
+
+class _Rule:
+    """The parts of a rule line that decide whether a forwarded packet matches it."""
+
+    __slots__ = ("line", "proto", "ports", "destination", "target", "to_destination", "other_matches")
+
+    def __init__(self, line: str):
+        self.line = line
+        self.proto: Optional[str] = None
+        self.ports: Optional[Tuple[int, int]] = None
+        self.destination: Optional[str] = None
+        self.target: Optional[str] = None
+        self.to_destination: Optional[str] = None
+        # Matches the model does not understand (-i, -m conntrack, ...); such rules never match.
+        self.other_matches = False
+
+        tokens = line.split()[2:]
+        i = 0
+        while i < len(tokens):
+            option, value = tokens[i], tokens[i + 1] if i + 1 < len(tokens) else ""
+            if option == "-p":
+                self.proto = value
+            elif option == "--dport" and _PORT_RANGE_REGEX.match(value):
+                start, end = _PORT_RANGE_REGEX.match(value).groups()
+                self.ports = (int(start), int(end or start))
+            elif option == "-d":
+                self.destination = value.split("/", 1)[0]
+            elif option == "-j":
+                self.target = value
+            elif option == "--to-destination":
+                self.to_destination = value.rsplit(":", 1)[0]
+            elif option == "-m" and value in ("tcp", "udp"):
+                pass
+            elif option.startswith("-"):
+                self.other_matches = True
+            else:
+                i -= 1  # A flag without value
+            i += 2
+
+    def matches(self, proto: str, port: int, destination: Optional[str]) -> bool:
+        if self.other_matches:
+            return False
+        if self.proto is not None and self.proto != proto:
+            return False
+        if self.ports is not None and not self.ports[0] <= port <= self.ports[1]:
+            return False
+        return self.destination is None or self.destination == destination
+
+
+class _ChainIndex:
+    """Rules of one chain with exact-port rules indexed, so walking a packet does not scan them all."""
+
+    def __init__(self, lines: List[str]):
+        self.length = len(lines)
+        self.generic: List[Tuple[int, _Rule]] = []
+        self.by_port: Dict[Tuple[str, int], List[Tuple[int, _Rule]]] = {}
+        for position, line in enumerate(lines):
+            rule = _Rule(line)
+            if rule.proto is not None and rule.ports is not None and rule.ports[0] == rule.ports[1]:
+                self.by_port.setdefault((rule.proto, rule.ports[0]), []).append((position, rule))
+            else:
+                self.generic.append((position, rule))
+
+    def candidates(self, proto: str, port: int) -> List[Tuple[int, _Rule]]:
+        return sorted(self.generic + self.by_port.get((proto, port), []), key=lambda candidate: candidate[0])
+
+
+class SimulatedRuleset:
+    """
+    In-memory model of the nat and filter tables as `iptables-restore --noflush` and `iptables-save`
+    see them. Like iptables-restore, a payload is committed table by table: if a line fails, its
+    table is left unchanged and the rest of the payload is skipped, but tables committed before stay.
+    """
+
+    def __init__(self):
+        self.chains: Dict[str, Dict[str, List[str]]] = {
+            table: {chain: [] for chain in BUILTIN_CHAINS[table]} for table in TABLES
+        }
+        self.policies: Dict[str, Dict[str, str]] = {
+            table: {chain: "ACCEPT" for chain in BUILTIN_CHAINS[table]} for table in TABLES
+        }
+        self._indexes: Dict[Tuple[str, str], _ChainIndex] = {}
+        # Bumped on every change, so derived figures can be cached until the ruleset changes.
+        self.generation = 0
+
+    def load(self, dump: str):
+        """Replaces the tables found in an iptables-save dump (e.g. of a production host)."""
+        table = None
+        for line in dump.splitlines():
+            line = line.strip()
+            if line.startswith("*"):
+                table = line[1:]
+                if table in self.chains:
+                    self.chains[table] = {chain: [] for chain in BUILTIN_CHAINS[table]}
+            elif table not in self.chains:
+                continue
+            elif line.startswith(":"):
+                chain, policy = line[1:].split()[:2]
+                self.chains[table].setdefault(chain, [])
+                if policy != "-":
+                    self.policies[table][chain] = policy
+            elif line.startswith("-A "):
+                self.chains[table].setdefault(line.split()[1], []).append(line)
+        self._indexes.clear()
+        self.generation += 1
+
+    def restore(self, payload: str):
+        """Applies an iptables-restore --noflush payload. Raises IPTablesError if a line fails."""
+        changed: Dict[str, Dict[str, Optional[List[str]]]] = {table: {} for table in TABLES}
+        table = None
+
+        def chain_rules(name: str, number: int) -> List[str]:
+            if name in changed[table]:
+                rules = changed[table][name]
+            else:
+                rules = self.chains[table].get(name)
+                if rules is not None:
+                    rules = changed[table][name] = list(rules)
+            if rules is None:
+                raise IPTablesError(f"iptables-restore: line {number} failed: chain '{name}' does not exist")
+            return rules
+
+        for number, line in enumerate(payload.splitlines(), 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("*"):
+                table = line[1:]
+                if table not in self.chains:
+                    raise IPTablesError(f"iptables-restore: line {number} failed: table '{table}' is not simulated")
+                continue
+            if table is None:
+                raise IPTablesError(f"iptables-restore: line {number} failed: no table selected")
+            if line == "COMMIT":
+                for chain, rules in changed[table].items():
+                    if rules is None:
+                        self.chains[table].pop(chain, None)
+                    else:
+                        self.chains[table][chain] = rules
+                    self._indexes.pop((table, chain), None)
+                changed[table].clear()
+                self.generation += 1
+                table = None
+                continue
+            if line.startswith(":"):
+                chain = line[1:].split()[0]
+                # Declaring a chain creates it, and under --noflush flushes an existing user chain.
+                if chain not in BUILTIN_CHAINS[table]:
+                    changed[table][chain] = []
+                continue
+
+            action, chain = line.split()[:2]
+            rule = "-A " + line[3:]
+            if action == "-A":
+                chain_rules(chain, number).append(rule)
+            elif action == "-I":
+                chain_rules(chain, number).insert(0, rule)
+            elif action == "-D":
+                rules = chain_rules(chain, number)
+                if rule not in rules:
+                    raise IPTablesError(
+                        f"iptables-restore: line {number} failed: Bad rule (does a matching rule exist in that chain?)"
+                    )
+                rules.remove(rule)
+            elif action == "-N":
+                changed[table][chain] = []
+            elif action == "-F":
+                chain_rules(chain, number).clear()
+            elif action == "-X":
+                if chain_rules(chain, number):
+                    raise IPTablesError(f"iptables-restore: line {number} failed: chain '{chain}' is not empty")
+                changed[table][chain] = None
+            else:
+                raise IPTablesError(f"iptables-restore: line {number} failed: '{action}' is not simulated")
+
+        if table is not None:
+            raise IPTablesError("iptables-restore: COMMIT expected at end of input")
+
+    def save(self, table: str) -> str:
+        """The table in iptables-save format."""
+        lines = ["# Generated by the PortMaster ruleset simulation", f"*{table}"]
+        for chain in self.chains[table]:
+            lines.append(f":{chain} {self.policies[table].get(chain, '-')} [0:0]")
+        for rules in self.chains[table].values():
+            lines.extend(rules)
+        lines.append("COMMIT")
+        return "\n".join(lines) + "\n"
+
+    def rule_count(self, table: str, prefixes: Tuple[str, ...] = ("",)) -> int:
+        """Rules in the table's chains whose name starts with one of prefixes (all chains by default)."""
+        return sum(len(rules) for chain, rules in self.chains[table].items() if chain.startswith(prefixes))
+
+    def _index(self, table: str, chain: str) -> _ChainIndex:
+        index = self._indexes.get((table, chain))
+        if index is None:
+            index = self._indexes[(table, chain)] = _ChainIndex(self.chains[table].get(chain, []))
+        return index
+
+    def _walk(
+            self, table: str, chain: str, proto: str, port: int, destination: Optional[str], depth: int = 0
+    ) -> Tuple[int, bool, Optional[str]]:
+        """Returns (rules evaluated, whether a terminal target was hit, DNAT destination) for one chain."""
+        index = self._index(table, chain)
+        evaluated = 0
+        last_position = -1
+        for position, rule in index.candidates(proto, port):
+            if not rule.matches(proto, port, destination):
+                continue
+            evaluated += position - last_position
+            last_position = position
+            if rule.target in TERMINAL_TARGETS:
+                return evaluated, True, rule.to_destination
+            if rule.target == "RETURN":
+                return evaluated, False, None
+            if rule.target in self.chains[table] and depth < 16:
+                sub_evaluated, terminal, to_destination = self._walk(
+                    table, rule.target, proto, port, destination, depth + 1)
+                evaluated += sub_evaluated
+                if terminal:
+                    return evaluated, True, to_destination
+        return evaluated + index.length - 1 - last_position, False, None
+
+    def traversal_depth(self, port: int, proto: str = "tcp") -> int:
+        """
+        Estimates how many rules a new connection to port evaluates in nat PREROUTING and then in
+        filter FORWARD towards the DNAT target or, if nothing DNATed it, in filter INPUT (the packet
+        is addressed to the host itself). Rules with matches the model does not understand count as
+        evaluated but never match, so this is a lower bound for busy hosts.
+        """
+        nat_evaluated, _, destination = self._walk("nat", "PREROUTING", proto, port, None)
+        chain = "FORWARD" if destination is not None else "INPUT"
+        filter_evaluated, _, _ = self._walk("filter", chain, proto, port, destination)
+        return nat_evaluated + filter_evaluated
+
+
+class SimulatedIPTablesManager(IPTablesManager):
+    """
+    The iptables backend with the kernel replaced by a SimulatedRuleset (PORTMASTER_BACKEND=simulate).
+
+    It builds exactly the same iptables-restore payloads and parses the same iptables-save output as
+    the real backend, so the service behaves as in production, but nothing is executed and no root
+    is needed. Every command is recorded (the last `history` in memory, all of them in command_log
+    if given) and metrics() estimates the ruleset size and per-packet traversal depth. The model
+    starts empty, or from an iptables-save dump (seed_path) to dry-run against a production ruleset.
+    """
+
+    def __init__(
+            self, exposed_ports: Optional[range] = None, per_client_chains: bool = False,
+            seed_path: str = "", command_log: str = "", history: int = 1000, depth_samples: int = 256,
+    ):
+        super().__init__(exposed_ports, per_client_chains, persistent_writer=False)
+        self.ruleset = SimulatedRuleset()
+        if seed_path:
+            with open(seed_path) as seed:
+                self.ruleset.load(seed.read())
+            logging.info(f"Simulated ruleset seeded from {seed_path}.")
+        self.command_log = command_log
+        self.commands: Deque[Tuple[str, Optional[str]]] = deque(maxlen=history)
+        self.depth_samples = depth_samples
+        self._depths: Tuple[int, Dict[str, float]] = (-1, {})
+
+        # --- METRICS ---
+        self.commands_total = 0
+        self.restore_lines_total = 0
+        self.failed_total = 0
+
+    def _record(self, command: List[str], input: Optional[str]):
+        text = " ".join(command)
+        self.commands.append((text, input))
+        self.commands_total += 1
+        if self.command_log:
+            with open(self.command_log, "a") as log:
+                log.write(f"$ {text}\n")
+                if input:
+                    log.write(input if input.endswith("\n") else input + "\n")
+
+    async def _run_command(self, command: List[str], input: Optional[str] = None) -> str:
+        self._record(command, input)
+        try:
+            if command[0] == "iptables-restore":
+                self.ruleset.restore(input or "")
+                self.restore_lines_total += len((input or "").splitlines())
+                return ""
+            if command[0] == "iptables-save":
+                return self.ruleset.save(command[command.index("-t") + 1])
+        except IPTablesError as e:
+            self.failed_total += 1
+            logging.error(f"Simulated command '{' '.join(command)}' failed: {e}")
+            raise
+        raise IPTablesError(f"The simulation does not model '{' '.join(command)}'.")
+
+    def _sample_ports(self) -> Iterable[int]:
+        ports = self.exposed_ports or range(0)
+        step = max(1, len(ports) // self.depth_samples)
+        return ports[::step]
+
+    def _forwarded_ports(self) -> List[int]:
+        ports = []
+        for chain, rules in self.ruleset.chains["nat"].items():
+            if chain.startswith(OWN_CHAIN_PREFIXES):
+                ports.extend(
+                    int(rule.split("--dport ")[1].split()[0]) for rule in rules
+                    if "-j DNAT" in rule and "--dport " in rule
+                )
+        return ports[::max(1, len(ports) // self.depth_samples)]
+
+    def _depth_metrics(self) -> Dict[str, float]:
+        """Traversal depths of sampled exposed and forwarded ports, recomputed only after a change."""
+        generation, metrics = self._depths
+        if generation != self.ruleset.generation:
+            depths = [self.ruleset.traversal_depth(port) for port in self._sample_ports()]
+            forwarded = [self.ruleset.traversal_depth(port) for port in self._forwarded_ports()]
+            metrics = {
+                "simulate_depth_mean": sum(depths) / len(depths) if depths else 0.0,
+                "simulate_depth_max": max(depths, default=0),
+                "simulate_depth_forwarded_mean": sum(forwarded) / len(forwarded) if forwarded else 0.0,
+            }
+            self._depths = (self.ruleset.generation, metrics)
+        return metrics
+
+    def metrics(self) -> Dict[str, float]:
+        metrics = {
+            "simulate_commands_total": self.commands_total,
+            "simulate_restore_lines_total": self.restore_lines_total,
+            "simulate_failed_commands_total": self.failed_total,
+            "simulate_nat_rules": self.ruleset.rule_count("nat"),
+            "simulate_filter_rules": self.ruleset.rule_count("filter"),
+            "simulate_own_rules": sum(self.ruleset.rule_count(table, OWN_CHAIN_PREFIXES) for table in TABLES),
+            "simulate_chains": sum(len(chains) for chains in self.ruleset.chains.values()),
+        }
+        metrics.update(self._depth_metrics())
+        return metrics
@@ -0,0 +1,93 @@
+# src/system/sock_diag.py
+
+import os
+import socket
+import struct
+from typing import Optional, Set
+
+# Constants from <linux/netlink.h>, <linux/sock_diag.h> and <linux/inet_diag.h>.
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x001
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+INET_DIAG_REQ_BYTECODE = 1
+INET_DIAG_BC_S_GE = 2
+INET_DIAG_BC_S_LE = 3
+
+TCP_LISTEN = 10
+# Unconnected UDP sockets are reported in TCP_CLOSE state.
+TCP_CLOSE = 7
+
+_NLMSGHDR = struct.Struct("=IHHII")
+_INET_DIAG_REQ_V2 = struct.Struct("=BBBxI48x")  # family, protocol, ext, pad, states, zeroed inet_diag_sockid
+_RTATTR = struct.Struct("=HH")
+_BC_OP = struct.Struct("=BBH")  # code, yes, no
+_NLMSGERR = struct.Struct("=i")
+_SPORT = struct.Struct("!H")  # inet_diag_msg.id.idiag_sport, big-endian, right after family/state/timer/retrans
+
+
+def _port_range_bytecode(low: int, high: int) -> bytes:
+    """
+    inet_diag bytecode accepting sockets with low <= sport <= high. Each comparison op is followed by
+    a second op whose 'no' field carries the port; a 'no' jump past the end of the program rejects.
+    """
+    return (
+        _BC_OP.pack(INET_DIAG_BC_S_GE, 8, 20) + _BC_OP.pack(0, 0, low)
+        + _BC_OP.pack(INET_DIAG_BC_S_LE, 8, 12) + _BC_OP.pack(0, 0, high)
+    )
+
+
+def _dump_request(family: int, protocol: int, states: int, bytecode: bytes, sequence: int) -> bytes:
+    attribute = _RTATTR.pack(_RTATTR.size + len(bytecode), INET_DIAG_REQ_BYTECODE) + bytecode
+    body = _INET_DIAG_REQ_V2.pack(family, protocol, 0, states) + attribute
+    header = _NLMSGHDR.pack(_NLMSGHDR.size + len(body), SOCK_DIAG_BY_FAMILY, NLM_F_REQUEST | NLM_F_DUMP, sequence, 0)
+    return header + body
+
+
+def _dump_ports(sock: socket.socket, request: bytes, ports: Set[int]):
+    """Sends one dump request and adds the source port of every returned socket to ports."""
+    sock.send(request)
+    while True:
+        data = sock.recv(1 << 16)
+        offset = 0
+        while offset + _NLMSGHDR.size <= len(data):
+            length, message_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+            if length < _NLMSGHDR.size:
+                raise OSError("Malformed netlink message from sock_diag.")
+            if message_type == NLMSG_DONE:
+                return
+            if message_type == NLMSG_ERROR:
+                (error,) = _NLMSGERR.unpack_from(data, offset + _NLMSGHDR.size)
+                if error:
+                    raise OSError(-error, f"sock_diag dump failed: {os.strerror(-error)}")
+            else:
+                (port,) = _SPORT.unpack_from(data, offset + _NLMSGHDR.size + 4)
+                ports.add(port)
+            offset += (length + 3) & ~3
+
+
+def query_listening_ports(port_range: Optional[range] = None) -> Set[int]:
+    """
+    Asks the kernel over NETLINK_SOCK_DIAG for listening TCP and unconnected UDP sockets (IPv4 and IPv6).
+    With a port_range the filtering runs in the kernel, so only sockets inside the range are returned.
+    Raises OSError if sock_diag is unavailable (e.g. udp_diag not loaded), so callers can fall back.
+    """
+    low, high = (port_range.start, port_range.stop - 1) if port_range is not None else (0, 65535)
+    bytecode = _port_range_bytecode(low, high)
+    ports: Set[int] = set()
+
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG) as sock:
+        sock.bind((0, 0))
+        sequence = 0
+        for family in (socket.AF_INET, socket.AF_INET6):
+            for protocol, state in ((socket.IPPROTO_TCP, TCP_LISTEN), (socket.IPPROTO_UDP, TCP_CLOSE)):
+                sequence += 1
+                try:
+                    _dump_ports(sock, _dump_request(family, protocol, 1 << state, bytecode, sequence), ports)
+                except OSError:
+                    # Hosts with IPv6 disabled have nothing to report for AF_INET6.
+                    if family != socket.AF_INET6:
+                        raise
+    return ports
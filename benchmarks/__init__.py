@@ -0,0 +1,2 @@
+# benchmarks/__init__.py
+"""Performance benchmarks for PortMaster. Run the modules with `python -m benchmarks.<name>`."""
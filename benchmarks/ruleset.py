@@ -0,0 +1,71 @@
+# benchmarks/ruleset.py
+"""
+Capacity planning on the simulation backend: how large the iptables ruleset grows and how many
+rules a new connection traverses for a given number of clients and ports, without root.
+
+    python -m benchmarks.ruleset --clients 1000 --ports-per-client 20
+    python -m benchmarks.ruleset --clients 1000 --ports-per-client 20 --per-client-chains
+    python -m benchmarks.ruleset --seed production-iptables-save.txt --clients 200 --show-commands 3
+
+The clients get consecutive sub-ranges of --range, one kernel batch each, exactly as the iptables
+backend would write them. With --seed the model starts from an iptables-save dump of a real host,
+so the rules of Docker, the VPN container etc. are part of the traversal estimate.
+"""
+
+import argparse
+import asyncio
+import ipaddress
+import logging
+import time
+from typing import Dict
+
+from app.system.simulate import SimulatedIPTablesManager
+
+
+async def run(args) -> Dict[str, float]:
+    start, end = (int(part) for part in args.range.split("-"))
+    if args.clients * args.ports_per_client > end - start + 1:
+        raise SystemExit(f"{args.clients} clients x {args.ports_per_client} ports do not fit into {args.range}.")
+
+    backend = SimulatedIPTablesManager(
+        range(start, end + 1), args.per_client_chains, args.seed, history=max(1, args.show_commands),
+    )
+    await backend.ensure_chains()
+    hosts = ipaddress.ip_network(args.client_net).hosts()
+    started = time.perf_counter()
+    for i in range(args.clients):
+        first = start + i * args.ports_per_client
+        await backend.apply_batch(adds={str(next(hosts)): set(range(first, first + args.ports_per_client))})
+    elapsed = time.perf_counter() - started
+
+    metrics = backend.metrics()
+    metrics["model_seconds"] = elapsed
+    for command, payload in list(backend.commands)[-args.show_commands:] if args.show_commands else []:
+        print(f"$ {command}")
+        if payload:
+            lines = payload.splitlines()
+            print("\n".join(lines[:20]) + (f"\n... ({len(lines) - 20} more lines)" if len(lines) > 20 else ""))
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--ports-per-client", type=int, default=10)
+    parser.add_argument("--range", default="20000-25000", help="EXPOSED_PORT_RANGE to model.")
+    parser.add_argument("--client-net", default="10.8.0.0/16", help="Network the client VPN IPs are taken from.")
+    parser.add_argument("--per-client-chains", action="store_true", help="Model PORTMASTER_PER_CLIENT_CHAINS=true.")
+    parser.add_argument("--seed", default="", help="iptables-save dump the ruleset starts from.")
+    parser.add_argument("--show-commands", type=int, default=0, help="Print the last N generated commands.")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    metrics = asyncio.run(run(args))
+    print(f"{args.clients} clients x {args.ports_per_client} ports"
+          f"{', per-client chains' if args.per_client_chains else ''}:")
+    for key, value in metrics.items():
+        print(f"  {key:34s} {value:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# benchmarks/scanner.py
+"""
+Micro-benchmark for HostPortScanner: the streaming /proc/net parser against the 'ss' parser,
+both fed synthetic socket tables of the same size.
+
+    python -m benchmarks.scanner --lines 100000
+    python -m benchmarks.scanner --live
+
+Only parsing is timed. The 'ss' path additionally pays a fork/exec of 'ss' in production,
+which this benchmark does not include, so the real gap is larger than reported.
+With --live, the complete sock_diag, /proc/net and 'ss' paths are timed against this host instead.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import timeit
+
+from app.system.scanner import HostPortScanner
+
+PROC_HEADER = (
+    "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt"
+    "   uid  timeout inode\n"
+)
+SS_HEADER = "Netid State  Recv-Q Send-Q Local Address:Port  Peer Address:PortProcess\n"
+# Socket states as they appear in /proc/net and in 'ss -tun' output.
+STATES = [("0A", "LISTEN"), ("01", "ESTAB"), ("06", "TIME-WAIT"), ("07", "UNCONN")]
+
+
+def generate_tables(lines: int, directory: str, seed: int = 42) -> str:
+    """Writes synthetic tcp/udp tables (and empty IPv6 ones) into directory and returns matching ss output."""
+    rng = random.Random(seed)
+    ss_lines = [SS_HEADER]
+    tables = {"tcp": [PROC_HEADER], "udp": [PROC_HEADER]}
+    for i in range(lines):
+        proto = "udp" if i % 4 == 3 else "tcp"
+        state_hex, state_name = STATES[3] if proto == "udp" else rng.choice(STATES[:3])
+        port = rng.randint(1024, 65535)
+        tables[proto].append(
+            f"{i:5d}: 0100007F:{port:04X} 0100007F:{rng.randint(1024, 65535):04X} {state_hex} "
+            f"00000000:00000000 00:00000000 00000000  1000        0 {100000 + i} 1 0000000000000000 100 0 0 10 0\n"
+        )
+        peer = "0.0.0.0:*" if state_name in ("LISTEN", "UNCONN") else "127.0.0.1:40000"
+        ss_lines.append(f"{proto}   {state_name} 0      128      127.0.0.1:{port}   {peer}\n")
+
+    for name, content in tables.items():
+        with open(os.path.join(directory, name), "w") as table:
+            table.writelines(content)
+        with open(os.path.join(directory, f"{name}6"), "w") as table:
+            table.write(PROC_HEADER)
+    return "".join(ss_lines)
+
+
+def run_live(port_range: range, repeat: int):
+    """Times every scanner method end to end against the sockets of this host."""
+    print(f"Live scan of this host, filter {port_range.start}-{port_range.stop - 1}")
+    for method in ("netlink", "proc", "ss"):
+        scanner = HostPortScanner(port_range, method=method)
+        timings = timeit.repeat(lambda: asyncio.run(scanner.get_listening_ports()), number=1, repeat=repeat)
+        ports = asyncio.run(scanner.get_listening_ports())
+        print(f"  {method:8s} {min(timings) * 1000:8.2f} ms  ({len(ports)} ports in range)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=100_000, help="Number of sockets in the synthetic tables.")
+    parser.add_argument("--range", default="20000-25000", help="Exposed port range used as the filter.")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing repetitions; the best one is reported.")
+    parser.add_argument("--live", action="store_true", help="Time all scanner methods against this host.")
+    args = parser.parse_args()
+
+    start, end = (int(part) for part in args.range.split("-"))
+    port_range = range(start, end + 1)
+    if args.live:
+        run_live(port_range, args.repeat)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        ss_output = generate_tables(args.lines, directory)
+        proc_scanner = HostPortScanner(port_range, method="proc", proc_net_dir=directory)
+        ss_scanner = HostPortScanner(port_range, method="ss")
+
+        proc_ports = proc_scanner._scan_proc_net()
+        ss_ports = ss_scanner._parse_ss_output(ss_output)
+        # The ss table only holds listening sockets in production ('ss -ltun'); emulate that filter.
+        ss_listening = ss_scanner._parse_ss_output(
+            "".join(line for line in ss_output.splitlines(True) if " LISTEN " in line or " UNCONN " in line)
+        )
+
+        results = {
+            "proc": min(timeit.repeat(proc_scanner._scan_proc_net, number=1, repeat=args.repeat)),
+            "ss": min(timeit.repeat(lambda: ss_scanner._parse_ss_output(ss_output), number=1, repeat=args.repeat)),
+        }
+
+    print(f"{args.lines} sockets, filter {start}-{end}")
+    print(f"  /proc/net parser: {results['proc'] * 1000:8.2f} ms  ({len(proc_ports)} ports in range)")
+    print(f"  ss parser:        {results['ss'] * 1000:8.2f} ms  ({len(ss_ports)} ports in range, "
+          f"{len(ss_listening)} of them listening)")
+    print(f"  speedup:          {results['ss'] / results['proc']:8.2f}x (excluding the 'ss' fork)")
+    if proc_ports != ss_listening:
+        print("  WARNING: the two parsers disagree on the set of listening ports!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# benchmarks/service.py
+"""
+Throughput and latency benchmark for PortMasterService and the REST API, on in-memory stand-ins
+for the kernel backend and the host port scanner (no root or netfilter needed).
+
+    python -m benchmarks.service
+    python -m benchmarks.service --clients 100 --ports 1000 --backend-latency-ms 5
+    python -m benchmarks.service --output new.json --compare old.json
+
+For every combination of client count and total port count, all clients run each scenario
+concurrently: forward their ports, resubmit them unchanged, drop one port, then the same through
+the FastAPI app (via an in-process ASGI client, so HTTP parsing and validation are included),
+and finally disconnect. Per scenario p50/p99 latency, ops/s and peak memory are reported and
+written to a JSON file; --compare prints the change against an earlier file.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# app.core.config reads the environment on import; give it what it needs for an isolated run.
+os.environ.setdefault("PORTMASTER_IP", "127.0.0.1")
+os.environ.setdefault("PORTMASTER_ADMIN_API_KEY", "benchmark")
+os.environ.setdefault("PORTMASTER_STATE_DB", "")
+
+from app.api.legacy import LegacyProtocolServer
+from app.core.config import Config
+from app.services.portmaster_service import PortMasterService
+from benchmarks.standins import InMemoryBackend, StaticScanner
+
+try:
+    import httpx
+except ImportError:  # The API scenarios are skipped without it.
+    httpx = None
+
+# Header the ASGI wrapper turns into the request's client address, so one HTTP client can act as many VPN IPs.
+CLIENT_IP_HEADER = "X-Bench-Client-IP"
+
+
+def client_ip(index: int) -> str:
+    index += 1
+    return f"10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+
+
+def with_client_ip(app):
+    """Wraps an ASGI app so that CLIENT_IP_HEADER replaces the client address of each request."""
+    header = CLIENT_IP_HEADER.lower().encode("latin-1")
+
+    async def wrapped(scope, receive, send):
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == header:
+                    scope = dict(scope, client=(value.decode("latin-1"), 0))
+                    break
+        await app(scope, receive, send)
+
+    return wrapped
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def run_concurrently(operations: List[Callable[[], Awaitable]]) -> Dict[str, float]:
+    """Starts all operations at once and returns latency percentiles and throughput."""
+    latencies: List[float] = []
+
+    async def timed(operation):
+        started = time.perf_counter()
+        await operation()
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(operation) for operation in operations))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "ops": len(operations),
+        "wall_s": wall,
+        "ops_per_s": len(operations) / wall if wall > 0 else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def exposed_range_for(total_ports: int) -> range:
+    return range(20000, 20000 + total_ports) if 20000 + total_ports <= 65536 else range(65536 - total_ports, 65536)
+
+
+async def run_combination(clients: int, total_ports: int, args) -> List[Dict]:
+    ports_per_client = max(1, total_ports // clients)
+    exposed = exposed_range_for(clients * ports_per_client)
+    config = Config(
+        vpn_ip="127.0.0.1", daemon_port=0, exposed_ports=exposed, admin_api_key="benchmark",
+        reconcile_interval=0.0, rescan_interval=0.0, state_db="",
+        group_commit_window=args.group_commit_window_ms / 1000, group_commit_max_batch=args.group_commit_max_batch,
+    )
+    backend = InMemoryBackend(args.backend_latency_ms / 1000)
+    service = PortMasterService(config, backend, StaticScanner(latency=args.scanner_latency_ms / 1000))
+    await service.initialize()
+    service.start_background_tasks()
+
+    ips, keys, pools, wanted = [], [], [], []
+    for i in range(clients):
+        first = exposed.start + i * ports_per_client
+        client = await service.create_client(f"bench-{i}", f"{first}-{first + ports_per_client - 1}")
+        ips.append(client_ip(i))
+        keys.append(client.api_key)
+        pools.append(service.get_client_pool(client.client_id))
+        wanted.append(set(range(first, first + ports_per_client)))
+
+    def service_update(i: int, ports):
+        return lambda: service.update_client_ports(ips[i], set(ports), pools[i], f"bench-{i}")
+
+    scenarios: List[tuple] = [
+        ("service_forward", [service_update(i, wanted[i]) for i in range(clients)]),
+        ("service_resubmit", [service_update(i, wanted[i]) for i in range(clients)]),
+        ("service_drop_one", [service_update(i, set(sorted(wanted[i])[:-1])) for i in range(clients)]),
+    ]
+
+    http_client = None
+    if httpx is not None and not args.skip_api:
+        import app.main as api
+
+        api.service_instance = service
+        api.legacy_server = LegacyProtocolServer(service, config.vpn_ip, 0, 1.0)
+        http_client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=with_client_ip(api.app)), base_url="http://portmaster",
+        )
+
+        def api_update(i: int, ports):
+            body = {"ports": sorted(ports)}
+            headers = {"X-API-Key": keys[i], CLIENT_IP_HEADER: ips[i]}
+
+            async def post():
+                response = await http_client.post("/ports", json=body, headers=headers)
+                response.raise_for_status()
+            return post
+
+        scenarios += [
+            ("api_readd_one", [api_update(i, wanted[i]) for i in range(clients)]),
+            ("api_resubmit", [api_update(i, wanted[i]) for i in range(clients)]),
+        ]
+
+    scenarios.append(("service_disconnect", [
+        (lambda i=i: service.disconnect_client_ip(ips[i])) for i in range(clients)
+    ]))
+
+    results = []
+    for name, operations in scenarios:
+        if args.trace_memory:
+            tracemalloc.start()
+        batches_before = backend.batches
+        result = await run_concurrently(operations)
+        result.update({
+            "scenario": name,
+            "clients": clients,
+            "ports_per_client": ports_per_client,
+            "ports_total": clients * ports_per_client,
+            "kernel_batches": backend.batches - batches_before,
+            # ru_maxrss is in KiB on Linux; it is the peak of the whole process so far.
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        })
+        if args.trace_memory:
+            result["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        results.append(result)
+        print(
+            f"  {name:20s} {result['ops']:6d} ops  p50 {result['p50_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms  "
+            f"{result['ops_per_s']:10.1f} ops/s  {result['kernel_batches']:5d} batches"
+        )
+
+    if http_client is not None:
+        await http_client.aclose()
+    await service.shutdown()
+    return results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict], baseline_path: str):
+    """Prints p50 and throughput of every scenario relative to an earlier result file."""
+    with open(baseline_path) as baseline_file:
+        baseline = {
+            (r["scenario"], r["clients"], r["ports_total"]): r for r in json.load(baseline_file)["results"]
+        }
+    print(f"\nCompared with {baseline_path} (p50 and ops/s, new / old):")
+    for result in results:
+        old = baseline.get((result["scenario"], result["clients"], result["ports_total"]))
+        if old is None:
+            continue
+        p50 = result["p50_ms"] / old["p50_ms"] if old["p50_ms"] else float("nan")
+        throughput = result["ops_per_s"] / old["ops_per_s"] if old["ops_per_s"] else float("nan")
+        flag = "  <-- slower" if p50 > 1.2 or throughput < 0.8 else ""
+        print(
+            f"  {result['scenario']:20s} {result['clients']:6d} clients {result['ports_total']:6d} ports  "
+            f"p50 x{p50:6.2f}  ops/s x{throughput:6.2f}{flag}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", default="1,100,10000", help="Comma-separated client counts.")
+    parser.add_argument("--ports", default="10,1000,60000", help="Comma-separated total port counts.")
+    parser.add_argument("--backend-latency-ms", type=float, default=0.0, help="Injected latency per kernel batch.")
+    parser.add_argument("--scanner-latency-ms", type=float, default=0.0, help="Injected latency per host port scan.")
+    parser.add_argument("--group-commit-window-ms", type=float, default=5.0, help="0 disables the group commit writer.")
+    parser.add_argument("--group-commit-max-batch", type=int, default=256)
+    parser.add_argument("--skip-api", action="store_true", help="Only benchmark the service, not the REST API.")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also report the Python heap peak per scenario (tracemalloc; slows everything down).")
+    parser.add_argument("--output", default="benchmark-results.json", help="JSON file to write the results to.")
+    parser.add_argument("--compare", help="Earlier JSON result file to compare against.")
+    args = parser.parse_args()
+    # The service logs every client creation; keep the report readable.
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if httpx is None and not args.skip_api:
+        print("httpx is not installed; skipping the REST API scenarios.", file=sys.stderr)
+
+    results: List[Dict] = []
+    for clients in (int(c) for c in args.clients.split(",")):
+        for total_ports in (int(p) for p in args.ports.split(",")):
+            if max(1, total_ports // clients) * clients > 65536 - 1024:
+                print(f"Skipping {clients} clients x {total_ports} ports: does not fit into the port space.")
+                continue
+            print(f"{clients} client(s), {total_ports} port(s):")
+            results.extend(asyncio.run(run_combination(clients, total_ports, args)))
+
+    with open(args.output, "w") as output:
+        json.dump({
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "arguments": vars(args),
+            },
+            "results": results,
+        }, output, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# benchmarks/standins.py
+"""
+In-memory stand-ins for the kernel rule backend and the host port scanner, so PortMasterService
+can be driven without root or netfilter. Both can inject a fixed latency per call to emulate the
+fork/exec and netlink round trips of the real implementations.
+"""
+
+import asyncio
+from typing import Dict, Iterable, Iterator, Optional, Set
+
+from app.system.commands import ExpectedFingerprint, IPTablesError, format_digest, ruleset_digest
+
+
+class InMemoryBackend:
+    """
+    Keeps the forwards in a dict instead of the kernel. Like `iptables-restore`, a batch that deletes
+    a forward which does not exist fails as a whole and changes nothing.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.rules: Dict[str, Set[int]] = {}
+        self.expected_fingerprint = ExpectedFingerprint()
+        # --- METRICS ---
+        self.batches = 0
+        self.rules_written = 0
+
+    async def _kernel_call(self):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    async def ensure_chains(self) -> int:
+        await self._kernel_call()
+        return 0
+
+    async def apply_batch(
+            self, adds: Optional[Dict[str, Set[int]]] = None, removes: Optional[Dict[str, Set[int]]] = None
+    ):
+        adds = {ip: ports for ip, ports in (adds or {}).items() if ports}
+        removes = {ip: ports for ip, ports in (removes or {}).items() if ports}
+        if not adds and not removes:
+            return
+        await self._kernel_call()
+        for client_ip, ports in removes.items():
+            missing = set(ports) - self.rules.get(client_ip, set())
+            if missing:
+                raise IPTablesError(f"Bad rule (does a matching rule exist in that chain?): {client_ip} {sorted(missing)[:5]}")
+        for client_ip, ports in removes.items():
+            self.rules[client_ip].difference_update(ports)
+            if not self.rules[client_ip]:
+                del self.rules[client_ip]
+        for client_ip, ports in adds.items():
+            self.rules.setdefault(client_ip, set()).update(ports)
+        self.expected_fingerprint.advance(self._lines(adds), self._lines(removes))
+        self.batches += 1
+        self.rules_written += sum(len(p) for p in adds.values()) + sum(len(p) for p in removes.values())
+
+    async def add_port_forward(self, client_ip: str, port: int):
+        await self.apply_batch(adds={client_ip: {port}})
+
+    async def remove_port_forward(self, client_ip: str, port: int):
+        await self.apply_batch(removes={client_ip: {port}})
+
+    async def flush_client(self, client_ip: str, ports: Iterable[int]):
+        await self.apply_batch(removes={client_ip: set(ports)})
+
+    async def parse_existing_rules(self) -> Dict[str, Set[int]]:
+        await self._kernel_call()
+        return {client_ip: set(ports) for client_ip, ports in self.rules.items()}
+
+    @staticmethod
+    def _lines(changes: Dict[str, Set[int]]) -> Iterator[str]:
+        return (f"{client_ip}:{port}" for client_ip, ports in changes.items() for port in ports)
+
+    async def fingerprint(self) -> str:
+        await self._kernel_call()
+        return format_digest(ruleset_digest(self._lines(self.rules)))
+
+    async def close(self):
+        pass
+
+
+class StaticScanner:
+    """Reports a fixed set of host ports as listening."""
+
+    def __init__(self, ports: Iterable[int] = (), latency: float = 0.0):
+        self.ports = set(ports)
+        self.latency = latency
+
+    async def get_listening_ports(self) -> Set[int]:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        return set(self.ports)
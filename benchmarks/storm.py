@@ -0,0 +1,253 @@
+# benchmarks/storm.py
+"""
+Reconnect-storm load generator: N virtual VPN clients re-register their ports with a running
+PortMaster at once, the way they do after the Amnezia container restarts.
+
+    python -m benchmarks.storm --url http://127.0.0.1:5000 --admin-key KEY --clients 500
+    python -m benchmarks.storm --url ... --admin-key KEY --pattern poisson --rate 200
+    python -m benchmarks.storm --url ... --admin-key KEY --pattern staggered --stagger-ms 5 --rounds 3
+
+Every virtual client gets its own API key from /admin/clients (with a sub-pool carved out of
+--range) and its own source address from --source-net: each client binds its connections to that
+address, so the daemon sees N distinct VPN IPs. On Linux every 127.0.0.0/8 address is local, so
+with the daemon listening on 127.0.0.1 no setup is needed; against a VPN address, the source
+addresses have to be assigned to a local interface first.
+
+Requests are sent according to the arrival pattern (burst: all at once, poisson: exponential gaps
+at --rate per second, staggered: one every --stagger-ms). Reported are the time until every client
+had all its ports forwarded, error rates, request latency and the daemon's lock-wait distribution
+over the run (from /admin/metrics). The clients are deleted again at the end unless --keep-clients.
+"""
+
+import argparse
+import asyncio
+import ipaddress
+import json
+import random
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+@dataclass
+class VirtualClient:
+    client_id: str
+    source_ip: str
+    ports: List[int]
+    api_key: str = ""
+    http: Optional["httpx.AsyncClient"] = None
+    forwarded_at: Optional[float] = None
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    partial: int = 0
+
+
+def arrival_offsets(pattern: str, count: int, rate: float, stagger: float, rng: random.Random) -> List[float]:
+    """Seconds after the start of a round at which each client sends its request."""
+    if pattern == "burst":
+        return [0.0] * count
+    if pattern == "staggered":
+        return [i * stagger for i in range(count)]
+    offsets, moment = [], 0.0
+    for _ in range(count):
+        offsets.append(moment)
+        moment += rng.expovariate(rate)
+    return offsets
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def lock_wait_distribution(before: Dict[str, float], after: Dict[str, float]) -> Dict[str, float]:
+    """The lock_wait_* histogram of the run: cumulative bucket counts (after minus before)."""
+    return {
+        key: after[key] - before.get(key, 0)
+        for key in after if key.startswith("lock_wait_")
+    }
+
+
+async def register(admin: "httpx.AsyncClient", clients: List[VirtualClient]):
+    async def create(client: VirtualClient):
+        first, last = client.ports[0], client.ports[-1]
+        response = await admin.post("/admin/clients", json={"client_id": client.client_id, "port_range": f"{first}-{last}"})
+        if response.status_code != 201:
+            raise RuntimeError(f"Cannot create client {client.client_id}: {response.status_code} {response.text}")
+        client.api_key = response.json()["api_key"]
+
+    await asyncio.gather(*(create(client) for client in clients))
+
+
+async def unregister(admin: "httpx.AsyncClient", clients: List[VirtualClient]):
+    await asyncio.gather(
+        *(admin.delete(f"/admin/clients/{client.client_id}") for client in clients if client.api_key),
+        return_exceptions=True,
+    )
+
+
+async def send_ports(client: VirtualClient, storm_started: float, offset: float, timeout: float):
+    await asyncio.sleep(max(0.0, storm_started + offset - time.perf_counter()))
+    started = time.perf_counter()
+    try:
+        response = await client.http.post(
+            "/ports", json={"ports": client.ports}, headers={"X-API-Key": client.api_key}, timeout=timeout,
+        )
+    except httpx.HTTPError:
+        client.errors += 1
+        return
+    finished = time.perf_counter()
+    client.latencies.append(finished - started)
+    if response.status_code != 200:
+        client.errors += 1
+        return
+    body = response.json()
+    if body["failed_to_forward"] or sorted(body["successfully_forwarded"]) != client.ports:
+        client.partial += 1
+        return
+    if client.forwarded_at is None:
+        client.forwarded_at = finished - storm_started
+
+
+async def run_storm(args) -> Dict:
+    start, end = (int(part) for part in args.range.split("-"))
+    if args.clients * args.ports_per_client > end - start + 1:
+        raise SystemExit(f"{args.clients} clients x {args.ports_per_client} ports do not fit into {args.range}.")
+    network = ipaddress.ip_network(args.source_net)
+    hosts = network.hosts()
+    next(hosts)  # Leave the first address (e.g. 127.0.0.1, where the daemon listens) alone.
+    rng = random.Random(args.seed)
+
+    clients = []
+    for i in range(args.clients):
+        first = start + i * args.ports_per_client
+        clients.append(VirtualClient(
+            client_id=f"{args.prefix}-{i}",
+            source_ip=str(next(hosts)),
+            ports=list(range(first, first + args.ports_per_client)),
+        ))
+
+    admin = httpx.AsyncClient(base_url=args.url, headers={"X-Admin-API-Key": args.admin_key}, timeout=args.timeout)
+    try:
+        await register(admin, clients)
+        for client in clients:
+            client.http = httpx.AsyncClient(
+                base_url=args.url, transport=httpx.AsyncHTTPTransport(local_address=client.source_ip),
+            )
+        metrics_before = (await admin.get("/admin/metrics")).json()
+
+        round_results = []
+        for round_number in range(args.rounds):
+            for client in clients:
+                client.forwarded_at = None
+            if round_number:
+                # Drop the forwards so every round starts cold, like after a container restart.
+                await asyncio.gather(*(
+                    client.http.delete("/ports", headers={"X-API-Key": client.api_key}) for client in clients
+                ))
+            offsets = arrival_offsets(args.pattern, len(clients), args.rate, args.stagger_ms / 1000, rng)
+            storm_started = time.perf_counter()
+            await asyncio.gather(*(
+                send_ports(client, storm_started, offset, args.timeout) for client, offset in zip(clients, offsets)
+            ))
+            forwarded = [client.forwarded_at for client in clients if client.forwarded_at is not None]
+            round_results.append({
+                "time_to_all_forwarded_s": max(forwarded) if len(forwarded) == len(clients) else None,
+                "forwarded_clients": len(forwarded),
+            })
+
+        metrics_after = (await admin.get("/admin/metrics")).json()
+    finally:
+        if not args.keep_clients:
+            await unregister(admin, clients)
+        for client in clients:
+            if client.http is not None:
+                await client.http.aclose()
+        await admin.aclose()
+
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    requests = args.clients * args.rounds
+    errors = sum(client.errors for client in clients)
+    partial = sum(client.partial for client in clients)
+    return {
+        "pattern": args.pattern,
+        "clients": args.clients,
+        "ports_per_client": args.ports_per_client,
+        "rounds": round_results,
+        "requests": requests,
+        "error_rate": errors / requests,
+        "partial_rate": partial / requests,
+        "latency_p50_ms": percentile(latencies, 0.50) * 1000,
+        "latency_p95_ms": percentile(latencies, 0.95) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+        "latency_mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "lock_wait": lock_wait_distribution(metrics_before, metrics_after),
+        "kernel_batches": metrics_after.get("group_commit_batches", 0) - metrics_before.get("group_commit_batches", 0),
+    }
+
+
+def print_report(report: Dict):
+    print(f"{report['clients']} clients x {report['ports_per_client']} ports, pattern {report['pattern']}")
+    for number, round_result in enumerate(report["rounds"], 1):
+        total = round_result["time_to_all_forwarded_s"]
+        summary = f"{total:.3f} s" if total is not None else \
+            f"not reached ({round_result['forwarded_clients']}/{report['clients']} clients forwarded)"
+        print(f"  round {number}: time to all forwarded {summary}")
+    print(f"  requests {report['requests']}, errors {report['error_rate']:.2%}, partially forwarded {report['partial_rate']:.2%}")
+    print(f"  latency p50 {report['latency_p50_ms']:.2f} ms, p95 {report['latency_p95_ms']:.2f} ms, "
+          f"p99 {report['latency_p99_ms']:.2f} ms")
+    print(f"  group commit batches: {report['kernel_batches']:g}")
+
+    lock_wait = report["lock_wait"]
+    count = lock_wait.get("lock_wait_count", 0)
+    if count:
+        print(f"  lock wait over {count:g} rule requests (mean {lock_wait['lock_wait_sum_seconds'] / count * 1000:.2f} ms):")
+        previous = 0
+        for key, cumulative in lock_wait.items():
+            if key.startswith("lock_wait_le_"):
+                print(f"    <= {key[len('lock_wait_le_'):]:>7s} {cumulative - previous:8g}  ({cumulative / count:6.1%} cumulative)")
+                previous = cumulative
+        print(f"    >  {'5000ms':>7s} {count - previous:8g}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Base URL of the running PortMaster API.")
+    parser.add_argument("--admin-key", required=True, help="PORTMASTER_ADMIN_API_KEY of the daemon.")
+    parser.add_argument("--clients", type=int, default=100, help="Number of virtual clients.")
+    parser.add_argument("--ports-per-client", type=int, default=10)
+    parser.add_argument("--range", default="20000-25000", help="Part of EXPOSED_PORT_RANGE to carve the sub-pools from.")
+    parser.add_argument("--source-net", default="127.0.0.0/8", help="Network the client source addresses are taken from.")
+    parser.add_argument("--pattern", choices=("burst", "poisson", "staggered"), default="burst")
+    parser.add_argument("--rate", type=float, default=100.0, help="Mean arrivals per second for the poisson pattern.")
+    parser.add_argument("--stagger-ms", type=float, default=10.0, help="Gap between clients for the staggered pattern.")
+    parser.add_argument("--rounds", type=int, default=1, help="Storms to replay; forwards are dropped between rounds.")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds.")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the poisson arrivals.")
+    parser.add_argument("--prefix", default="storm", help="client_id prefix of the virtual clients.")
+    parser.add_argument("--keep-clients", action="store_true", help="Do not delete the virtual clients afterwards.")
+    parser.add_argument("--output", help="Also write the report to this JSON file.")
+    args = parser.parse_args()
+
+    if httpx is None:
+        print("The storm generator needs httpx (pip install httpx).", file=sys.stderr)
+        sys.exit(1)
+
+    report = asyncio.run(run_storm(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output:
+            arguments = {key: value for key, value in vars(args).items() if key != "admin_key"}
+            json.dump({"arguments": arguments, "report": report}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
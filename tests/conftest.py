@@ -0,0 +1,8 @@
+# tests/conftest.py
+
+import os
+
+# app.core.config reads the environment on import; give it what it needs for an isolated run.
+os.environ.setdefault("PORTMASTER_IP", "127.0.0.1")
+os.environ.setdefault("PORTMASTER_ADMIN_API_KEY", "test")
+os.environ.setdefault("PORTMASTER_STATE_DB", "")
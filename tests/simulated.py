@@ -0,0 +1,44 @@
+# tests/simulated.py
+"""PortMasterService on the simulation backend, shared by the tests that need the whole write path."""
+
+from typing import List, Tuple
+
+from app.core.config import Config
+from app.services.intervals import PortPool
+from app.services.portmaster_service import PortMasterService
+from app.system.simulate import SimulatedIPTablesManager
+from benchmarks.standins import StaticScanner
+
+EXPOSED = range(20000, 21000)
+POOL = PortPool([(20000, 20999)])
+
+
+async def simulated_service(
+        per_client_chains: bool = True, **overrides
+) -> Tuple[PortMasterService, SimulatedIPTablesManager]:
+    """A started service on the simulation backend, with the group commit writer but no periodic tasks."""
+    settings = {"reconcile_interval": 0, "rescan_interval": 0, "state_db": "", **overrides}
+    config = Config(
+        vpn_ip="127.0.0.1", daemon_port=0, exposed_ports=EXPOSED, admin_api_key="test",
+        per_client_chains=per_client_chains, backend="simulate", **settings,
+    )
+    backend = SimulatedIPTablesManager(EXPOSED, per_client_chains)
+    service = PortMasterService(config, backend, StaticScanner())
+    await service.initialize()
+    service.start_background_tasks()
+    return service, backend
+
+
+async def connect(service: PortMasterService, *client_ips: str):
+    """Forwards two ports to each client IP: 20000-20001 to the first, 20010-20011 to the second, ..."""
+    for i, client_ip in enumerate(client_ips):
+        await service.update_client_ports(client_ip, {20000 + 10 * i, 20001 + 10 * i}, POOL)
+
+
+def client_chains(backend: SimulatedIPTablesManager) -> Tuple[List[str], List[str]]:
+    """Client sub-chains and the rules jumping to them that are left in the simulated ruleset."""
+    chains = [chain for table in ("nat", "filter") for chain in backend.ruleset.chains[table]
+              if chain.startswith(("PMD-", "PMF-"))]
+    jumps = [rule for table in ("nat", "filter") for rules in backend.ruleset.chains[table].values()
+             for rule in rules if "-j PMD-" in rule or "-j PMF-" in rule]
+    return chains, jumps
@@ -0,0 +1,54 @@
+# tests/test_allocator.py
+
+from app.services.allocator import PortAllocator
+from app.services.intervals import PortPool
+
+EXPOSED = range(20000, 20100)
+
+
+def test_allocate_skips_owned_and_host_occupied_ports():
+    allocator = PortAllocator(EXPOSED)
+    allocator.mark_owned([20000, 20002])
+    allocator.mark_host_occupied(occupied=[20001])
+    assert allocator.allocate(PortPool([(20000, 20009)]), 3) == [20003, 20004, 20005]
+    assert not allocator.is_free(20001)
+    allocator.mark_host_occupied(freed=[20001])
+    assert allocator.is_free(20001)
+
+
+def test_allocate_is_next_fit_and_wraps_around():
+    allocator = PortAllocator(EXPOSED)
+    pool = PortPool([(20000, 20004)])
+    first = allocator.allocate(pool, 2)
+    allocator.mark_owned(first)
+    second = allocator.allocate(pool, 2)
+    allocator.mark_owned(second)
+    assert first == [20000, 20001] and second == [20002, 20003]
+    allocator.mark_released(first)
+    # Continues after the last pick, then wraps around to the freed front.
+    assert allocator.allocate(pool, 3) == [20004, 20000, 20001]
+
+
+def test_allocate_returns_fewer_ports_when_the_pool_is_full():
+    allocator = PortAllocator(EXPOSED)
+    pool = PortPool([(20010, 20012), (20050, 20050)])
+    allocator.mark_owned([20011])
+    assert allocator.allocate(pool, 10) == [20010, 20012, 20050]
+
+
+def test_pools_are_clipped_to_the_exposed_range():
+    allocator = PortAllocator(EXPOSED)
+    assert allocator.allocate(PortPool([(19990, 20001)]), 5) == [20000, 20001]
+    assert allocator.allocate(PortPool([(30000, 30010)]), 5) == []
+    assert allocator.free_intervals(PortPool([(20095, 20200)])) == [(20095, 20099)]
+
+
+def test_free_intervals_and_clear_owned():
+    allocator = PortAllocator(EXPOSED)
+    allocator.mark_owned([20003, 20004])
+    allocator.mark_host_occupied(occupied=[20007])
+    pool = PortPool([(20000, 20009)])
+    assert allocator.free_intervals(pool) == [(20000, 20002), (20005, 20006), (20008, 20009)]
+    allocator.clear_owned()
+    # Host-occupied ports stay taken.
+    assert allocator.free_intervals(pool) == [(20000, 20006), (20008, 20009)]
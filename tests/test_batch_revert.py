@@ -0,0 +1,54 @@
+# tests/test_batch_revert.py
+
+import asyncio
+
+import pytest
+
+from app.system.commands import IPTablesError
+from app.system.simulate import SimulatedIPTablesManager
+
+EXPOSED = range(20000, 21000)
+
+
+async def backend_with_forward(per_client_chains: bool) -> SimulatedIPTablesManager:
+    backend = SimulatedIPTablesManager(EXPOSED, per_client_chains)
+    await backend.ensure_chains()
+    await backend.apply_batch(adds={"10.0.0.2": {20000, 20001}})
+    # Drift: somebody deleted one ACCEPT rule, so removing the forward fails in the filter table.
+    chain = "PMF-10.0.0.2" if per_client_chains else "PORTMASTER-FWD"
+    rule = next(rule for rule in backend.ruleset.chains["filter"][chain] if "--dport 20000" in rule)
+    backend.ruleset.restore(f"*filter\n-D{rule[2:]}\nCOMMIT\n")
+    return backend
+
+
+def nat_rules(backend: SimulatedIPTablesManager):
+    # A reverted deletion re-appends the rule; the order within our chains does not matter.
+    return sorted(backend.ruleset.save("nat").splitlines())
+
+
+@pytest.mark.parametrize("per_client_chains", [False, True])
+def test_nat_part_of_a_failed_batch_is_reverted(per_client_chains):
+    async def run():
+        backend = await backend_with_forward(per_client_chains)
+        nat_before = nat_rules(backend)
+        with pytest.raises(IPTablesError):
+            await backend.apply_batch(adds={"10.0.0.3": {20002}}, removes={"10.0.0.2": {20000}})
+        assert nat_rules(backend) == nat_before
+
+        # The backend's view of the sub-chains is intact, so the next batches work as usual.
+        await backend.apply_batch(adds={"10.0.0.3": {20002}}, removes={"10.0.0.2": {20001}})
+        assert await backend.parse_existing_rules() == {"10.0.0.2": {20000}, "10.0.0.3": {20002}}
+    asyncio.run(run())
+
+
+def test_failed_nat_part_is_left_alone():
+    async def run():
+        backend = SimulatedIPTablesManager(EXPOSED)
+        await backend.ensure_chains()
+        await backend.apply_batch(adds={"10.0.0.2": {20000}})
+        nat_before = nat_rules(backend)
+        with pytest.raises(IPTablesError):
+            await backend.apply_batch(adds={"10.0.0.3": {20002}}, removes={"10.0.0.2": {20005}})
+        assert nat_rules(backend) == nat_before
+        assert backend.failed_total == 1
+    asyncio.run(run())
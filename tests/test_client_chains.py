@@ -0,0 +1,65 @@
+# tests/test_client_chains.py
+
+import asyncio
+
+from app.services.group_commit import Disconnect, PortUpdate
+from app.system.simulate import SimulatedIPTablesManager
+from tests.simulated import EXPOSED, POOL, client_chains, connect, simulated_service
+
+
+def test_expiring_several_ips_removes_their_chains():
+    async def run():
+        service, backend = await simulated_service()
+        await connect(service, "10.0.0.2", "10.0.0.3", "10.0.0.4")
+        await service.expire_client_ips(["10.0.0.2", "10.0.0.3"])
+        chains, jumps = client_chains(backend)
+        assert sorted(chains) == ["PMD-10.0.0.4", "PMF-10.0.0.4"]
+        assert len(jumps) == 2
+        await service.shutdown()
+    asyncio.run(run())
+
+
+def test_updating_to_no_ports_removes_the_chains():
+    async def run():
+        service, backend = await simulated_service()
+        await connect(service, "10.0.0.2")
+        await service.update_client_ports("10.0.0.2", set(), POOL)
+        assert client_chains(backend) == ([], [])
+        # The IP can come back later with fresh chains.
+        await connect(service, "10.0.0.2")
+        assert len(client_chains(backend)[0]) == 2
+        await service.shutdown()
+    asyncio.run(run())
+
+
+def test_emptying_and_adding_ips_in_one_batch():
+    async def run():
+        service, backend = await simulated_service()
+        await connect(service, "10.0.0.2")
+        results = await service._submit_many([
+            Disconnect("10.0.0.2"), PortUpdate("10.0.0.3", {20010, 20011}, POOL, None),
+        ])
+        assert not any(isinstance(result, Exception) for result in results)
+        chains, _ = client_chains(backend)
+        assert sorted(chains) == ["PMD-10.0.0.3", "PMF-10.0.0.3"]
+        assert await backend.parse_existing_rules() == {"10.0.0.3": {20010, 20011}}
+        await service.shutdown()
+    asyncio.run(run())
+
+
+def test_stale_empty_chains_are_removed_on_startup():
+    async def run():
+        backend = SimulatedIPTablesManager(EXPOSED, per_client_chains=True)
+        await backend.ensure_chains()
+        await backend.apply_batch(adds={"10.0.0.2": {20000}, "10.0.0.3": {20001}})
+        # An empty sub-chain pair as older versions left it behind
+        backend.ruleset.restore("*nat\n-F PMD-10.0.0.3\nCOMMIT\n*filter\n-F PMF-10.0.0.3\nCOMMIT\n")
+
+        restarted = SimulatedIPTablesManager(EXPOSED, per_client_chains=True)
+        restarted.ruleset = backend.ruleset
+        await restarted.ensure_chains()
+        assert await restarted.parse_existing_rules() == {"10.0.0.2": {20000}}
+        chains, jumps = client_chains(restarted)
+        assert sorted(chains) == ["PMD-10.0.0.2", "PMF-10.0.0.2"]
+        assert len(jumps) == 2
+    asyncio.run(run())
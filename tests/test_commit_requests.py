@@ -0,0 +1,64 @@
+# tests/test_commit_requests.py
+
+import asyncio
+
+import pytest
+
+from app.services.group_commit import Allocate, PortUpdate
+from app.services.intervals import PortPool
+from app.system.commands import IPTablesError
+from tests.simulated import POOL, simulated_service
+
+# A sub-pool reaching past EXPOSED_PORT_RANGE, as a stored or legacy client may have one.
+WIDE_POOL = PortPool([(20000, 30000)])
+
+
+def test_port_outside_the_exposed_range_fails_only_its_request():
+    async def run():
+        service, backend = await simulated_service()
+        results = await service._submit_many([
+            PortUpdate("10.0.0.2", {20000, 30000}, WIDE_POOL, None),
+            PortUpdate("10.0.0.3", {20010}, POOL, None),
+        ])
+        assert results == [({20000}, {30000}), ({20010}, set())]
+        assert await backend.parse_existing_rules() == {"10.0.0.2": {20000}, "10.0.0.3": {20010}}
+        await service.shutdown()
+    asyncio.run(run())
+
+
+def test_failed_planning_releases_the_reservations(monkeypatch):
+    async def run():
+        service, backend = await simulated_service()
+        await service.update_client_ports("10.0.0.2", {20000}, POOL)
+
+        def broken_allocate(allowed, count):
+            raise RuntimeError("allocator failure")
+        monkeypatch.setattr(service.ownership.free_map, "allocate", broken_allocate)
+
+        with pytest.raises(RuntimeError):
+            await service._commit_requests([
+                PortUpdate("10.0.0.2", {20000, 20001}, POOL, None),
+                PortUpdate("10.0.0.3", {20010}, POOL, None),
+                Allocate("10.0.0.4", 2, POOL, None),
+            ])
+        assert {ip: set(ports) for ip, ports in service.forwarded_ports.items()} == {"10.0.0.2": {20000}}
+        assert service.ownership.is_free(20001) and service.ownership.is_free(20010)
+        await service.shutdown()
+    asyncio.run(run())
+
+
+def test_allocation_that_cannot_be_written_raises(monkeypatch):
+    async def run():
+        service, backend = await simulated_service()
+
+        async def failing_batch(adds=None, removes=None):
+            raise IPTablesError("iptables-restore: line 3 failed")
+        monkeypatch.setattr(backend, "apply_batch", failing_batch)
+
+        with pytest.raises(IPTablesError):
+            await service.allocate_ports("10.0.0.2", 2, POOL)
+        assert service.ownership.is_free(20000) and "10.0.0.2" not in service.forwarded_ports
+        # A port update still reports the ports it could not forward.
+        assert await service.update_client_ports("10.0.0.2", {20000}, POOL) == (set(), {20000})
+        await service.shutdown()
+    asyncio.run(run())
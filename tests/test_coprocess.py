@@ -0,0 +1,27 @@
+# tests/test_coprocess.py
+
+import asyncio
+import sys
+
+import pytest
+
+from app.system.commands import IPTablesError
+from app.system.coprocess import RestoreCoprocess
+
+
+def test_lock_wait_fits_twice_into_the_ack_timeout():
+    for ack_timeout in (3.0, 10.0, 60.0):
+        wait = next(arg for arg in RestoreCoprocess(ack_timeout=ack_timeout).command if arg.startswith("--wait="))
+        assert 2 * int(wait[len("--wait="):]) < ack_timeout
+
+
+def test_unacknowledged_batch_fails_and_the_writer_restarts():
+    async def run():
+        # Swallows its input without ever echoing the acknowledgement comment.
+        writer = RestoreCoprocess([sys.executable, "-c", "import sys; sys.stdin.read()"], ack_timeout=0.2)
+        with pytest.raises(IPTablesError, match="did not acknowledge batch 1"):
+            await writer.submit("*nat\nCOMMIT\n")
+        with pytest.raises(IPTablesError, match="did not acknowledge batch 2"):
+            await writer.submit("*nat\nCOMMIT\n")
+        await writer.close()
+    asyncio.run(run())
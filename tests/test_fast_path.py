@@ -0,0 +1,23 @@
+# tests/test_fast_path.py
+
+import asyncio
+
+from tests.simulated import POOL, simulated_service
+
+
+def test_resubmission_tags_adopted_forwards_with_the_client():
+    async def run():
+        service, backend = await simulated_service()
+        # Forwards adopted from the kernel on startup belong to no client yet.
+        await backend.apply_batch(adds={"10.0.0.2": {20000, 20001}})
+        service.ownership.load(await backend.parse_existing_rules())
+        assert service.ownership.client_of("10.0.0.2") is None
+
+        assert service.unchanged_ports("10.0.0.2", {20000, 20001}, "alice") is None
+        await service.update_client_ports("10.0.0.2", {20000, 20001}, POOL, "alice")
+        assert service.ownership.client_of("10.0.0.2") == "alice"
+        assert service.unchanged_ports("10.0.0.2", {20000, 20001}, "alice") == {20000, 20001}
+        # Legacy requests carry no client and never retag.
+        assert service.unchanged_ports("10.0.0.2", {20000, 20001}) == {20000, 20001}
+        await service.shutdown()
+    asyncio.run(run())
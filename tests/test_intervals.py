@@ -0,0 +1,65 @@
+# tests/test_intervals.py
+
+import pytest
+
+from app.services.intervals import IntervalIndex, PortPool
+
+
+def test_port_pool_merges_adjacent_and_overlapping_intervals():
+    pool = PortPool([(21500, 21599), (21000, 21010), (21011, 21020), (21005, 21008)])
+    assert pool.intervals == [(21000, 21020), (21500, 21599)]
+    assert len(pool) == 21 + 100
+    assert str(pool) == "21000-21020,21500-21599"
+
+
+def test_port_pool_parse_and_membership():
+    pool = PortPool.parse("21000-21010, 21500,21600-21601")
+    assert pool.to_strings() == ["21000-21010", "21500", "21600-21601"]
+    assert 21000 in pool and 21010 in pool and 21500 in pool and 21601 in pool
+    assert 20999 not in pool and 21011 not in pool and 21501 not in pool and 21602 not in pool
+    assert "21000" not in pool
+    assert list(PortPool.parse("21600-21601,21500")) == [21500, 21600, 21601]
+
+
+def test_port_pool_rejects_invalid_input():
+    with pytest.raises(ValueError):
+        PortPool.parse("21010-21000")
+    with pytest.raises(ValueError):
+        PortPool.parse("abc")
+    assert not PortPool()
+
+
+def test_interval_index_finds_owners_and_overlaps():
+    index = IntervalIndex()
+    index.add("alice", PortPool.parse("21000-21010,21500"))
+    index.add("bob", PortPool.parse("21011-21020"))
+    assert index.owner_of(21000) == "alice"
+    assert index.owner_of(21010) == "alice"
+    assert index.owner_of(21011) == "bob"
+    assert index.owner_of(21021) is None
+    assert index.owner_of(20000) is None
+    assert index.owner_of(21500) == "alice"
+    assert index.overlapping_owner(PortPool.parse("21400-21600")) == "alice"
+    assert index.overlapping_owner(PortPool.parse("21021-21499")) is None
+    with pytest.raises(ValueError, match="bob"):
+        index.add("carol", PortPool.parse("21015-21030"))
+    assert len(index) == 3
+
+
+def test_interval_index_remove_frees_the_intervals():
+    index = IntervalIndex()
+    pool = PortPool.parse("21000-21010,21500")
+    index.add("alice", pool)
+    index.remove("alice", pool)
+    assert len(index) == 0
+    assert index.owner_of(21005) is None
+    index.add("bob", PortPool.parse("21000-21600"))
+    assert index.owner_of(21500) == "bob"
+
+
+def test_port_pool_clipped_to_a_range():
+    pool = PortPool.parse("19990-20010,20500,20990-21005")
+    assert str(pool.clipped(range(20000, 21000))) == "20000-20010,20500,20990-20999"
+    assert str(pool.clipped(range(20400, 20600))) == "20500"
+    assert not pool.clipped(range(30000, 31000))
+    assert not pool.clipped(range(0))
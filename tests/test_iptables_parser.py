@@ -0,0 +1,142 @@
+# tests/test_iptables_parser.py
+
+import asyncio
+from typing import Dict, List, Optional
+
+from app.system.iptables import IPTablesManager
+
+EXPOSED = range(20000, 21000)
+JUMPS = {
+    "nat": [f"-A PREROUTING -p {p} -m {p} --dport 20000:20999 -j PORTMASTER-DNAT" for p in ("tcp", "udp")],
+    "filter": [f"-A FORWARD -p {p} -m {p} --dport 20000:20999 -j PORTMASTER-FWD" for p in ("tcp", "udp")],
+}
+
+
+class RecordingIPTables(IPTablesManager):
+    """Serves fixed iptables-save dumps and records every restore payload instead of running it."""
+
+    def __init__(self, nat: List[str], filter: List[str], **kwargs):
+        super().__init__(EXPOSED, **kwargs)
+        self.saved = {"nat": nat, "filter": filter}
+        self.restores: List[str] = []
+
+    async def _run_command(self, command: List[str], input: Optional[str] = None) -> str:
+        if command[0] == "iptables-save":
+            return "\n".join(self.saved[command[-1]]) + "\n"
+        self.restores.append(input)
+        return ""
+
+
+def dnat(ip: str, port: int, proto: str = "tcp", chain: str = "PORTMASTER-DNAT") -> str:
+    return f"-A {chain} -p {proto} -m {proto} --dport {port} -j DNAT --to-destination {ip}:{port}"
+
+
+def accept(ip: str, port: int, proto: str = "tcp", chain: str = "PORTMASTER-FWD") -> str:
+    return f"-A {chain} -d {ip}/32 -p {proto} -m {proto} --dport {port} -j ACCEPT"
+
+
+def forward(ip: str, port: int) -> Dict[str, List[str]]:
+    return {
+        "nat": [dnat(ip, port, proto) for proto in ("tcp", "udp")],
+        "filter": [accept(ip, port, proto) for proto in ("tcp", "udp")],
+    }
+
+
+def dump(*parts: Dict[str, List[str]], chains=("PORTMASTER-DNAT", "PORTMASTER-FWD")) -> Dict[str, List[str]]:
+    tables = {
+        "nat": ["*nat", ":PREROUTING ACCEPT [0:0]", f":{chains[0]} - [0:0]", *JUMPS["nat"]],
+        "filter": ["*filter", ":FORWARD DROP [0:0]", f":{chains[1]} - [0:0]", *JUMPS["filter"]],
+    }
+    for part in parts:
+        for table, lines in part.items():
+            tables[table].extend(lines)
+    for lines in tables.values():
+        lines.append("COMMIT")
+    return tables
+
+
+def parse(tables: Dict[str, List[str]], **kwargs):
+    manager = RecordingIPTables(tables["nat"], tables["filter"], **kwargs)
+    forwards = asyncio.run(manager.parse_existing_rules())
+    restored = [line for payload in manager.restores for line in payload.splitlines()]
+    return forwards, restored
+
+
+def test_complete_forwards_are_adopted_without_changes():
+    forwards, restored = parse(dump(forward("10.0.0.2", 20001), forward("10.0.0.2", 20002), forward("10.0.0.3", 20003)))
+    assert forwards == {"10.0.0.2": {20001, 20002}, "10.0.0.3": {20003}}
+    assert restored == []
+
+
+def test_foreign_rules_are_ignored():
+    docker = {
+        "nat": ["-A DOCKER ! -i docker0 -p tcp -m tcp --dport 8080 -j DNAT --to-destination 172.17.0.2:8080",
+                "-A PREROUTING -p tcp -m tcp --dport 8443 -j DNAT --to-destination 172.17.0.3:443"],
+        "filter": ["-A FORWARD -d 172.17.0.2/32 -p tcp -m tcp --dport 8080 -j ACCEPT"],
+    }
+    forwards, restored = parse(dump(docker, forward("10.0.0.2", 20001)))
+    assert forwards == {"10.0.0.2": {20001}}
+    assert restored == []
+
+
+def test_incomplete_forward_is_completed():
+    half = forward("10.0.0.2", 20001)
+    half["filter"] = half["filter"][:1]  # The UDP ACCEPT is missing
+    forwards, restored = parse(dump(half))
+    assert forwards == {"10.0.0.2": {20001}}
+    # The present pieces are removed verbatim and the whole forward is written again.
+    deleted = [line for line in restored if line.startswith("-D ")]
+    added = [line for line in restored if line.startswith("-A ")]
+    assert sorted(deleted) == sorted("-D" + line[2:] for line in half["nat"] + half["filter"])
+    assert sorted(added) == sorted(forward("10.0.0.2", 20001)["nat"] + forward("10.0.0.2", 20001)["filter"])
+
+
+def test_orphaned_accept_rules_are_removed():
+    orphan = {"filter": [accept("10.0.0.9", 20009, proto) for proto in ("tcp", "udp")]}
+    forwards, restored = parse(dump(orphan, forward("10.0.0.2", 20001)))
+    assert forwards == {"10.0.0.2": {20001}}
+    assert sorted(line for line in restored if line.startswith(("-A ", "-D "))) == \
+        sorted("-D" + line[2:] for line in orphan["filter"])
+
+
+def test_conflicting_dnat_keeps_the_first_target():
+    forwards, restored = parse(dump(forward("10.0.0.2", 20005), forward("10.0.0.3", 20005)))
+    assert forwards == {"10.0.0.2": {20005}}
+    loser = forward("10.0.0.3", 20005)
+    assert sorted(line for line in restored if line.startswith("-D ")) == \
+        sorted("-D" + line[2:] for line in loser["nat"] + loser["filter"])
+    assert not any(line.startswith("-A ") for line in restored)
+
+
+def test_duplicates_are_collapsed():
+    twice = forward("10.0.0.2", 20001)
+    twice["nat"].append(twice["nat"][0])
+    forwards, restored = parse(dump(twice))
+    assert forwards == {"10.0.0.2": {20001}}
+    assert sum(line.startswith("-D ") for line in restored) == len(twice["nat"]) + len(twice["filter"])
+    assert sum(line.startswith("-A ") for line in restored) == 4
+
+
+def test_forwards_on_builtin_chains_are_moved_into_ours():
+    legacy = {
+        "nat": [dnat("10.0.0.4", 20004, proto, chain="PREROUTING") for proto in ("tcp", "udp")],
+        "filter": [accept("10.0.0.4", 20004, proto, chain="FORWARD") for proto in ("tcp", "udp")],
+    }
+    forwards, restored = parse(dump(legacy))
+    assert forwards == {"10.0.0.4": {20004}}
+    assert sorted(line for line in restored if line.startswith("-D ")) == \
+        sorted("-D" + line[2:] for line in legacy["nat"] + legacy["filter"])
+    assert sorted(line for line in restored if line.startswith("-A ")) == \
+        sorted(forward("10.0.0.4", 20004)["nat"] + forward("10.0.0.4", 20004)["filter"])
+
+
+def test_per_client_chains_are_parsed():
+    client = {
+        "nat": [":PMD-10.0.0.2 - [0:0]", "-A PORTMASTER-DNAT -j PMD-10.0.0.2",
+                *(dnat("10.0.0.2", 20001, proto, chain="PMD-10.0.0.2") for proto in ("tcp", "udp"))],
+        "filter": [":PMF-10.0.0.2 - [0:0]", "-A PORTMASTER-FWD -d 10.0.0.2/32 -j PMF-10.0.0.2",
+                   *(f"-A PMF-10.0.0.2 -p {proto} -m {proto} --dport 20001 -j ACCEPT" for proto in ("tcp", "udp"))],
+    }
+    forwards, restored = parse(dump(client), per_client_chains=True)
+    assert forwards == {"10.0.0.2": {20001}}
+    assert restored == []
@@ -0,0 +1,49 @@
+# tests/test_legacy_daemon.py
+
+from typing import List, Optional
+
+from app import portmaster_daemon
+from app.system.commands import IPTablesError
+from app.system.simulate import SimulatedRuleset
+
+
+class SimulatedDaemonIPTables(portmaster_daemon.IPTablesManager):
+    """The legacy daemon's iptables wrapper with the kernel replaced by a SimulatedRuleset."""
+
+    def __init__(self):
+        self.ruleset = SimulatedRuleset()
+        self.restores = 0
+
+    def _run_command(self, command: List[str], input: Optional[str] = None):
+        try:
+            if command[0] == "iptables-restore":
+                self.restores += 1
+                self.ruleset.restore(input)
+                return ""
+            return self.ruleset.save(command[-1])
+        except IPTablesError as e:
+            raise portmaster_daemon.IPTablesError(str(e)) from e
+
+
+def own_rules(manager: SimulatedDaemonIPTables) -> List[str]:
+    return sorted(rule for table in ("nat", "filter") for rules in manager.ruleset.chains[table].values()
+                  for rule in rules)
+
+
+def test_batch_is_retried_without_rules_that_are_gone():
+    manager = SimulatedDaemonIPTables()
+    manager.apply_batch("10.0.0.2", {20000, 20001}, set())
+    assert len(own_rules(manager)) == 12
+    # The MASQUERADE rules of 20000 were removed by hand (or never written by an older version).
+    for rule in [rule for rule in manager.ruleset.chains["nat"]["POSTROUTING"] if "--dport 20000 " in rule]:
+        manager.ruleset.restore(f"*nat\n-D{rule[2:]}\nCOMMIT\n")
+
+    manager.apply_batch("10.0.0.2", {20002}, {20000})
+    assert manager.restores == 3  # The failed batch and its retry
+    assert own_rules(manager) == sorted(
+        f"-A {rule}" for port in (20001, 20002) for _, rule in manager._forward_rules("10.0.0.2", port)
+    )
+    # The next batch goes through in one call again.
+    manager.apply_batch("10.0.0.2", set(), {20001, 20002})
+    assert manager.restores == 4
+    assert own_rules(manager) == []
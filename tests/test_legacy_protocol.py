@@ -0,0 +1,24 @@
+# tests/test_legacy_protocol.py
+
+import asyncio
+
+from app.api.legacy import LegacyProtocolServer
+from app.services.intervals import PortPool
+from tests.simulated import simulated_service
+
+
+def test_ports_command_keeps_forwards_from_a_clients_sub_pool():
+    async def run():
+        service, _ = await simulated_service()
+        await service.create_client("alice", "20500-20509")
+        await service.update_client_ports("10.0.0.2", {20500}, PortPool.parse("20500-20509"), "alice")
+        server = LegacyProtocolServer(service, "127.0.0.1", 0, 1.0)
+
+        response = await server._process_ports("10.0.0.2", " 20000,20501")
+        assert service.forwarded_ports["10.0.0.2"] == {20000, 20500}
+        assert "Failed to forward ports 20501." in response
+
+        await server._process_ports("10.0.0.2", " 20001")
+        assert service.forwarded_ports["10.0.0.2"] == {20001, 20500}
+        await service.shutdown()
+    asyncio.run(run())
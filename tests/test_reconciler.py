@@ -0,0 +1,78 @@
+# tests/test_reconciler.py
+
+import asyncio
+
+import pytest
+
+from app.system.commands import IPTablesError
+from tests.simulated import POOL, connect, simulated_service
+
+SABOTAGE = {
+    "flushed PREROUTING": "*nat\n-F PREROUTING\nCOMMIT\n",
+    "flushed FORWARD": "*filter\n-F FORWARD\nCOMMIT\n",
+    "flushed DNAT chain": "*nat\n-F PORTMASTER-DNAT\nCOMMIT\n",
+    "deleted DNAT chain": "*nat\n-F PREROUTING\n-F PORTMASTER-DNAT\n-X PORTMASTER-DNAT\nCOMMIT\n",
+}
+
+
+@pytest.mark.parametrize("per_client_chains", [False, True])
+@pytest.mark.parametrize("sabotage", SABOTAGE)
+def test_reconcile_restores_chains_and_jumps(per_client_chains, sabotage):
+    async def run():
+        service, backend = await simulated_service(per_client_chains)
+        await connect(service, "10.0.0.2", "10.0.0.3")
+        await service.reconciler.reconcile_once()
+        healthy = {table: sorted(backend.ruleset.save(table).splitlines()) for table in ("nat", "filter")}
+
+        backend.ruleset.restore(SABOTAGE[sabotage])
+        assert await service.reconciler.reconcile_once() > 0
+        assert {table: sorted(backend.ruleset.save(table).splitlines()) for table in ("nat", "filter")} == healthy
+        assert await service.reconciler.reconcile_once() == 0
+        await service.shutdown()
+    asyncio.run(run())
+
+
+def test_reconcile_is_skipped_when_the_rules_cannot_be_read():
+    async def run():
+        service, backend = await simulated_service()
+        await connect(service, "10.0.0.2")
+        await service.reconciler.reconcile_once()
+        backend.ruleset.restore("*nat\n-F PMD-10.0.0.2\nCOMMIT\n")
+
+        async def unreadable():
+            raise IPTablesError("iptables-save failed")
+
+        async def must_not_apply(adds=None, removes=None):
+            raise AssertionError(f"applied {adds} / {removes} without reading the rules")
+
+        parse, apply = backend.parse_existing_rules, backend.apply_batch
+        backend.parse_existing_rules, backend.apply_batch = unreadable, must_not_apply
+        assert await service.reconciler.reconcile_once() == 0
+        backend.parse_existing_rules, backend.apply_batch = parse, apply
+        # The fingerprint was not recorded, so the next run repairs the drift.
+        assert await service.reconciler.reconcile_once() > 0
+        assert await backend.parse_existing_rules() == {"10.0.0.2": {20000, 20001}}
+        await service.shutdown()
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("per_client_chains", [False, True])
+def test_own_batches_do_not_trigger_a_full_pass(per_client_chains):
+    async def run():
+        service, backend = await simulated_service(per_client_chains)
+        await connect(service, "10.0.0.2")
+        await service.reconciler.reconcile_once()
+        runs = service.reconciler.runs
+
+        await connect(service, "10.0.0.3", "10.0.0.4")
+        await service.update_client_ports("10.0.0.2", {20005}, POOL)
+        await service.expire_client_ips(["10.0.0.3"])
+        assert await service.reconciler.reconcile_once() == 0
+        assert service.reconciler.runs == runs
+
+        # An outside change still does.
+        backend.ruleset.restore("*nat\n-F PREROUTING\nCOMMIT\n")
+        assert await service.reconciler.reconcile_once() > 0
+        assert service.reconciler.runs == runs + 1
+        await service.shutdown()
+    asyncio.run(run())
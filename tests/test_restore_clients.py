@@ -0,0 +1,22 @@
+# tests/test_restore_clients.py
+
+import asyncio
+
+from tests.simulated import simulated_service
+
+
+def test_stored_pools_are_clipped_to_the_exposed_range():
+    async def run():
+        service, _ = await simulated_service()
+        service._restore_clients([
+            ("inside", "key-inside", "20000-20099"),
+            ("straddling", "key-straddling", "20900-21099"),
+            ("outside", "key-outside", "30000-30099"),
+        ])
+        assert str(service.get_client_pool("inside")) == "20000-20099"
+        assert str(service.get_client_pool("straddling")) == "20900-20999"
+        assert service.clients["straddling"].allowed_port_ranges == ["20900-20999"]
+        assert "outside" not in service.clients
+        assert service.pool_index.owner_of(30000) is None
+        await service.shutdown()
+    asyncio.run(run())
@@ -0,0 +1,26 @@
+# tests/test_roaming.py
+
+import asyncio
+
+from app.services.intervals import PortPool
+from tests.simulated import simulated_service
+
+ALICE_POOL = PortPool.parse("20500-20509")
+
+
+async def alice_moves(**overrides):
+    service, _ = await simulated_service(**overrides)
+    await service.create_client("alice", str(ALICE_POOL))
+    await service.update_client_ports("10.0.0.2", {20500}, ALICE_POOL, "alice")
+    await service.update_client_ports("10.0.0.3", {20501}, ALICE_POOL, "alice")
+    forwards = {ip: set(ports) for ip, ports in service.forwarded_ports.items()}
+    await service.shutdown()
+    return forwards
+
+
+def test_devices_sharing_a_key_keep_their_forwards_by_default():
+    assert asyncio.run(alice_moves()) == {"10.0.0.2": {20500}, "10.0.0.3": {20501}}
+
+
+def test_roaming_moves_the_forwards_to_the_new_ip():
+    assert asyncio.run(alice_moves(roaming=True)) == {"10.0.0.3": {20501}}
@@ -0,0 +1,40 @@
+# tests/test_simulate.py
+
+import pytest
+
+from app.system.commands import IPTablesError
+from app.system.simulate import SimulatedRuleset
+
+DUMP = """*nat
+:PREROUTING ACCEPT [0:0]
+-A PREROUTING -p tcp -m tcp --dport 20000 -j DNAT --to-destination 10.0.0.2:20000
+COMMIT
+*filter
+:INPUT ACCEPT [0:0]
+:FORWARD DROP [0:0]
+-A INPUT -p tcp -m tcp --dport 22 -j ACCEPT
+""" + "".join(f"-A FORWARD -d 10.0.0.9/32 -p tcp -m tcp --dport {port} -j ACCEPT\n" for port in range(1, 11)) + """\
+-A FORWARD -d 10.0.0.2/32 -p tcp -m tcp --dport 20000 -j ACCEPT
+COMMIT
+"""
+
+
+def test_traversal_walks_forward_only_for_dnated_connections():
+    ruleset = SimulatedRuleset()
+    ruleset.load(DUMP)
+    # DNATed: one nat rule, then all of FORWARD down to the client's ACCEPT.
+    assert ruleset.traversal_depth(20000) == 1 + 11
+    # Not DNATed: the packet is for the host, so filter INPUT is walked instead of FORWARD.
+    assert ruleset.traversal_depth(20001) == 1 + 1
+
+
+def test_restore_commits_table_by_table():
+    ruleset = SimulatedRuleset()
+    ruleset.load(DUMP)
+    payload = ("*nat\n-A PREROUTING -p udp -m udp --dport 20000 -j DNAT --to-destination 10.0.0.2:20000\nCOMMIT\n"
+               "*filter\n-D FORWARD -d 10.0.0.3/32 -p udp -m udp --dport 20000 -j ACCEPT\nCOMMIT\n")
+    with pytest.raises(IPTablesError):
+        ruleset.restore(payload)
+    # The nat table was committed before the filter line failed.
+    assert len(ruleset.chains["nat"]["PREROUTING"]) == 2
+    assert len(ruleset.chains["filter"]["FORWARD"]) == 11
@@ -0,0 +1,52 @@
+# tests/test_sock_diag.py
+
+import socket
+import struct
+
+from app.system import sock_diag
+
+
+def run_bytecode(bytecode: bytes, sport: int) -> bool:
+    """The kernel's inet_diag_bc_run() for the source-port ops: accept if the program ends exactly at its end."""
+    remaining, offset = len(bytecode), 0
+    while remaining > 0:
+        code, yes, no = struct.unpack_from("=BBH", bytecode, offset)
+        if code == sock_diag.INET_DIAG_BC_S_GE:
+            matched = sport >= struct.unpack_from("=BBH", bytecode, offset + 4)[2]
+        elif code == sock_diag.INET_DIAG_BC_S_LE:
+            matched = sport <= struct.unpack_from("=BBH", bytecode, offset + 4)[2]
+        else:
+            raise AssertionError(f"Unexpected op {code} at {offset}")
+        step = yes if matched else no
+        remaining -= step
+        offset += step
+    return remaining == 0
+
+
+def test_port_range_bytecode_accepts_exactly_the_range():
+    bytecode = sock_diag._port_range_bytecode(20000, 25000)
+    assert len(bytecode) == 16
+    for port, accepted in ((0, False), (19999, False), (20000, True), (22222, True), (25000, True),
+                           (25001, False), (65535, False)):
+        assert run_bytecode(bytecode, port) is accepted, port
+
+
+def test_single_port_bytecode():
+    bytecode = sock_diag._port_range_bytecode(8080, 8080)
+    assert [run_bytecode(bytecode, port) for port in (8079, 8080, 8081)] == [False, True, False]
+
+
+def test_dump_request_layout():
+    bytecode = sock_diag._port_range_bytecode(20000, 25000)
+    request = sock_diag._dump_request(socket.AF_INET, socket.IPPROTO_TCP, 1 << sock_diag.TCP_LISTEN, bytecode, 7)
+    length, message_type, flags, sequence, pid = struct.unpack_from("=IHHII", request)
+    assert length == len(request)
+    assert message_type == sock_diag.SOCK_DIAG_BY_FAMILY
+    assert flags == sock_diag.NLM_F_REQUEST | sock_diag.NLM_F_DUMP
+    assert (sequence, pid) == (7, 0)
+    family, protocol, ext, states = struct.unpack_from("=BBBxI", request, 16)
+    assert (family, protocol, ext, states) == (socket.AF_INET, socket.IPPROTO_TCP, 0, 1 << sock_diag.TCP_LISTEN)
+    attribute_length, attribute_type = struct.unpack_from("=HH", request, 16 + 56)
+    assert attribute_type == sock_diag.INET_DIAG_REQ_BYTECODE
+    assert attribute_length == 4 + len(bytecode)
+    assert request[16 + 56 + 4:] == bytecode
@@ -0,0 +1,87 @@
+# tests/test_store.py
+
+import asyncio
+import sqlite3
+
+from app.services.store import StateStore, hash_api_key
+from tests.simulated import POOL, simulated_service
+
+
+def test_plaintext_keys_of_older_databases_are_hashed(tmp_path):
+    path = str(tmp_path / "portmaster.db")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE clients (client_id TEXT PRIMARY KEY, api_key TEXT NOT NULL UNIQUE, port_ranges TEXT NOT NULL);
+        INSERT INTO clients VALUES ('alice', 'alice-key', '20000-20099');
+    """)
+    connection.commit()
+    connection.close()
+
+    async def run():
+        store = StateStore(path)
+        clients, _ = await store.load()
+        await store.close()
+        reopened = StateStore(path)
+        clients_again, _ = await reopened.load()
+        await reopened.close()
+        return clients, clients_again
+
+    clients, clients_again = asyncio.run(run())
+    assert clients == clients_again == [("alice", hash_api_key("alice-key"), "20000-20099")]
+
+
+def test_created_keys_are_stored_hashed(tmp_path):
+    async def run():
+        service, _ = await simulated_service(state_db=str(tmp_path / "portmaster.db"))
+        created = await service.create_client("bob", "20100-20199")
+        assert service.get_client_by_key(created.api_key).client_id == "bob"
+        assert service.get_client_by_key(hash_api_key(created.api_key)) is None
+        assert service.clients["bob"].api_key == hash_api_key(created.api_key)
+        assert service.store._connection.execute("SELECT api_key FROM clients").fetchall() == \
+            [(hash_api_key(created.api_key),)]
+        await service.shutdown()
+    asyncio.run(run())
+
+
+def test_simulation_does_not_touch_the_state_database(tmp_path):
+    path = tmp_path / "portmaster.db"
+
+    async def run():
+        service, _ = await simulated_service(state_db=str(path))
+        await service.create_client("carol", "20200-20299")
+        await service.shutdown()
+    asyncio.run(run())
+    assert not path.exists()
+
+
+def test_forwards_are_journaled_before_the_request_is_answered(tmp_path):
+    async def run():
+        service, _ = await simulated_service(state_db=str(tmp_path / "portmaster.db"))
+        await service.update_client_ports("10.0.0.2", {20000, 20001}, POOL)
+        assert not service.store._pending
+        assert sorted(service.store._connection.execute("SELECT port, client_ip FROM forwards")) == \
+            [(20000, "10.0.0.2"), (20001, "10.0.0.2")]
+        await service.shutdown()
+    asyncio.run(run())
+
+
+def test_failed_load_leaves_the_database_unchanged(tmp_path):
+    path = str(tmp_path / "portmaster.db")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE clients (client_id TEXT PRIMARY KEY, api_key TEXT NOT NULL UNIQUE, port_ranges TEXT NOT NULL);
+        INSERT INTO clients VALUES ('alice', 'alice-key', '20000-20099');
+        CREATE TABLE forwards (port INTEGER PRIMARY KEY);
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        INSERT INTO meta VALUES ('forwards_journaled', '1');
+    """)
+    connection.commit()
+
+    async def run():
+        store = StateStore(path)
+        assert await store.load() == ([], None)
+    asyncio.run(run())
+    # The key migration ran before the journal failed to load, and was rolled back with it.
+    assert connection.execute("SELECT api_key FROM clients").fetchall() == [("alice-key",)]
+    assert connection.execute("SELECT key FROM meta").fetchall() == [("forwards_journaled",)]
+    connection.close()
@@ -0,0 +1,63 @@
+# tests/test_timer_wheel.py
+
+import pytest
+
+from app.services import leases
+from app.services.leases import TimerWheel
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(leases.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_keys_expire_on_their_tick(clock):
+    wheel = TimerWheel(tick=1.0, max_timeout=10.0)
+    wheel.schedule("10.0.0.2", 3.0)
+    wheel.schedule("10.0.0.3", 5.0)
+    clock[0] += 2.0
+    assert wheel.advance() == []
+    clock[0] += 1.0
+    assert wheel.advance() == ["10.0.0.2"]
+    assert "10.0.0.2" not in wheel and "10.0.0.3" in wheel
+    clock[0] += 2.0
+    assert wheel.advance() == ["10.0.0.3"]
+    assert len(wheel) == 0
+
+
+def test_reschedule_and_cancel(clock):
+    wheel = TimerWheel(tick=1.0, max_timeout=10.0)
+    wheel.schedule("10.0.0.2", 2.0)
+    wheel.schedule("10.0.0.3", 2.0)
+    clock[0] += 1.0
+    wheel.advance()
+    wheel.schedule("10.0.0.2", 5.0)  # Renewed lease
+    wheel.cancel("10.0.0.3")
+    clock[0] += 1.0
+    assert wheel.advance() == []
+    clock[0] += 4.0
+    assert wheel.advance() == ["10.0.0.2"]
+
+
+def test_timeouts_are_rounded_up_and_capped(clock):
+    wheel = TimerWheel(tick=1.0, max_timeout=4.0)
+    wheel.schedule("short", 0.1)
+    wheel.schedule("long", 100.0)
+    clock[0] += 1.0
+    assert wheel.advance() == ["short"]
+    clock[0] += 10.0
+    assert wheel.advance() == ["long"]
+
+
+def test_a_long_stall_expires_everything_once(clock):
+    wheel = TimerWheel(tick=1.0, max_timeout=3.0)
+    for i in range(3):
+        wheel.schedule(f"10.0.0.{i}", i + 1.0)
+    clock[0] += 1000.0
+    assert sorted(wheel.advance()) == ["10.0.0.0", "10.0.0.1", "10.0.0.2"]
+    assert wheel.advance() == []
+    wheel.schedule("10.0.0.9", 1.0)
+    clock[0] += 1.0
+    assert wheel.advance() == ["10.0.0.9"]